@@ -0,0 +1,77 @@
+"""
+Precompute the pattern databases used as A* heuristics by WorkoutPlanGenerator.
+
+Builds one table per fixed split, training days (2-7) and weekly set target for the
+built-in exercise database, and writes them to PatternDatabase.directory (or the
+directory given on the command line). The planner loads them lazily at run time and
+only builds missing tables in memory. Afterwards every split and training day count is
+planned once with the tables, and the script fails if a plan came from the rule-based
+fallback instead of the search.
+
+Usage: python build_pattern_databases.py [output_dir]
+"""
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+from fitai_core import KnowledgeBase, PatternDatabase, UserProfile, WorkoutPlanGenerator, \
+    _initialize_expanded_exercise_database
+
+FIXED_SPLITS = ("full_body", "ppl", "upper_lower", "ppl_ul", "ppl_2x")
+GOALS = ("muscle gain", "athletic", "health", "maintenance")
+
+
+def main():
+    if len(sys.argv) > 1:
+        PatternDatabase.directory = sys.argv[1]
+
+    kb = KnowledgeBase()
+    _initialize_expanded_exercise_database(SimpleNamespace(kb=kb))
+
+    written = 0
+    start = time.perf_counter()
+    for goal in GOALS:
+        user = UserProfile(30, 5, 10, 170, "male", "moderate", [goal], [])
+        generator = WorkoutPlanGenerator(kb.exercises, user)
+        for split_type in FIXED_SPLITS:
+            for days_per_week in range(2, 8):
+                target = generator._target_sets_per_group(user.goals, days_per_week)
+                schedule = [generator._template_profile(generator._day_options(split_type, day)[0][1])
+                            for day in range(days_per_week)]
+                path = PatternDatabase.path_for(target, schedule)
+                if os.path.exists(path):
+                    continue
+
+                pattern_database = PatternDatabase.build(target, schedule)
+                if pattern_database is None:
+                    sys.exit("numpy is required to build pattern databases")
+                pattern_database.save(path)
+                written += 1
+
+    print(f"Wrote {written} pattern databases to {PatternDatabase.directory} "
+          f"in {time.perf_counter() - start:.2f}s")
+
+    failures = check_searched_plans(kb)
+    if failures:
+        sys.exit("Fell back to the rule-based plan for: " + ", ".join(failures))
+
+
+def check_searched_plans(kb):
+    """Return the (goal, split, days) combinations whose A* or beam plan used the fallback"""
+    failures = []
+    for goal in GOALS:
+        user = UserProfile(30, 5, 10, 170, "male", "moderate", [goal], [])
+        generator = WorkoutPlanGenerator(kb.exercises, user)
+        for split_type in FIXED_SPLITS:
+            for days_per_week in range(2, 8):
+                for beam_width in (None, 8):
+                    plan = generator.generate_workout_plan(days_per_week, split_type, beam_width=beam_width)
+                    if plan.used_fallback:
+                        failures.append(f"{goal}/{split_type}/{days_per_week} days"
+                                        + (f"/beam {beam_width}" if beam_width else ""))
+    return failures
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""Pytest configuration: the modules live at the repository root, which this file puts on sys.path"""
@@ -0,0 +1,211 @@
+"""
+Batch plan generation for many user profiles over a process pool.
+
+Every worker process loads the built-in knowledge base and builds its indexes once (see
+_initialize_worker); profiles are then sent to the workers in chunks and the plans are
+streamed back, in input order or as they complete. A failure while planning one profile
+is reported on that item's BatchResult and does not affect the rest of the batch.
+
+    for result in generate_workout_plans(profiles, max_workers=8, days_per_week=4):
+        if result.error is None:
+            save(result.profile, result.plan)
+
+Meal plan batches (generate_meal_plans) chunk profiles by restriction combination, so each
+worker builds a filtered food view once and reuses it for the whole chunk.
+"""
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+
+from fitai_core import ExerciseIndex, FoodIndex, MealPlanCSP, PatternDatabase, WorkoutPlanGenerator, \
+    load_default_knowledge_base, restriction_mask
+
+# Knowledge base of the current worker process, set by _initialize_worker
+_worker_kb = None
+
+
+class BatchResult:
+    """The outcome for one input item: the plan, or the error message if planning failed"""
+
+    __slots__ = ('index', 'profile', 'plan', 'error')
+
+    def __init__(self, index, profile, plan=None, error=None):
+        self.index = index  # Position of the item in the input
+        self.profile = profile
+        self.plan = plan
+        self.error = error  # "ExceptionType: message", None on success
+
+    def __repr__(self):
+        status = "error={!r}".format(self.error) if self.error is not None else "ok"
+        return "BatchResult(index={}, {})".format(self.index, status)
+
+
+def _initialize_worker(pattern_database_dir=None):
+    """Load the knowledge base and build the indexes once per worker process"""
+    global _worker_kb
+    if pattern_database_dir is not None:
+        PatternDatabase.directory = pattern_database_dir
+    _worker_kb = load_default_knowledge_base()
+    ExerciseIndex.for_database(_worker_kb.exercises)
+    FoodIndex.for_database(_worker_kb.foods)
+
+
+def worker_knowledge_base():
+    """Return the knowledge base of this worker process, loading it on first use"""
+    if _worker_kb is None:
+        _initialize_worker()
+    return _worker_kb
+
+
+def _workout_plan(kb, profile, settings):
+    return WorkoutPlanGenerator(kb.exercises, profile).generate_workout_plan(**settings)
+
+
+def _meal_plan(kb, profile, settings):
+    return MealPlanCSP(kb.foods, profile).generate_meal_plan(**settings)
+
+
+def _restriction_group(profile):
+    return restriction_mask(profile.restrictions)
+
+
+def _run_chunk(task, chunk):
+    """Run task(kb, profile, settings) for every (index, profile, settings) of the chunk"""
+    kb = worker_knowledge_base()
+    results = []
+    for index, profile, settings in chunk:
+        try:
+            results.append((index, task(kb, profile, settings), None))
+        except Exception as exc:
+            results.append((index, None, f"{type(exc).__name__}: {exc}"))
+    return results
+
+
+class _InlineExecutor:
+    """Runs submitted calls immediately in this process (max_workers=0)"""
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+def create_worker_pool(max_workers=None, pattern_database_dir=None):
+    """Return a ProcessPoolExecutor whose workers are initialized for plan generation"""
+    return ProcessPoolExecutor(max_workers=max_workers, initializer=_initialize_worker,
+                               initargs=(pattern_database_dir,))
+
+
+def _chunks(items, chunk_size, settings, group_key=None, window=None):
+    """
+    Split the input into lists of (index, profile, settings); items are profiles or (profile, settings).
+    With a group_key, profiles are read window items at a time and chunked by their key.
+    """
+    groups = {}  # group key -> pending chunk
+    buffered = 0
+    for index, item in enumerate(items):
+        if isinstance(item, tuple):
+            profile, item_settings = item
+            item_settings = {**settings, **item_settings}
+        else:
+            profile, item_settings = item, settings
+        key = group_key(profile) if group_key else None
+        chunk = groups.setdefault(key, [])
+        chunk.append((index, profile, item_settings))
+        buffered += 1
+        if len(chunk) >= chunk_size:
+            buffered -= len(chunk)
+            del groups[key]
+            yield chunk
+        if group_key and buffered >= window:
+            # Flush the partial chunks so ordered results are not held back indefinitely
+            yield from groups.values()
+            groups.clear()
+            buffered = 0
+    yield from groups.values()
+
+
+def _run_batch(task, items, max_workers, executor, chunk_size, ordered, max_pending, settings, group_key=None):
+    if max_pending is None:
+        max_pending = 2 * (max_workers or os.cpu_count() or 1)
+    chunks = _chunks(items, chunk_size, settings, group_key, chunk_size * max_pending)
+
+    own_executor = executor is None
+    if own_executor:
+        # max_workers=0 runs in this process, e.g. for debugging or where worker processes are not available
+        executor = _InlineExecutor() if max_workers == 0 else create_worker_pool(max_workers)
+
+    pending = {}  # future -> chunk
+    finished = {}  # index -> result not yet yielded (ordered mode)
+    next_index = 0
+    try:
+        exhausted = False
+        while True:
+            # Keep at most max_pending chunks in flight so huge inputs are not materialized
+            while not exhausted and len(pending) < max_pending:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                else:
+                    pending[executor.submit(_run_chunk, task, chunk)] = chunk
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                chunk = pending.pop(future)
+                profiles = {index: profile for index, profile, _ in chunk}
+                try:
+                    outcomes = future.result()
+                except Exception as exc:  # The worker died or a result could not be transferred
+                    error = f"{type(exc).__name__}: {exc}"
+                    outcomes = [(index, None, error) for index, _, _ in chunk]
+                results = [BatchResult(index, profiles[index], plan, error) for index, plan, error in outcomes]
+                if ordered:
+                    finished.update((result.index, result) for result in results)
+                else:
+                    yield from results
+
+            while next_index in finished:
+                yield finished.pop(next_index)
+                next_index += 1
+    finally:
+        for future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def generate_workout_plans(items, max_workers=None, executor=None, chunk_size=8, ordered=True, max_pending=None,
+                           **settings):
+    """
+    Generate a workout plan for every item, yielding a BatchResult per item.
+
+    Items are UserProfiles, or (profile, settings) pairs whose settings dict overrides the
+    shared keyword settings passed on to WorkoutPlanGenerator.generate_workout_plan. Work is
+    spread over max_workers processes (os.cpu_count() by default; 0 runs in this process) or
+    over the given executor (see create_worker_pool), which is left running. Results come in
+    input order, or as they complete if ordered is False; at most max_pending chunks of
+    chunk_size items are in flight at a time.
+    """
+    return _run_batch(_workout_plan, items, max_workers, executor, chunk_size, ordered, max_pending, settings)
+
+
+def generate_meal_plans(items, meals_per_day=4, max_workers=None, executor=None, chunk_size=32, ordered=True,
+                        max_pending=None, **settings):
+    """
+    Generate a meal plan for every item, yielding a BatchResult per item.
+
+    Items and the pool options are as for generate_workout_plans; the remaining keyword settings
+    are passed on to MealPlanCSP.generate_meal_plan. Profiles are chunked by restriction
+    combination (within a read-ahead window of chunk_size * max_pending items), so every chunk
+    reuses one shared food view in its worker.
+    """
+    settings['meals_per_day'] = meals_per_day
+    return _run_batch(_meal_plan, items, max_workers, executor, chunk_size, ordered, max_pending, settings,
+                      group_key=_restriction_group)
@@ -0,0 +1,204 @@
+"""
+Result caching and request coalescing in front of plan generation.
+
+Plans are cached under a canonical key: the inputs that actually change the plan, plus the
+content signature of the food or exercise database (see fitai_core.database_signature). The
+signature is computed once per database index, so building a key does not rehash the database;
+after editing a database in place call KnowledgeBase.invalidate and it gets new keys. For
+workouts these inputs are the weekly set target derived from the goal, the training days, the
+split and the search settings. For meals they are the restriction mask, the meal count, the
+settings, and the daily macro bounds the engine plans from (the calorie maximum and macro
+minimums, or every bound for the CSP engine), bucketed to CALORIE_STEP / GRAM_STEP so
+profiles whose constraints are that close share a plan.
+
+PlanCache evicts least recently used entries beyond max_entries and entries older than
+ttl seconds. Concurrent requests for a key that is being computed wait for that single
+computation instead of starting their own. With variety=k, up to k different plans are
+generated per key and hits return one of them at random. Cached plans are shared between
+callers, who must not modify them.
+
+    planner = CachedPlanner(load_default_knowledge_base())
+    plan = planner.meal_plan(profile, meals_per_day=4, portions=True)
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from fitai_core import NUTRIENTS, ExerciseIndex, FoodIndex, MealPlanCSP, WorkoutPlanGenerator, restriction_mask
+
+# Resolution of the bucketed macro bounds in meal plan keys
+CALORIE_STEP = 50
+GRAM_STEP = 5
+
+
+def _settings_key(settings):
+    return tuple(sorted(settings.items()))
+
+
+def workout_key(exercises, profile, days_per_week=4, **settings):
+    """Cache key of WorkoutPlanGenerator(exercises, profile).generate_workout_plan(days_per_week, **settings)"""
+    days_per_week = max(2, min(7, days_per_week))  # As generate_workout_plan clamps it
+    split_type = settings.pop('split_type', None) or WorkoutPlanGenerator._determine_split_type(days_per_week)
+    return ('workout', ExerciseIndex.for_database(exercises).signature, days_per_week, split_type,
+            WorkoutPlanGenerator._target_sets_per_group(profile.goals, days_per_week), _settings_key(settings))
+
+
+def meal_key(foods, profile, meals_per_day=4, calorie_step=CALORIE_STEP, gram_step=GRAM_STEP, **settings):
+    """Cache key of MealPlanCSP(foods, profile).generate_meal_plan(meals_per_day, **settings)"""
+    bounds = []
+    for nutrient, (low, high) in zip(NUTRIENTS, profile.macro_bounds()):
+        step = calorie_step if nutrient == 'calories' else gram_step
+        if settings.get('engine') == "csp":
+            bounds += (round(low / step), round(high / step))
+        else:
+            # The daily targets of MealPlanCSP._meal_targets
+            bounds.append(round((high if nutrient == 'calories' else low) / step))
+    return ('meal', FoodIndex.for_database(foods).signature, restriction_mask(profile.restrictions), meals_per_day,
+            tuple(bounds), _settings_key(settings))
+
+
+def _consume_exception(future):
+    if not future.cancelled():
+        future.exception()
+
+
+class PlanCache:
+    """Thread-safe LRU/TTL plan cache that coalesces concurrent computations of the same key"""
+
+    def __init__(self, max_entries=10000, ttl=3600.0, variety=1, seed=None):
+        self.max_entries = max_entries
+        self.ttl = ttl  # Seconds an entry stays valid, None for no expiry
+        self.variety = variety  # Plans kept (and generated) per key; hits pick one at random
+        self._entries = OrderedDict()  # key -> (expiry time, [plans]), least recently used first
+        self._in_flight = {}  # key -> Future of the computation running for it
+        self._tasks = set()  # Running async computations (kept referenced until done)
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0  # Requests that waited for another request's computation
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                'coalesced': self.coalesced, 'evictions': self.evictions, 'expirations': self.expirations}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _claim(self, key):
+        """Return ('hit', plan), ('wait', future) or ('compute', future) for a request"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is not None and len(entry[1]) >= self.variety:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                plans = entry[1]
+                return 'hit', plans[0] if len(plans) == 1 else self._random.choice(plans)
+
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return 'wait', future
+            future = self._in_flight[key] = Future()
+            self.misses += 1
+            return 'compute', future
+
+    def _finish(self, key, future, plan=None, error=None):
+        """Store a computed plan (unless it failed) and wake up the waiting requests"""
+        with self._lock:
+            del self._in_flight[key]
+            if error is None:
+                entry = self._entries.get(key)
+                if entry is None:
+                    expires = time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+                    entry = self._entries[key] = (expires, [])
+                entry[1].append(plan)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        if error is None:
+            future.set_result(plan)
+        elif isinstance(error, Exception):
+            future.set_exception(error)
+        else:
+            # Cancelled (e.g. on shutdown): waiters see a cancellation, and there is no
+            # exception left on the future for asyncio to report as never retrieved
+            future.cancel()
+
+    def get(self, key, compute):
+        """Return the plan for key, calling compute() if it is not cached or being computed"""
+        state, value = self._claim(key)
+        if state == 'hit':
+            return value
+        if state == 'wait':
+            return value.result()
+        try:
+            plan = compute()
+        except BaseException as exc:
+            self._finish(key, value, error=exc)
+            raise
+        self._finish(key, value, plan)
+        return plan
+
+    async def get_async(self, key, compute):
+        """
+        Like get, for a coroutine function compute. The computation runs in its own task, so
+        a caller that is cancelled (e.g. on timeout) does not cancel it for the other callers.
+        """
+        state, value = self._claim(key)
+        if state == 'hit':
+            return value
+        if state == 'compute':
+            task = asyncio.ensure_future(self._compute_async(key, value, compute))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        waiter = asyncio.wrap_future(value)
+        # If this caller times out first, nobody awaits the waiter: mark a failure as seen
+        waiter.add_done_callback(_consume_exception)
+        return await asyncio.shield(waiter)
+
+    async def _compute_async(self, key, future, compute):
+        try:
+            plan = await compute()
+        except BaseException as exc:
+            self._finish(key, future, error=exc)
+            if not isinstance(exc, Exception):
+                raise
+        else:
+            self._finish(key, future, plan)
+
+
+class CachedPlanner:
+    """Workout and meal plan generation for a knowledge base behind a PlanCache"""
+
+    def __init__(self, kb, cache=None, calorie_step=CALORIE_STEP, gram_step=GRAM_STEP):
+        self.kb = kb
+        self.cache = cache if cache is not None else PlanCache()
+        self.calorie_step = calorie_step
+        self.gram_step = gram_step
+
+    def workout_plan(self, profile, days_per_week=4, **settings):
+        """Cached WorkoutPlanGenerator.generate_workout_plan"""
+        key = workout_key(self.kb.exercises, profile, days_per_week, **settings)
+        return self.cache.get(key, lambda: WorkoutPlanGenerator(self.kb.exercises, profile).generate_workout_plan(
+            days_per_week=days_per_week, **settings))
+
+    def meal_plan(self, profile, meals_per_day=4, **settings):
+        """Cached MealPlanCSP.generate_meal_plan"""
+        key = meal_key(self.kb.foods, profile, meals_per_day, self.calorie_step, self.gram_step, **settings)
+        return self.cache.get(key, lambda: MealPlanCSP(self.kb.foods, profile).generate_meal_plan(
+            meals_per_day=meals_per_day, **settings))
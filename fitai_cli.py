@@ -0,0 +1,240 @@
+"""
+Headless batch generation of workout and meal plans (no Qt required).
+
+Reads profile records from JSONL or CSV (a file, or stdin) and writes one JSON line per
+record as soon as its plans are ready, in input order. Records are streamed through the
+batch workers (see fitai_batch), so memory use does not grow with the input size.
+
+Record fields: age, height_ft, height_in, weight_lbs, gender, activity_level, goals,
+restrictions, and optionally id, days_per_week and meals_per_day. In CSV files goals and
+restrictions are separated by semicolons; in JSONL they may be lists or such strings.
+
+Usage: python fitai_cli.py [input] [-o output] [--workers N] [--days N] [--meals N]
+"""
+import argparse
+import csv
+import itertools
+import json
+import math
+import sys
+import time
+
+from fitai_batch import create_worker_pool, generate_meal_plans, generate_workout_plans
+from fitai_core import ACTIVITY_FACTORS, NUTRIENTS, UserProfile, load_default_knowledge_base
+
+# Accepted days_per_week and meals_per_day where a caller bounds them (see parse_count)
+DAYS_PER_WEEK_RANGE = (2, 7)
+MEALS_PER_DAY_RANGE = (1, 8)
+
+PROFILE_FIELDS = ('age', 'height_ft', 'height_in', 'weight_lbs', 'gender', 'activity_level', 'goals', 'restrictions')
+
+
+def read_records(stream, input_format):
+    """Yield (line number, record dict or None, error) for every record of the input"""
+    if input_format == "csv":
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record, None
+        return
+
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            yield line_number, None, f"Invalid JSON: {exc}"
+            continue
+        if not isinstance(record, dict):
+            yield line_number, None, "Invalid record: expected a JSON object"
+        else:
+            yield line_number, record, None
+
+
+def _number(value):
+    """A numeric field given as a number or a numeric string (ValueError for anything else)"""
+    if isinstance(value, str):
+        value = float(value)
+    elif isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"Expected a number, got {value!r}")
+    if not math.isfinite(value):
+        raise ValueError(f"Expected a finite number, got {value!r}")
+    return int(value) if isinstance(value, float) and value.is_integer() else value
+
+
+def _names(value):
+    """Goals or restrictions given as a list or a semicolon-separated string"""
+    if value is None:
+        return ()
+    if isinstance(value, str):
+        return tuple(name.strip().lower() for name in value.split(";") if name.strip())
+    return tuple(name.lower() for name in value)
+
+
+def parse_profile(record):
+    """Return the UserProfile of a record (ValueError if a field is missing or malformed)"""
+    missing = [field for field in PROFILE_FIELDS[:6] if record.get(field) in (None, "")]
+    if missing:
+        raise ValueError("Missing field(s): " + ", ".join(missing))
+    if str(record['activity_level']).lower() not in ACTIVITY_FACTORS:
+        raise ValueError(f"Unknown activity level: {record['activity_level']}")
+    try:
+        age, height_ft, height_in, weight_lbs = (_number(record[field]) for field in PROFILE_FIELDS[:4])
+    except ValueError as exc:
+        raise ValueError(f"Malformed profile: {exc}") from exc
+    try:
+        return UserProfile(age, height_ft, height_in, weight_lbs, record['gender'].lower(),
+                           record['activity_level'].lower(), _names(record.get('goals')),
+                           _names(record.get('restrictions')))
+    except (TypeError, AttributeError, ValueError) as exc:
+        raise ValueError(f"Malformed profile: {exc}") from exc
+
+
+def parse_count(record, field, default, valid_range=None):
+    """
+    Whole-number setting of a record such as days_per_week, default if absent or empty (ValueError
+    if malformed, or outside valid_range, an inclusive (low, high) pair, when given); an explicit
+    0 is a value, not a missing field
+    """
+    value = record.get(field)
+    try:
+        value = int(_number(default if value in (None, "") else value))
+    except ValueError as exc:
+        raise ValueError(f"Malformed {field}: {exc}") from exc
+    if valid_range is not None and not valid_range[0] <= value <= valid_range[1]:
+        raise ValueError(f"{field} must be between {valid_range[0]} and {valid_range[1]}, got {value}")
+    return value
+
+
+def profile_summary(profile):
+    """BMR and TDEE of a profile, rounded for output"""
+    return {'bmr': round(profile.calculate_bmr(), 1), 'tdee': round(profile.calculate_tdee(), 1)}
+
+
+def _parse_records(records, default_days, default_meals):
+    """Yield (record id, profile, summary, workout settings, meal settings, error) for every record"""
+    for line_number, record, error in records:
+        record_id = record.get('id', line_number) if record else line_number
+        profile = summary = workout_settings = meal_settings = None
+        if error is None:
+            try:
+                profile = parse_profile(record)
+                summary = profile_summary(profile)
+                workout_settings = {'days_per_week': parse_count(record, 'days_per_week', default_days,
+                                                                 DAYS_PER_WEEK_RANGE)}
+                meal_settings = {'meals_per_day': parse_count(record, 'meals_per_day', default_meals,
+                                                              MEALS_PER_DAY_RANGE)}
+            except (TypeError, ValueError) as exc:
+                profile = None
+                error = str(exc)
+        yield record_id, profile, summary, workout_settings, meal_settings, error
+
+
+def workout_plan_json(plan):
+    days = []
+    for day_name, workout in plan:
+        exercises = []
+        for exercise in workout:
+            if isinstance(exercise, tuple) and len(exercise) == 3:
+                exercise_name, sets, rep_range = exercise
+            else:
+                exercise_name, sets, rep_range = exercise, 3, "8-12"  # Same defaults as the app
+            exercises.append({'exercise': exercise_name, 'sets': sets, 'reps': rep_range})
+        days.append({'day': day_name, 'exercises': exercises})
+    return days
+
+
+def meal_plan_json(plan, foods):
+    meals = []
+    for meal_name, meal_foods in plan:
+        servings = getattr(meal_foods, 'servings', None) or {food_name: 1 for food_name in meal_foods}
+        totals = {nutrient: round(sum(foods[food_name][nutrient] * servings[food_name] for food_name in meal_foods), 1)
+                  for nutrient in NUTRIENTS}
+        meals.append({'meal': meal_name,
+                      'foods': [{'food': food_name, 'servings': servings[food_name]} for food_name in meal_foods],
+                      'totals': totals})
+    return meals
+
+
+def generate(records, output, workers=None, days=4, meals=4, workout=True, meal=True):
+    """Write one JSON line per record to output; returns (records written, records with errors)"""
+    foods = load_default_knowledge_base().foods
+    parsed, workout_items, meal_items = itertools.tee(_parse_records(records, days, meals), 3)
+
+    executor = create_worker_pool(workers) if workers != 0 else None
+    pool_options = {'max_workers': workers, 'executor': executor}
+    try:
+        workout_results = generate_workout_plans(
+            ((profile, settings) for _, profile, _, settings, _, error in workout_items if error is None),
+            **pool_options) if workout else None
+        meal_results = generate_meal_plans(
+            ((profile, settings) for _, profile, _, _, settings, error in meal_items if error is None),
+            portions=True, **pool_options) if meal else None
+
+        written = failed = 0
+        for record_id, _, summary, _, _, error in parsed:
+            result = {'id': record_id}
+            if error is not None:
+                result['error'] = error
+            else:
+                result.update(summary)
+                if workout_results is not None:
+                    workout_result = next(workout_results)
+                    if workout_result.error is None:
+                        result['workout_plan'] = workout_plan_json(workout_result.plan)
+                    else:
+                        result['workout_error'] = error = workout_result.error
+                if meal_results is not None:
+                    meal_result = next(meal_results)
+                    if meal_result.error is None:
+                        result['meal_plan'] = meal_plan_json(meal_result.plan, foods)
+                    else:
+                        result['meal_error'] = error = meal_result.error
+
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+            written += 1
+            failed += error is not None
+        return written, failed
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate workout and meal plans for a stream of profiles.")
+    parser.add_argument("input", nargs="?", default="-", help="JSONL or CSV file of profiles (default: stdin)")
+    parser.add_argument("-o", "--output", default="-", help="JSONL output file (default: stdout)")
+    parser.add_argument("--format", choices=("jsonl", "csv"),
+                        help="input format (default: from the file extension, else jsonl)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes (default: one per CPU; 0 runs in this process)")
+    parser.add_argument("--days", type=int, default=4, help="default workout days per week")
+    parser.add_argument("--meals", type=int, default=4, help="default meals per day")
+    parser.add_argument("--only", choices=("workout", "meal"), help="generate only one kind of plan")
+    args = parser.parse_args(argv)
+    for option, value, (low, high) in (("--days", args.days, DAYS_PER_WEEK_RANGE),
+                                       ("--meals", args.meals, MEALS_PER_DAY_RANGE)):
+        if not low <= value <= high:
+            parser.error(f"{option} must be between {low} and {high}")
+
+    input_format = args.format or ("csv" if args.input.lower().endswith(".csv") else "jsonl")
+    source = sys.stdin if args.input == "-" else open(args.input, newline="")
+    output = sys.stdout if args.output == "-" else open(args.output, "w")
+    start = time.perf_counter()
+    try:
+        written, failed = generate(read_records(source, input_format), output, workers=args.workers,
+                                   days=args.days, meals=args.meals, workout=args.only != "meal",
+                                   meal=args.only != "workout")
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+
+    print(f"Wrote {written} records ({failed} with errors) in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
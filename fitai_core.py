@@ -1,15 +1,94 @@
+import hashlib
+import heapq
+import itertools
+import math
+import os
+import sys
+import time
+from array import array
+from collections import OrderedDict
+from types import SimpleNamespace
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed to build pattern databases and score candidate meals
+    np = None
+
+
+ACTIVITY_FACTORS = {
+    'sedentary': 1.2,
+    'light': 1.375,
+    'moderate': 1.55,
+    'active': 1.725,
+    'very active': 1.9
+}
+
+
+def _as_tuple(values):
+    """Return goals or restrictions as a tuple; a single string is one entry, not a sequence of letters"""
+    return (values,) if isinstance(values, str) else tuple(values)
+
+
 class UserProfile:
+    """
+    Immutable, hashable user profile (usable as a cache key). Goals and restrictions are stored
+    as tuples (a single string becomes a one-entry tuple); metric conversions, BMR, TDEE and the macro bounds are computed on first use and
+    kept in slots.
+    """
+
+    __slots__ = ('age', 'height_ft', 'height_in', 'weight_lbs', 'gender', 'activity_level', 'goals',
+                 'restrictions', '_metric', '_bmr', '_tdee', '_macro_bounds', '_hash')
+
     def __init__(self, age, height_ft, height_in, weight_lbs, gender, activity_level, goals, restrictions):
-        self.age = age
-        self.height_ft = height_ft
-        self.height_in = height_in
-        self.weight_lbs = weight_lbs
-        self.gender = gender
-        self.activity_level = activity_level  # sedentary, light, moderate, active, very active
-        self.goals = goals  # weight loss, muscle gain, maintenance, athletic, health
-        self.restrictions = restrictions  # dietary restrictions
+        initialize = object.__setattr__
+        initialize(self, 'age', age)
+        initialize(self, 'height_ft', height_ft)
+        initialize(self, 'height_in', height_in)
+        initialize(self, 'weight_lbs', weight_lbs)
+        initialize(self, 'gender', gender)
+        initialize(self, 'activity_level', activity_level)  # sedentary, light, moderate, active, very active
+        initialize(self, 'goals', _as_tuple(goals))  # weight loss, muscle gain, maintenance, athletic, health
+        initialize(self, 'restrictions', _as_tuple(restrictions))  # dietary restrictions
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"UserProfile is immutable (cannot set {name!r})")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"UserProfile is immutable (cannot delete {name!r})")
+
+    def _fields(self):
+        return (self.age, self.height_ft, self.height_in, self.weight_lbs, self.gender, self.activity_level,
+                self.goals, self.restrictions)
+
+    def __eq__(self, other):
+        if not isinstance(other, UserProfile):
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    def __hash__(self):
+        return self._memo('_hash', lambda: hash(self._fields()))
+
+    def __reduce__(self):
+        # Pickle the fields only; cached values are recomputed on demand
+        return UserProfile, self._fields()
+
+    def __repr__(self):
+        return ("UserProfile(age={!r}, height_ft={!r}, height_in={!r}, weight_lbs={!r}, gender={!r}, "
+                "activity_level={!r}, goals={!r}, restrictions={!r})".format(*self._fields()))
+
+    def _memo(self, slot, compute):
+        """Return a cached value, computing it on first use"""
+        try:
+            return getattr(self, slot)
+        except AttributeError:
+            value = compute()
+            object.__setattr__(self, slot, value)
+            return value
 
     def _convert_to_metric(self):
+        return self._memo('_metric', self._compute_metric)
+
+    def _compute_metric(self):
         # Convert height from ft/in to cm
         total_inches = (self.height_ft * 12) + self.height_in
         height_cm = total_inches * 2.54
@@ -21,6 +100,9 @@ class UserProfile:
 
     def calculate_bmr(self):
         """Calculate BMR using Mifflin-St Jeor Equation"""
+        return self._memo('_bmr', self._compute_bmr)
+
+    def _compute_bmr(self):
         height_cm, weight_kg = self._convert_to_metric()
 
         if self.gender.lower() == 'male':
@@ -30,18 +112,112 @@ class UserProfile:
 
     def calculate_tdee(self):
         """Calculate Total Daily Energy Expenditure"""
-        activity_factors = {
-            'sedentary': 1.2,
-            'light': 1.375,
-            'moderate': 1.55,
-            'active': 1.725,
-            'very active': 1.9
-        }
-        return self.calculate_bmr() * activity_factors[self.activity_level.lower()]
+        return self._memo('_tdee', lambda: self.calculate_bmr() * ACTIVITY_FACTORS[self.activity_level.lower()])
 
     def get_weight_kg(self):
         """Return weight in kg for use in calculations"""
-        return self.weight_lbs / 2.2046
+        return self._convert_to_metric()[1]
+
+    def macro_bounds(self):
+        """Return the daily ((min, max), ...) bounds for calories, protein, carbs and fat (see NUTRIENTS)"""
+        return self._memo('_macro_bounds', self._compute_macro_bounds)
+
+    def _compute_macro_bounds(self):
+        weight_kg = self.get_weight_kg()
+        tdee = self.calculate_tdee()
+
+        calories = [0.9 * tdee, 1.1 * tdee]
+        protein = [0.8 * weight_kg, 2.5 * weight_kg]  # 0.8-2.5g per kg body weight
+        carbs = [2.0 * weight_kg, 6.0 * weight_kg]  # 2-6g per kg body weight
+        fat = [0.5 * weight_kg, 1.5 * weight_kg]  # 0.5-1.5g per kg body weight
+
+        # Adjust macro constraints based on goals
+        if 'weight loss' in self.goals:
+            calories = [0.7 * tdee, 0.8 * tdee]
+            # Lower carbs for weight loss
+            carbs[1] = 3.0 * weight_kg
+            protein[0] = 1.6 * weight_kg  # Higher protein for satiety
+        elif 'muscle gain' in self.goals:
+            calories[0] = 1.0 * tdee
+            protein[0] = 1.8 * weight_kg
+            carbs[0] = 4.0 * weight_kg  # Higher carbs for energy
+
+        return tuple(tuple(bounds) for bounds in (calories, protein, carbs, fat))
+
+
+def _lookup_column(column, lookup):
+    """Map a column of categorical values through lookup, calling it once per distinct value"""
+    if isinstance(column, np.ndarray) and column.dtype.kind in 'US':
+        distinct, inverse = np.unique(column, return_inverse=True)
+        return np.array([lookup(str(value)) for value in distinct])[inverse.reshape(-1)]
+
+    # Rows holding collections (e.g. several goals per member) are keyed by tuple
+    cache = {}
+    codes = []
+    for value in column:
+        key = value if isinstance(value, str) else tuple(value)
+        try:
+            codes.append(cache[key])
+        except KeyError:
+            cache[key] = lookup(key)
+            codes.append(cache[key])
+    return np.array(codes)
+
+
+def _goal_code(goals):
+    # Same precedence as UserProfile.macro_bounds: weight loss wins over muscle gain
+    if 'weight loss' in goals:
+        return 1
+    if 'muscle gain' in goals:
+        return 2
+    return 0
+
+
+def calculate_energy_targets(age, height_ft, height_in, weight_lbs, gender, activity_level, goals):
+    """
+    Vectorized UserProfile.calculate_bmr / calculate_tdee / macro_bounds for a whole cohort.
+    Every argument is a column (one entry per member); a goals entry may be a single goal or a
+    collection of goals, read as UserProfile reads them. Returns {'bmr', 'tdee', nutrient: {'min', 'max'}} with NumPy arrays that
+    match the scalar path exactly (requires numpy).
+    """
+    if np is None:
+        raise ImportError("calculate_energy_targets requires numpy")
+
+    age = np.asarray(age)
+    weight_lbs = np.asarray(weight_lbs)
+
+    # Same operation order as UserProfile so the floats are bit-identical
+    height_cm = (np.asarray(height_ft) * 12 + np.asarray(height_in)) * 2.54
+    weight_kg = weight_lbs / 2.2046
+    male = _lookup_column(gender, lambda value: value.lower() == 'male').astype(bool)
+    base = 10 * weight_kg + 6.25 * height_cm - 5 * age
+    bmr = np.where(male, base + 5, base - 161)
+    tdee = bmr * _lookup_column(activity_level, lambda value: ACTIVITY_FACTORS[value.lower()])
+
+    goal = _lookup_column(goals, lambda value: _goal_code(_as_tuple(value)))
+    weight_loss = goal == 1
+    muscle_gain = goal == 2
+
+    return {
+        'bmr': bmr,
+        'tdee': tdee,
+        'calories': {
+            'min': np.where(weight_loss, 0.7 * tdee, np.where(muscle_gain, 1.0 * tdee, 0.9 * tdee)),
+            'max': np.where(weight_loss, 0.8 * tdee, 1.1 * tdee)
+        },
+        'protein': {
+            'min': np.where(weight_loss, 1.6 * weight_kg, np.where(muscle_gain, 1.8 * weight_kg, 0.8 * weight_kg)),
+            'max': 2.5 * weight_kg
+        },
+        'carbs': {
+            'min': np.where(muscle_gain, 4.0 * weight_kg, 2.0 * weight_kg),
+            'max': np.where(weight_loss, 3.0 * weight_kg, 6.0 * weight_kg)
+        },
+        'fat': {
+            'min': 0.5 * weight_kg,
+            'max': 1.5 * weight_kg
+        }
+    }
 
 
 class KnowledgeBase:
@@ -50,6 +226,394 @@ class KnowledgeBase:
         self.foods = {}  # Populate with nutritional data
         self.exercises = {}  # Populate with exercise data
 
+    def invalidate(self):
+        """
+        Call after editing foods or exercises in place: drops the indexes built for them, so
+        planners and cache keys (see database_signature) pick up the new content
+        """
+        FoodIndex.invalidate(self.foods)
+        ExerciseIndex.invalidate(self.exercises)
+
+
+# Nutrient columns of the food nutrient matrix
+NUTRIENTS = ('calories', 'protein', 'carbs', 'fat')
+
+# Meal names and each meal's share of the daily targets, per nutrient, for the usual meal counts
+MEAL_DISTRIBUTIONS = {
+    3: (("Breakfast", "Lunch", "Dinner"), {
+        "calories": [0.25, 0.35, 0.4],
+        "protein": [0.25, 0.35, 0.4],
+        "carbs": [0.3, 0.4, 0.3],
+        "fat": [0.25, 0.35, 0.4]
+    }),
+    4: (("Breakfast", "Lunch", "Snack", "Dinner"), {
+        "calories": [0.25, 0.3, 0.15, 0.3],
+        "protein": [0.2, 0.3, 0.15, 0.35],
+        "carbs": [0.3, 0.3, 0.15, 0.25],
+        "fat": [0.25, 0.3, 0.15, 0.3]
+    }),
+    5: (("Breakfast", "Morning Snack", "Lunch", "Afternoon Snack", "Dinner"), {
+        "calories": [0.2, 0.1, 0.3, 0.1, 0.3],
+        "protein": [0.2, 0.1, 0.3, 0.1, 0.3],
+        "carbs": [0.25, 0.1, 0.3, 0.1, 0.25],
+        "fat": [0.2, 0.1, 0.3, 0.1, 0.3]
+    }),
+    6: (("Breakfast", "Morning Snack", "Lunch", "Afternoon Snack", "Dinner", "Evening Snack"), {
+        "calories": [0.2, 0.1, 0.25, 0.1, 0.25, 0.1],
+        "protein": [0.2, 0.1, 0.25, 0.1, 0.25, 0.1],
+        "carbs": [0.25, 0.1, 0.25, 0.1, 0.25, 0.05],
+        "fat": [0.2, 0.1, 0.25, 0.1, 0.25, 0.1]
+    }),
+}
+
+# The same as (meal names, per-meal (calories, protein, carbs, fat) share vectors)
+MEAL_LAYOUTS = {
+    meals_per_day: (names, tuple(zip(*(distribution[nutrient] for nutrient in NUTRIENTS))))
+    for meals_per_day, (names, distribution) in MEAL_DISTRIBUTIONS.items()
+}
+_derived_meal_layouts = {}
+
+
+def meal_layout(meals_per_day):
+    """
+    Return (meal names, per-meal nutrient share vectors) for any number of meals. Counts
+    without a hand-tuned layout get three main meals (or fewer) and equal snacks in between.
+    """
+    layout = MEAL_LAYOUTS.get(meals_per_day) or _derived_meal_layouts.get(meals_per_day)
+    if layout is not None:
+        return layout
+
+    if meals_per_day <= 0:
+        layout = ((), ())
+    elif meals_per_day == 1:
+        layout = (("Lunch",), ((1.0,) * len(NUTRIENTS),))
+    elif meals_per_day == 2:
+        layout = (("Breakfast", "Dinner"), ((0.45,) * len(NUTRIENTS), (0.55,) * len(NUTRIENTS)))
+    else:
+        # The six-meal day plus snacks; the main meals keep 70% and the snacks share the rest
+        names, shares = MEAL_LAYOUTS[6]
+        names = names + ("Snack",) * (meals_per_day - 6)
+        snack_share = (0.3 / (meals_per_day - 3),) * len(NUTRIENTS)
+        main_shares = {"Breakfast": (0.2,) * len(NUTRIENTS), "Lunch": (0.25,) * len(NUTRIENTS),
+                       "Dinner": (0.25,) * len(NUTRIENTS)}
+        layout = (names, tuple(main_shares.get(name, snack_share) for name in names))
+
+    _derived_meal_layouts[meals_per_day] = layout
+    return layout
+
+
+# Preferred foods per category, and excluded foods, of each meal type
+MEAL_TEMPLATE_FOODS = {
+    "Breakfast": {
+        "proteins": ["Egg", "Egg Whites", "Greek Yogurt", "Protein Shake", "Cottage Cheese"],
+        "carbs": ["Oatmeal", "Ezekiel Bread", "Whole Wheat Bread", "Banana", "Sweet Potato", "Blueberries"],
+        "fats": ["Avocado", "Peanut Butter", "Almond Butter", "Chia Seeds", "Flax Seeds"],
+        "veggies": ["Spinach", "Tomato", "Bell Pepper", "Mushrooms"],
+        "exclude": ["Salmon", "Chicken Breast", "Tuna", "Tilapia", "Beef"]
+    },
+    "Lunch": {
+        "proteins": ["Chicken Breast", "Tuna", "Turkey Breast", "Tofu", "Salmon", "Lean Beef", "Greek Yogurt"],
+        "carbs": ["Brown Rice", "Sweet Potato", "Quinoa", "Whole Wheat Bread", "Ezekiel Bread"],
+        "fats": ["Avocado", "Olive Oil", "Almonds", "Feta Cheese"],
+        "veggies": ["Mixed Greens", "Broccoli", "Spinach", "Cucumber", "Tomato", "Bell Pepper"],
+        "exclude": []
+    },
+    "Dinner": {
+        "proteins": ["Salmon", "Chicken Breast", "Lean Beef", "Shrimp", "Tilapia", "Turkey Breast", "Cod"],
+        "carbs": ["Sweet Potato", "Brown Rice", "Quinoa", "Jasmine Rice"],
+        "fats": ["Avocado", "Olive Oil", "Almonds"],
+        "veggies": ["Broccoli", "Asparagus", "Brussels Sprouts", "Zucchini", "Cauliflower", "Green Beans"],
+        "exclude": ["Oatmeal"]
+    },
+    "Snack": {
+        "proteins": ["Greek Yogurt", "Protein Shake", "Cottage Cheese", "Protein Bar"],
+        "carbs": ["Banana", "Apple", "Orange", "Blueberries", "Strawberries", "Rice Cakes"],
+        "fats": ["Almonds", "Peanut Butter", "Almond Butter", "Trail Mix"],
+        "veggies": ["Carrot", "Cucumber", "Bell Pepper"],
+        "exclude": ["Salmon", "Chicken Breast", "Beef"]
+    },
+    "Morning Snack": {
+        "proteins": ["Greek Yogurt", "Protein Shake", "Cottage Cheese", "Protein Bar"],
+        "carbs": ["Banana", "Apple", "Orange", "Blueberries", "Rice Cakes"],
+        "fats": ["Almonds", "Peanut Butter", "Almond Butter", "Trail Mix"],
+        "veggies": ["Carrot", "Cucumber"],
+        "exclude": ["Salmon", "Chicken Breast", "Beef"]
+    },
+    "Afternoon Snack": {
+        "proteins": ["Greek Yogurt", "Protein Shake", "Cottage Cheese", "Protein Bar"],
+        "carbs": ["Banana", "Apple", "Orange", "Blueberries", "Rice Cakes"],
+        "fats": ["Almonds", "Peanut Butter", "Almond Butter", "Trail Mix"],
+        "veggies": ["Carrot", "Cucumber", "Bell Pepper"],
+        "exclude": ["Salmon", "Chicken Breast", "Beef"]
+    },
+    "Evening Snack": {
+        "proteins": ["Greek Yogurt", "Cottage Cheese", "Protein Shake"],
+        "carbs": ["Banana", "Blueberries", "Strawberries", "Rice Cakes"],
+        "fats": ["Almonds", "Peanut Butter", "Almond Butter"],
+        "veggies": ["Carrot", "Cucumber"],
+        "exclude": ["Salmon", "Chicken Breast", "Beef"]
+    }
+}
+
+# The templates compiled to frozen sets for constant-time membership tests
+MEAL_TEMPLATES = {
+    meal_type: {category: frozenset(food_names) for category, food_names in template.items()}
+    for meal_type, template in MEAL_TEMPLATE_FOODS.items()
+}
+
+
+def meal_template(meal_type):
+    """Return the compiled template of a meal type (snacks without their own use the generic one)"""
+    template = MEAL_TEMPLATES.get(meal_type)
+    if template is None:
+        template = MEAL_TEMPLATES["Snack"] if "Snack" in meal_type else {}
+    return template
+
+
+# Dietary restriction flags: one bit per food property a restriction can rule out
+FOOD_MEAT = 1
+FOOD_DAIRY = 2
+FOOD_NUTS = 4
+FOOD_GLUTEN = 8
+FOOD_HIGH_CARB = 16  # more than half the calories from carbs (vegetables excepted)
+FOOD_NON_PALEO = 32  # grains, legumes and processed foods
+
+# Name keywords that set each flag
+FOOD_FLAG_KEYWORDS = (
+    (FOOD_MEAT, ("Chicken", "Salmon", "Beef", "Turkey", "Tuna", "Tilapia", "Shrimp", "Pork", "Cod",
+                 "Ground Turkey")),
+    (FOOD_DAIRY, ("Milk", "Cheese", "Greek Yogurt", "Cottage Cheese", "Feta Cheese", "Mozzarella", "Cheddar",
+                  "Butter", "Yogurt")),
+    (FOOD_NUTS, ("Almonds", "Peanut Butter", "Almond Butter", "Walnuts", "Trail Mix")),
+    (FOOD_GLUTEN, ("Wheat", "Bread", "Pasta", "Flour Tortilla", "Ezekiel Bread", "Whole Wheat")),
+    (FOOD_NON_PALEO, ("Rice", "Oat", "Bread", "Pasta", "Couscous", "Tortilla", "Quinoa", "Wheat", "Cereal",
+                      "Tofu", "Tempeh", "Seitan", "Edamame", "Lentils", "Black Beans", "Kidney Beans",
+                      "Chickpeas", "Peanut", "Hummus", "Soy", "Protein Shake", "Protein Bar", "Plant-Based",
+                      "Nutritional Yeast")),
+)
+
+# Flags ruled out by each dietary restriction (restrictions are matched case-insensitively)
+RESTRICTION_FLAGS = {
+    'vegetarian': FOOD_MEAT,
+    'vegan': FOOD_MEAT | FOOD_DAIRY,
+    'dairy': FOOD_DAIRY,
+    'nuts': FOOD_NUTS,
+    'gluten': FOOD_GLUTEN,
+    'keto': FOOD_HIGH_CARB,
+    'paleo': FOOD_NON_PALEO | FOOD_DAIRY,
+}
+
+
+def restriction_mask(restrictions):
+    """Combine dietary restrictions into one bitmask of ruled-out food flags (unknown ones are ignored)"""
+    mask = 0
+    for restriction in restrictions:
+        mask |= RESTRICTION_FLAGS.get(restriction.lower(), 0)
+    return mask
+
+
+def database_signature(database):
+    """
+    Content signature of a food or exercise database ({name: {field: value}}) for this process:
+    it changes when an entry is added, removed, renamed or edited in place. Computed once per
+    index (see FoodIndex.signature / ExerciseIndex.signature); after an in-place edit call
+    KnowledgeBase.invalidate so the indexes, and with them the signatures, are rebuilt.
+    """
+    return hash((tuple(database), tuple(map(tuple, map(dict.items, database.values())))))
+
+
+class FoodIndex:
+    """Precomputed food categories (protein/carb/fat/veggie/fruit sources) and restriction flags for a food database"""
+
+    CATEGORIES = ('proteins', 'carbs', 'fats', 'veggies', 'fruits')
+
+    # Macro-dominant categories: (category, macro, minimum grams per calorie, ratio keyword,
+    # keywords). The ratio only qualifies the ratio keyword (e.g. "Protein" foods need at least
+    # 0.1 g protein per calorie); any of the other keywords puts a food in the category outright.
+    MACRO_RULES = (
+        ('proteins', 'protein', 0.1, "Protein",
+         ("Egg", "Chicken", "Fish", "Turkey", "Tofu", "Beef", "Cottage", "Greek")),
+        ('carbs', 'carbs', 0.15, "Rice", ("Potato", "Bread", "Oatmeal", "Quinoa")),
+        ('fats', 'fat', 0.1, "Oil", ("Butter", "Avocado", "Seeds", "Almonds", "Nuts")),
+    )
+    # Keyword-only categories
+    KEYWORD_RULES = (
+        ('veggies', ("Broccoli", "Spinach", "Greens", "Asparagus", "Cucumber", "Carrot", "Pepper", "Zucchini",
+                     "Cauliflower", "Brussels", "Tomato", "Mushrooms", "Green Beans", "Kale")),
+        ('fruits', ("Banana", "Apple", "Orange", "Strawberries", "Blueberries", "Grapes", "Pineapple", "Mango",
+                    "Watermelon", "Kiwi")),
+    )
+
+    # One index per food database, shared by every planner built on it
+    _cache = {}
+    _cache_limit = 8
+
+    def __init__(self, foods):
+        self.foods = foods
+        self.signature = database_signature(foods)
+
+        # Food names per category, in database order (a food can be in several categories),
+        # and the restriction flags of every food
+        buckets = {category: [] for category in self.CATEGORIES}
+        self.flags = {}
+        for food_name, nutrition in foods.items():
+            categories = tuple(self._categorize(food_name, nutrition))
+            for category in categories:
+                buckets[category].append(food_name)
+            self.flags[food_name] = self._restriction_flags(food_name, nutrition, categories)
+
+        self.categories = {category: tuple(names) for category, names in buckets.items()}
+        self._views = {}  # (restriction mask, excluded names) -> available foods
+        self._categorized = {}  # (restriction mask, excluded names) -> {category: available sources}
+
+        # Row of every food in the nutrient matrix
+        self.names = tuple(foods)
+        self.rows = {food_name: row for row, food_name in enumerate(self.names)}
+        self._matrix = None
+
+    @classmethod
+    def for_database(cls, foods):
+        """Return the index for a food database, built on first use and after invalidate"""
+        index = cls._cache.get(id(foods))
+        if index is None or index.foods is not foods:
+            if len(cls._cache) >= cls._cache_limit:
+                cls._cache.pop(next(iter(cls._cache)))
+            index = cls(foods)
+            cls._cache[id(foods)] = index
+        return index
+
+    @classmethod
+    def invalidate(cls, foods):
+        """Drop the index of a food database that was edited in place"""
+        index = cls._cache.get(id(foods))
+        if index is not None and index.foods is foods:
+            del cls._cache[id(foods)]
+
+    @classmethod
+    def _categorize(cls, food_name, nutrition):
+        """Yield the categories of a food"""
+        calories = max(nutrition['calories'], 1)
+        for category, macro, min_ratio, ratio_keyword, keywords in cls.MACRO_RULES:
+            if (nutrition[macro] / calories >= min_ratio and ratio_keyword in food_name
+                    or any(keyword in food_name for keyword in keywords)):
+                yield category
+
+        for category, keywords in cls.KEYWORD_RULES:
+            if any(keyword in food_name for keyword in keywords):
+                yield category
+
+    @staticmethod
+    def _restriction_flags(food_name, nutrition, categories):
+        """Return the restriction flag bits of a food"""
+        flags = 0
+        for flag, keywords in FOOD_FLAG_KEYWORDS:
+            if any(keyword in food_name for keyword in keywords):
+                flags |= flag
+        if 'veggies' not in categories and nutrition['carbs'] * 4 > 0.5 * max(nutrition['calories'], 1):
+            flags |= FOOD_HIGH_CARB
+        return flags
+
+    def available(self, mask, exclude=()):
+        """
+        Return the foods (name -> nutrition, in database order) with none of the flags in mask,
+        minus the excluded names. Views are cached per (mask, exclude) and shared, so callers
+        must not modify them.
+        """
+        excluded = frozenset(exclude)
+        key = (mask, excluded)
+        view = self._views.get(key)
+        if view is None:
+            view = {food_name: nutrition for food_name, nutrition in self.foods.items()
+                    if not self.flags[food_name] & mask and food_name not in excluded}
+            self._views[key] = view
+        return view
+
+    def nutrient_matrix(self):
+        """
+        Return the foods' nutrients as a (N + 1) x len(NUTRIENTS) float matrix, one row per food in
+        self.rows order plus a final all-zero row standing for "no food" (requires numpy)
+        """
+        if self._matrix is None:
+            matrix = np.zeros((len(self.names) + 1, len(NUTRIENTS)))
+            for row, food_name in enumerate(self.names):
+                nutrition = self.foods[food_name]
+                matrix[row] = [nutrition[nutrient] for nutrient in NUTRIENTS]
+            self._matrix = matrix
+        return self._matrix
+
+    def categorized(self, mask, exclude=()):
+        """
+        Return {category: ((name, nutrition), ...)} for the foods available under mask and exclude
+        (see available). Cached and shared like the views themselves.
+        """
+        key = (mask, frozenset(exclude))
+        view = self._categorized.get(key)
+        if view is None:
+            available_foods = self.available(mask, exclude)
+            view = {category: tuple(self.sources(category, available_foods)) for category in self.CATEGORIES}
+            self._categorized[key] = view
+        return view
+
+    def sources(self, category, available_foods):
+        """Return (name, nutrition) pairs of a category that are in available_foods, in database order"""
+        return [(food_name, available_foods[food_name]) for food_name in self.categories[category]
+                if food_name in available_foods]
+
+
+# Serving multiplier bounds and rounding step used by the portion solver
+MIN_SERVINGS = 0.5
+MAX_SERVINGS = 3.0
+SERVING_STEP = 0.25
+PORTION_REGULARIZATION = 0.01  # Weight of the pull towards one serving, relative to the macro errors
+
+# Serving sizes the CSP engine chooses from, and how far a meal's calories may stray from its share
+CSP_SERVINGS = (0.5, 1.0, 1.5, 2.0, 2.5, 3.0)
+CSP_MEAL_CALORIE_WINDOW = (0.6, 1.4)
+CSP_RESTART_NODES = 50  # Node cutoff of the first search run, doubled at every restart
+CSP_DEADLINE_MS = 250  # Default search budget; a feasible day is usually found within a few dozen nodes
+
+# Largest table of final-slot combinations enumerate_meal_options scores in one vectorized pass
+ENUMERATION_TAIL_SIZE = 16384
+# Foods enumerate_meal_options keeps per slot (the best single fits): at least ENUMERATION_SLOT_LIMIT,
+# more while the slots before the last two span at most ENUMERATION_HEAD_SIZE combinations; and its
+# search budget in nodes
+ENUMERATION_SLOT_LIMIT = 24
+ENUMERATION_HEAD_SIZE = 16384
+ENUMERATION_NODE_LIMIT = 5000
+
+
+class MealPlan(list):
+    """A daily meal plan, [(meal_name, foods), ...], with details on how it was produced"""
+
+    def __init__(self, meals=(), engine="greedy"):
+        super().__init__(meals)
+        self.engine = engine  # "greedy" or "csp"
+        self.feasible = None  # CSP engine: True if the plan lies inside every constraint window
+        self.nodes_expanded = 0  # CSP engine: search nodes used
+        self.budget_exhausted = False  # CSP engine: True if the node or time budget ran out
+        self.alternatives = []  # Per meal, the ranked [(score, foods), ...] options if alternatives were requested
+
+
+class WeeklyMealPlan(list):
+    """Several days of meal plans, [MealPlan, ...], with the nutrient totals of every day"""
+
+    def __init__(self, days=(), daily_totals=None):
+        super().__init__(days)
+        self.daily_totals = daily_totals if daily_totals is not None else []  # [{nutrient: amount}, ...]
+
+
+class PortionedMeal(list):
+    """A meal's food names, with the number of servings of each in .servings (food name -> multiplier)"""
+
+    def __init__(self, foods=(), servings=None):
+        super().__init__(foods)
+        self.servings = servings if servings is not None else {food_name: 1 for food_name in self}
+
+    def totals(self, foods):
+        """Return the meal's nutrients, {nutrient: amount}, given the food database"""
+        return {nutrient: sum(foods[food_name][nutrient] * self.servings[food_name] for food_name in self)
+                for nutrient in NUTRIENTS}
+
 
 class MealPlanCSP:
     """Advanced meal planning with more diverse options and better structure"""
@@ -58,174 +622,405 @@ class MealPlanCSP:
         self.foods = foods
         self.user = user_profile
         self.constraints = self._generate_constraints()
+        self.food_index = FoodIndex.for_database(foods)
 
     def _generate_constraints(self):
-        """Generate constraints based on user profile"""
-        weight_kg = self.user.get_weight_kg()
-
-        constraints = {
-            'calories': {
-                'min': 0.9 * self.user.calculate_tdee(),
-                'max': 1.1 * self.user.calculate_tdee()
-            },
-            'protein': {
-                'min': 0.8 * weight_kg,  # 0.8g per kg body weight
-                'max': 2.5 * weight_kg  # 2.5g per kg body weight
-            },
-            'carbs': {
-                'min': 2.0 * weight_kg,  # 2g per kg body weight
-                'max': 6.0 * weight_kg  # 6g per kg body weight
-            },
-            'fat': {
-                'min': 0.5 * weight_kg,  # 0.5g per kg body weight
-                'max': 1.5 * weight_kg  # 1.5g per kg body weight
-            },
-            'restrictions': self.user.restrictions
-        }
+        """Generate constraints based on user profile (the bounds are cached on the profile)"""
+        constraints = {nutrient: {'min': low, 'max': high}
+                       for nutrient, (low, high) in zip(NUTRIENTS, self.user.macro_bounds())}
+        constraints['restrictions'] = self.user.restrictions
+        return constraints
 
-        # Adjust macro constraints based on goals
-        if 'weight loss' in self.user.goals:
-            constraints['calories']['max'] = 0.8 * self.user.calculate_tdee()
-            # Lower carbs for weight loss
-            constraints['carbs']['max'] = 3.0 * weight_kg
-            constraints['protein']['min'] = 1.6 * weight_kg  # Higher protein for satiety
-        elif 'muscle gain' in self.user.goals:
-            constraints['calories']['min'] = 1.1 * self.user.calculate_tdee()
-            constraints['protein']['min'] = 1.8 * weight_kg
-            constraints['carbs']['min'] = 4.0 * weight_kg  # Higher carbs for energy
+    def generate_meal_plan(self, meals_per_day=4, candidate_meals=1, portions=False, engine="greedy",
+                           node_limit=1000, deadline_ms=CSP_DEADLINE_MS, alternatives=0):
+        """
+        Generate a meal plan that satisfies all constraints
+
+        With candidate_meals > 1 (and numpy available) each meal is the best of that many random
+        candidate meals, scored against the meal's macro targets in one vectorized pass.
+        With portions=True each meal is a PortionedMeal whose serving sizes are fitted to the
+        meal's macro targets (see _solve_portions); otherwise every food is one serving.
+        With alternatives=k each meal is the best of the k ranked options from
+        enumerate_meal_options, and meal_plan.alternatives holds the k options of every meal.
+
+        engine="csp" solves the day as a constraint satisfaction problem instead (see _solve_csp):
+        the plan is guaranteed to lie inside the calorie and macro windows of self.constraints,
+        with servings. If the node_limit/deadline_ms budget runs out, or no plan exists, the
+        greedy plan (with fitted portions) is returned with feasible=False. Inputs that cannot
+        possibly fit the windows are rejected before any search.
+        """
+        if engine not in ("greedy", "csp"):
+            raise ValueError(f"Unknown meal planning engine: {engine}")
 
-        return constraints
+        meal_plan = MealPlan(engine=engine)
+        self.food_index = FoodIndex.for_database(self.foods)
+        meals = self._meal_targets(meals_per_day)
+
+        if engine == "csp":
+            if np is not None and self._solve_csp(meals, meal_plan, node_limit, deadline_ms):
+                meal_plan.feasible = True
+                return meal_plan
+            meal_plan.feasible = False
+            portions = True
+
+        # For each meal, find foods that approximately match the targets
+        for meal_name, (meal_calories, meal_protein, meal_carbs, meal_fat), template in meals:
+            if alternatives > 0:
+                options = self.enumerate_meal_options(
+                    meal_name, meal_calories, meal_protein, meal_carbs, meal_fat,
+                    k=alternatives, template=template
+                )
+                meal_plan.alternatives.append(options)
+                meal = list(options[0][1]) if options else []
+            elif candidate_meals > 1 and np is not None:
+                meal = self._select_best_meal(
+                    meal_calories, meal_protein, meal_carbs, meal_fat,
+                    meal_name, template, candidate_meals
+                )
+            else:
+                meal = self._select_foods_for_meal(
+                    meal_calories, meal_protein, meal_carbs, meal_fat,
+                    meal_name, template
+                )
+            if portions:
+                meal = self._solve_portions(meal, meal_calories, meal_protein, meal_carbs, meal_fat)
+            meal_plan.append((meal_name, meal))
+
+        return meal_plan
+
+    def generate_weekly_meal_plan(self, days=7, meals_per_day=4, food_repeat_window=1, slot_repeat_window=3,
+                                  candidate_meals=1, portions=False):
+        """
+        Generate meal plans for several days with variety constraints
+
+        A food served on one day rests for the next food_repeat_window days, and a food served
+        in a meal slot (e.g. Breakfast) rests in that slot for the next slot_repeat_window days.
+        Resting foods are tracked in recency-ordered rotations, so each meal filters its food
+        pools directly instead of redrawing; when every preferred food of a category is resting,
+        the category's other foods are used, and only if those rest too the one rested longest.
+        Targets and food pools are computed once for the whole week. Meals are picked as in
+        generate_meal_plan (greedy, candidate_meals, portions).
+        """
+        self.food_index = FoodIndex.for_database(self.foods)
+        meals = self._meal_targets(meals_per_day)
+        meal_sources = [self._meal_sources(template) for _, _, template in meals]
+        category_sources = [tuple(self._categorized_foods(template)[category]
+                                  for category in ('proteins', 'carbs', 'fats', 'veggies', 'fruits'))
+                            for _, _, template in meals]
+
+        recently_served = OrderedDict()  # food -> last day served, least recent first
+        recently_in_slot = [OrderedDict() for _ in meals]
+        weekly_plan = WeeklyMealPlan()
+
+        for day in range(days):
+            self._expire_rotation(recently_served, day - food_repeat_window)
+            for rotation in recently_in_slot:
+                self._expire_rotation(rotation, day - slot_repeat_window)
+
+            meal_plan = MealPlan()
+            served_today = []
+            for meal_index, (meal_name, targets, template) in enumerate(meals):
+                resting = dict(recently_served)
+                resting.update(recently_in_slot[meal_index])
+                sources = self._rest_sources(meal_sources[meal_index], resting, category_sources[meal_index])
+
+                if candidate_meals > 1 and np is not None:
+                    meal = self._select_best_meal(*targets, meal_name, template, candidate_meals, sources=sources)
+                else:
+                    meal = self._select_foods_for_meal(*targets, meal_name, template, sources=sources)
+                if portions:
+                    meal = self._solve_portions(meal, *targets)
+                meal_plan.append((meal_name, meal))
+
+                for food_name in meal:
+                    recently_in_slot[meal_index][food_name] = day
+                    recently_in_slot[meal_index].move_to_end(food_name)
+                served_today.extend(meal)
+
+            for food_name in served_today:
+                recently_served[food_name] = day
+                recently_served.move_to_end(food_name)
 
-    def generate_meal_plan(self, meals_per_day=4):
-        """Generate a meal plan that satisfies all constraints"""
-        meal_plan = []
+            weekly_plan.append(meal_plan)
+            weekly_plan.daily_totals.append(self._plan_totals(meal_plan))
 
+        return weekly_plan
+
+    def _meal_targets(self, meals_per_day):
+        """Return [(meal_name, (calories, protein, carbs, fat) targets, template), ...] for a day"""
         # Get total daily targets
         daily_calories = self.constraints['calories']['max'] * 0.95  # Aim for 95% of max
         daily_protein = self.constraints['protein']['min'] * 1.1  # Aim for 110% of min
         daily_carbs = self.constraints['carbs']['min'] * 1.1  # Aim for 110% of min
         daily_fat = self.constraints['fat']['min'] * 1.1  # Aim for 110% of min
 
-        # Define meal names for better organization
-        if meals_per_day == 3:
-            meal_names = ["Breakfast", "Lunch", "Dinner"]
-            meal_distribution = {
-                "calories": [0.25, 0.35, 0.4],
-                "protein": [0.25, 0.35, 0.4],
-                "carbs": [0.3, 0.4, 0.3],
-                "fat": [0.25, 0.35, 0.4]
-            }
-        elif meals_per_day == 4:
-            meal_names = ["Breakfast", "Lunch", "Snack", "Dinner"]
-            meal_distribution = {
-                "calories": [0.25, 0.3, 0.15, 0.3],
-                "protein": [0.2, 0.3, 0.15, 0.35],
-                "carbs": [0.3, 0.3, 0.15, 0.25],
-                "fat": [0.25, 0.3, 0.15, 0.3]
-            }
-        elif meals_per_day == 5:
-            meal_names = ["Breakfast", "Morning Snack", "Lunch", "Afternoon Snack", "Dinner"]
-            meal_distribution = {
-                "calories": [0.2, 0.1, 0.3, 0.1, 0.3],
-                "protein": [0.2, 0.1, 0.3, 0.1, 0.3],
-                "carbs": [0.25, 0.1, 0.3, 0.1, 0.25],
-                "fat": [0.2, 0.1, 0.3, 0.1, 0.3]
-            }
-        elif meals_per_day == 6:
-            meal_names = ["Breakfast", "Morning Snack", "Lunch", "Afternoon Snack", "Dinner", "Evening Snack"]
-            meal_distribution = {
-                "calories": [0.2, 0.1, 0.25, 0.1, 0.25, 0.1],
-                "protein": [0.2, 0.1, 0.25, 0.1, 0.25, 0.1],
-                "carbs": [0.25, 0.1, 0.25, 0.1, 0.25, 0.05],
-                "fat": [0.2, 0.1, 0.25, 0.1, 0.25, 0.1]
-            }
-        else:
-            # Default to 3 meals
-            meal_names = ["Breakfast", "Lunch", "Dinner"]
-            meal_distribution = {
-                "calories": [0.25, 0.35, 0.4],
-                "protein": [0.25, 0.35, 0.4],
-                "carbs": [0.3, 0.4, 0.3],
-                "fat": [0.25, 0.35, 0.4]
-            }
-
-        # Create meal templates based on meal type
-        meal_templates = {
-            "Breakfast": {
-                "proteins": ["Egg", "Egg Whites", "Greek Yogurt", "Protein Shake", "Cottage Cheese"],
-                "carbs": ["Oatmeal", "Ezekiel Bread", "Whole Wheat Bread", "Banana", "Sweet Potato", "Blueberries"],
-                "fats": ["Avocado", "Peanut Butter", "Almond Butter", "Chia Seeds", "Flax Seeds"],
-                "veggies": ["Spinach", "Tomato", "Bell Pepper", "Mushrooms"],
-                "exclude": ["Salmon", "Chicken Breast", "Tuna", "Tilapia", "Beef"]
-            },
-            "Lunch": {
-                "proteins": ["Chicken Breast", "Tuna", "Turkey Breast", "Tofu", "Salmon", "Lean Beef", "Greek Yogurt"],
-                "carbs": ["Brown Rice", "Sweet Potato", "Quinoa", "Whole Wheat Bread", "Ezekiel Bread"],
-                "fats": ["Avocado", "Olive Oil", "Almonds", "Feta Cheese"],
-                "veggies": ["Mixed Greens", "Broccoli", "Spinach", "Cucumber", "Tomato", "Bell Pepper"],
-                "exclude": []
-            },
-            "Dinner": {
-                "proteins": ["Salmon", "Chicken Breast", "Lean Beef", "Shrimp", "Tilapia", "Turkey Breast", "Cod"],
-                "carbs": ["Sweet Potato", "Brown Rice", "Quinoa", "Jasmine Rice"],
-                "fats": ["Avocado", "Olive Oil", "Almonds"],
-                "veggies": ["Broccoli", "Asparagus", "Brussels Sprouts", "Zucchini", "Cauliflower", "Green Beans"],
-                "exclude": ["Oatmeal"]
-            },
-            "Snack": {
-                "proteins": ["Greek Yogurt", "Protein Shake", "Cottage Cheese", "Protein Bar"],
-                "carbs": ["Banana", "Apple", "Orange", "Blueberries", "Strawberries", "Rice Cakes"],
-                "fats": ["Almonds", "Peanut Butter", "Almond Butter", "Trail Mix"],
-                "veggies": ["Carrot", "Cucumber", "Bell Pepper"],
-                "exclude": ["Salmon", "Chicken Breast", "Beef"]
-            },
-            "Morning Snack": {
-                "proteins": ["Greek Yogurt", "Protein Shake", "Cottage Cheese", "Protein Bar"],
-                "carbs": ["Banana", "Apple", "Orange", "Blueberries", "Rice Cakes"],
-                "fats": ["Almonds", "Peanut Butter", "Almond Butter", "Trail Mix"],
-                "veggies": ["Carrot", "Cucumber"],
-                "exclude": ["Salmon", "Chicken Breast", "Beef"]
-            },
-            "Afternoon Snack": {
-                "proteins": ["Greek Yogurt", "Protein Shake", "Cottage Cheese", "Protein Bar"],
-                "carbs": ["Banana", "Apple", "Orange", "Blueberries", "Rice Cakes"],
-                "fats": ["Almonds", "Peanut Butter", "Almond Butter", "Trail Mix"],
-                "veggies": ["Carrot", "Cucumber", "Bell Pepper"],
-                "exclude": ["Salmon", "Chicken Breast", "Beef"]
-            },
-            "Evening Snack": {
-                "proteins": ["Greek Yogurt", "Cottage Cheese", "Protein Shake"],
-                "carbs": ["Banana", "Blueberries", "Strawberries", "Rice Cakes"],
-                "fats": ["Almonds", "Peanut Butter", "Almond Butter"],
-                "veggies": ["Carrot", "Cucumber"],
-                "exclude": ["Salmon", "Chicken Breast", "Beef"]
-            }
-        }
-
-        # For each meal, find foods that approximately match the targets
-        for i in range(meals_per_day):
-            meal_name = meal_names[i if i < len(meal_names) else -1]
-
-            # Calculate target macros for this meal
-            meal_calories = daily_calories * meal_distribution["calories"][
-                i if i < len(meal_distribution["calories"]) else -1]
-            meal_protein = daily_protein * meal_distribution["protein"][
-                i if i < len(meal_distribution["protein"]) else -1]
-            meal_carbs = daily_carbs * meal_distribution["carbs"][i if i < len(meal_distribution["carbs"]) else -1]
-            meal_fat = daily_fat * meal_distribution["fat"][i if i < len(meal_distribution["fat"]) else -1]
-
-            # Use the corresponding template
-            template = meal_templates.get(meal_name, {})
-            meal = self._select_foods_for_meal(
-                meal_calories, meal_protein, meal_carbs, meal_fat,
-                meal_name, template
-            )
-            meal_plan.append((meal_name, meal))
+        # Calculate target macros and the template of each meal
+        meals = []
+        for meal_name, (calorie_share, protein_share, carb_share, fat_share) in zip(*meal_layout(meals_per_day)):
+            meal_calories = daily_calories * calorie_share
+            meal_protein = daily_protein * protein_share
+            meal_carbs = daily_carbs * carb_share
+            meal_fat = daily_fat * fat_share
+
+            meals.append((meal_name, (meal_calories, meal_protein, meal_carbs, meal_fat),
+                          meal_template(meal_name)))
+        return meals
+
+    @staticmethod
+    def _expire_rotation(rotation, last_resting_day):
+        """Drop foods served before last_resting_day from a recency-ordered rotation"""
+        while rotation and next(iter(rotation.values())) < last_resting_day:
+            rotation.popitem(last=False)
+
+    @staticmethod
+    def _rest_sources(sources, resting, all_sources=None):
+        """
+        Return meal sources (see _meal_sources) without the resting foods ({food: day last served}).
+        A category left empty falls back to the other non-resting foods of that category in
+        all_sources (same order as sources), else keeps the foods that have rested longest
+        """
+        if not resting:
+            return sources
+        rested = []
+        for index, category_sources in enumerate(sources):
+            available = [(f, n) for f, n in category_sources if f not in resting]
+            if not available and all_sources is not None:
+                available = [(f, n) for f, n in all_sources[index] if f not in resting]
+            if not available and category_sources:
+                longest = min(resting[f] for f, _ in category_sources)
+                available = [(f, n) for f, n in category_sources if resting[f] == longest]
+            rested.append(available)
+        return tuple(rested)
+
+    def _plan_totals(self, meal_plan):
+        """Return the nutrient totals of a day's meal plan, {nutrient: amount}"""
+        totals = dict.fromkeys(NUTRIENTS, 0)
+        for _, meal in meal_plan:
+            servings = getattr(meal, 'servings', {})
+            for food_name in meal:
+                nutrition = self.foods[food_name]
+                for nutrient in NUTRIENTS:
+                    totals[nutrient] += nutrition[nutrient] * servings.get(food_name, 1)
+        return totals
+
+    def enumerate_meal_options(self, meal_type, target_calories, target_protein, target_carbs, target_fat, k=5,
+                               template=None, max_foods_per_meal=5, slot_limit=None,
+                               node_limit=ENUMERATION_NODE_LIMIT):
+        """
+        Return the k template-compatible food combinations (one serving each, at most
+        max_foods_per_meal foods) closest to the targets, best first, as (score, foods) pairs.
+        The score is the sum of squared relative errors over calories, protein, carbs and fat.
+
+        Combinations take one food per slot of the meal (see _meal_slots); each slot keeps only
+        the slot_limit foods that best fit its share of the targets (by default sized from
+        ENUMERATION_SLOT_LIMIT and ENUMERATION_HEAD_SIZE), so a slot falling back to a whole
+        category stays small. They are enumerated depth-first with branch and bound: a
+        partial combination is dropped as soon as the error it must still have, given the
+        smallest and largest nutrients the remaining slots can add, is no better than the
+        current k-th best. With numpy, the last slots are expanded once into a table of up to
+        ENUMERATION_TAIL_SIZE tail combinations that is scored in one vectorized pass per partial
+        combination, and the bound also measures how far the remaining slots can move the totals
+        towards the targets. After node_limit partial combinations the best found so far are
+        returned.
+        """
+        # Largest pools last, so they end up in the vectorized tail (the sort is stable, so
+        # slots sharing a pool stay next to each other)
+        if template is None:
+            template = meal_template(meal_type)
+        slots = sorted(self._meal_slots(meal_type, template), key=len)
+        if not slots or k <= 0:
+            return []
 
-        return meal_plan
+        targets = (target_calories, target_protein, target_carbs, target_fat)
+        scales = tuple(max(target, 1) for target in targets)
+        if slot_limit is None:
+            # Meals with few slots can afford larger pools; the last two slots must fit the tail
+            slot_limit = max(ENUMERATION_SLOT_LIMIT, int(ENUMERATION_HEAD_SIZE ** (1 / max(len(slots) - 2, 1))))
+            slot_limit = min(slot_limit, max(math.isqrt(ENUMERATION_TAIL_SIZE) - 1, ENUMERATION_SLOT_LIMIT))
+
+        # Slot values as (food, nutrients), best single fits first so good combinations
+        # (and a tight k-th best score) turn up early; only the slot_limit best foods are kept.
+        # A slot's share of the targets is what is left once the other slots add their average.
+        slot_values = [[(None, (0, 0, 0, 0)) if food_name is None else
+                        (food_name, tuple(self.foods[food_name][nutrient] for nutrient in NUTRIENTS))
+                        for food_name in slot] for slot in slots]
+        means = [tuple(sum(column) / len(values) for column in zip(*(nutrients for _, nutrients in values)))
+                 for values in slot_values]
+        average_meal = tuple(map(sum, zip(*means)))
+        for values, mean in zip(slot_values, means):
+            share = tuple(target - total + part for target, total, part in zip(targets, average_meal, mean))
+            values.sort(key=lambda value: sum(((amount - part) / scale) ** 2
+                                              for amount, part, scale in zip(value[1], share, scales)))
+            foods = [food_name for food_name, _ in values if food_name is not None]
+            if len(foods) > slot_limit:
+                kept = frozenset(foods[:slot_limit])
+                values[:] = [value for value in values if value[0] is None or value[0] in kept]
+
+        # Vectorized tail: the longest run of final slots whose product fits the table size
+        count = len(slots)
+        tail_start = count
+        if np is not None:
+            size = 1
+            while tail_start > 0 and size * len(slot_values[tail_start - 1]) <= ENUMERATION_TAIL_SIZE:
+                tail_start -= 1
+                size *= len(slot_values[tail_start])
+        if tail_start < count:
+            tail_rows, tail_totals, tail_first_index = self._slot_combinations(slots, slot_values, tail_start)
+            tail_sizes = (tail_rows >= 0).sum(axis=1)
+            tail_same_pool = tail_start > 0 and slots[tail_start] is slots[tail_start - 1]
+            target_array = np.array(targets, dtype=float)
+            scale_array = np.array(scales, dtype=float)
+            # Score of a tail row t after a head with totals h: with u = t / scale and
+            # r = (h - target) / scale, |u + r|^2 = |u|^2 + 2 u.r + |r|^2, so one matrix-vector
+            # product per head scores the whole table
+            tail_scaled = tail_totals / scale_array
+            tail_norms = (tail_scaled ** 2).sum(axis=1)
+            tail_lookup_rows = np.where(tail_rows >= 0, tail_rows, len(self.food_index.names))
+
+            # Scaled nutrients of the slots from each head depth to the tail, stacked, for the
+            # directional bound in visit
+            head_scaled = [np.array([nutrients for _, nutrients in values], dtype=float) / scale_array
+                           for values in slot_values[:tail_start]]
+            suffix_scaled = [np.concatenate(head_scaled[depth:]) for depth in range(tail_start)]
+            suffix_starts = [np.cumsum([0] + [len(scaled) for scaled in head_scaled[depth:]])[:-1]
+                             for depth in range(tail_start)]
+
+        # What the slots from a depth on can still add: nutrient bounds and required foods. The
+        # valid tail combinations bound the tail tighter than the separate ranges of its slots.
+        suffix_low = [(0,) * len(NUTRIENTS)] * (count + 1)
+        suffix_high = [(0,) * len(NUTRIENTS)] * (count + 1)
+        suffix_required = [0] * (count + 1)
+        for depth in reversed(range(count)):
+            amounts = [nutrients for _, nutrients in slot_values[depth]]
+            suffix_low[depth] = tuple(low + rest for low, rest in zip(map(min, zip(*amounts)), suffix_low[depth + 1]))
+            suffix_high[depth] = tuple(high + rest for high, rest in zip(map(max, zip(*amounts)), suffix_high[depth + 1]))
+            suffix_required[depth] = suffix_required[depth + 1] + (None not in slots[depth])
+            if depth == tail_start and len(tail_rows):
+                suffix_low[depth] = tuple(tail_totals.min(axis=0).tolist())
+                suffix_high[depth] = tuple(tail_totals.max(axis=0).tolist())
+
+        best = []  # Max-heap of (-score, tie, foods) holding the k best combinations
+        seen = set()
+        tie = itertools.count()
+
+        def offer(score, foods):
+            # Keep a combination if it is among the k best so far (each food set only once)
+            key = frozenset(foods)
+            if key in seen:
+                return
+            if len(best) < k:
+                heapq.heappush(best, (-score, next(tie), foods))
+            elif score < -best[0][0]:
+                _, _, removed = heapq.heapreplace(best, (-score, next(tie), foods))
+                seen.discard(frozenset(removed))
+            else:
+                return
+            seen.add(key)
+
+        def score_tail(totals, chosen, previous_index):
+            residual = (np.array(totals) - target_array) / scale_array
+            scores = tail_norms + 2 * (tail_scaled @ residual) + residual @ residual
+            valid = tail_sizes <= max_foods_per_meal - len(chosen)
+            if tail_same_pool:
+                valid &= tail_first_index > previous_index
+            if len(best) == k:
+                valid &= scores < -best[0][0]
+            candidates = np.flatnonzero(valid)
+            if chosen and len(candidates):
+                # Lookup table over food rows (plus one never chosen row for empty slots), only
+                # consulted for the rows that could still make the k best
+                chosen_mask = np.zeros(len(self.food_index.names) + 1, dtype=bool)
+                chosen_mask[[self.food_index.rows[food_name] for food_name in chosen]] = True
+                candidates = candidates[~chosen_mask[tail_lookup_rows[candidates]].any(axis=1)]
+            for row in candidates[np.argsort(scores[candidates], kind='stable')]:
+                if len(best) == k and scores[row] >= -best[0][0]:
+                    break
+                offer(float(scores[row]), chosen + tuple(self.food_index.names[food] for food in tail_rows[row]
+                                                         if food >= 0))
+
+        nodes_left = node_limit
+
+        def visit(depth, totals, chosen, previous_index):
+            nonlocal nodes_left
+            if nodes_left <= 0:
+                return  # Budget spent: keep the best combinations found so far
+            nodes_left -= 1
+            if depth == count:
+                offer(sum(((total - target) / scale) ** 2 for total, target, scale in zip(totals, targets, scales)),
+                      chosen)
+                return
+
+            # Bound: distance from each target to the range of totals still reachable
+            if len(best) == k:
+                lower_bound = 0
+                for total, low, high, target, scale in zip(totals, suffix_low[depth], suffix_high[depth],
+                                                           targets, scales):
+                    if total + low > target:
+                        lower_bound += ((total + low - target) / scale) ** 2
+                    elif total + high < target:
+                        lower_bound += ((target - total - high) / scale) ** 2
+                if lower_bound >= -best[0][0]:
+                    return
+
+                # Directional bound: along the unit vector from the scaled totals to the targets,
+                # each remaining slot (and the tail) can advance at most its best projection
+                if depth < tail_start < count and len(tail_rows):
+                    residual = (target_array - totals) / scale_array
+                    distance = float(np.sqrt(residual @ residual))
+                    if distance > 0:
+                        direction = residual / distance
+                        reach = float((tail_scaled @ direction).max()) + float(
+                            np.maximum.reduceat(suffix_scaled[depth] @ direction, suffix_starts[depth]).sum())
+                        if reach < distance and (distance - reach) ** 2 >= -best[0][0]:
+                            return
+            if len(chosen) + suffix_required[depth] > max_foods_per_meal:
+                return
+            if depth == tail_start:
+                score_tail(totals, chosen, previous_index)
+                return
+
+            # Consecutive slots drawing from the same pool take foods in increasing order
+            same_pool = depth > 0 and slots[depth] is slots[depth - 1]
+            for index, (food_name, nutrients) in enumerate(slot_values[depth]):
+                if food_name is None:
+                    visit(depth + 1, totals, chosen, index)
+                    continue
+                if food_name in chosen or (same_pool and index <= previous_index):
+                    continue
+                if len(chosen) >= max_foods_per_meal:
+                    continue
+                visit(depth + 1, tuple(total + amount for total, amount in zip(totals, nutrients)),
+                      chosen + (food_name,), index)
+
+        visit(0, (0,) * len(NUTRIENTS), (), -1)
+        return [(-negative_score, list(foods)) for negative_score, _, foods in sorted(best, reverse=True)]
+
+    def _slot_combinations(self, slots, slot_values, start):
+        """
+        Expand slots start.. of enumerate_meal_options into every valid combination at once:
+        returns the food rows of each combination (-1 for an empty slot), its nutrient totals and
+        the value index picked in the first slot. Combinations repeating a food, or taking foods
+        out of order from consecutive slots of the same pool, are left out.
+        """
+        sizes = [len(values) for values in slot_values[start:]]
+        picks = np.indices(sizes).reshape(len(sizes), -1).T
+        food_rows = np.empty(picks.shape, dtype=int)
+        totals = np.zeros((len(picks), len(NUTRIENTS)))
+        valid = np.ones(len(picks), dtype=bool)
+        for column, values in enumerate(slot_values[start:]):
+            rows = np.array([-1 if food_name is None else self.food_index.rows[food_name] for food_name, _ in values])
+            nutrients = np.array([nutrients for _, nutrients in values], dtype=float)
+            food_rows[:, column] = rows[picks[:, column]]
+            totals += nutrients[picks[:, column]]
+            if column > 0 and slots[start + column] is slots[start + column - 1]:
+                valid &= picks[:, column] > picks[:, column - 1]
+
+        ordered = np.sort(food_rows, axis=1)
+        valid &= ~((ordered[:, 1:] == ordered[:, :-1]) & (ordered[:, 1:] >= 0)).any(axis=1)
+        return food_rows[valid], totals[valid], picks[valid, 0]
 
     def _select_foods_for_meal(self, target_calories, target_protein, target_carbs, target_fat, meal_type,
-                               template=None):
+                               template=None, sources=None):
         """Select a combination of foods that meet the targets with better variety"""
         import random
         selected_foods = []
@@ -236,80 +1031,9 @@ class MealPlanCSP:
         current_carbs = 0
         current_fat = 0
 
-        # Create available foods dictionary with filtering by restrictions
-        available_foods = self._filter_available_foods(template)
-
-        # Categorize foods
-        protein_sources = []
-        carb_sources = []
-        fat_sources = []
-        veggie_sources = []
-        fruit_sources = []
-
-        # Categorize foods based on their dominant macro
-        for food_name, nutrition in available_foods.items():
-            # Skip foods that are excluded for this meal type
-            if template and "exclude" in template and food_name in template.get("exclude", []):
-                continue
-
-            # Protein-dominant foods
-            protein_per_calorie = nutrition['protein'] / max(nutrition['calories'], 1)
-            if protein_per_calorie >= 0.1 and "Protein" in food_name or "Egg" in food_name or "Chicken" in food_name or "Fish" in food_name or "Turkey" in food_name or "Tofu" in food_name or "Beef" in food_name or "Cottage" in food_name or "Greek" in food_name:
-                protein_sources.append((food_name, nutrition))
-
-            # Carb-dominant foods
-            carb_per_calorie = nutrition['carbs'] / max(nutrition['calories'], 1)
-            if carb_per_calorie >= 0.15 and "Rice" in food_name or "Potato" in food_name or "Bread" in food_name or "Oatmeal" in food_name or "Quinoa" in food_name:
-                carb_sources.append((food_name, nutrition))
-
-            # Fat-dominant foods
-            fat_per_calorie = nutrition['fat'] / max(nutrition['calories'], 1)
-            if fat_per_calorie >= 0.1 and "Oil" in food_name or "Butter" in food_name or "Avocado" in food_name or "Seeds" in food_name or "Almonds" in food_name or "Nuts" in food_name:
-                fat_sources.append((food_name, nutrition))
-
-            # Vegetables
-            if "Broccoli" in food_name or "Spinach" in food_name or "Greens" in food_name or "Asparagus" in food_name or "Cucumber" in food_name or "Carrot" in food_name or "Pepper" in food_name or "Zucchini" in food_name or "Cauliflower" in food_name or "Brussels" in food_name or "Tomato" in food_name or "Mushrooms" in food_name or "Green Beans" in food_name or "Kale" in food_name:
-                veggie_sources.append((food_name, nutrition))
-
-            # Fruits
-            if "Banana" in food_name or "Apple" in food_name or "Orange" in food_name or "Strawberries" in food_name or "Blueberries" in food_name or "Grapes" in food_name or "Pineapple" in food_name or "Mango" in food_name or "Watermelon" in food_name or "Kiwi" in food_name:
-                fruit_sources.append((food_name, nutrition))
-
-        # Prioritize template-preferred foods
-        preferred_proteins = []
-        preferred_carbs = []
-        preferred_fats = []
-        preferred_veggies = []
-
-        if template:
-            # Filter preferred protein sources
-            if "proteins" in template:
-                preferred_proteins = [(f, n) for f, n in protein_sources if f in template["proteins"]]
-
-            # Filter preferred carb sources
-            if "carbs" in template:
-                preferred_carbs = [(f, n) for f, n in carb_sources if f in template["carbs"]]
-
-            # Filter preferred fat sources
-            if "fats" in template:
-                preferred_fats = [(f, n) for f, n in fat_sources if f in template["fats"]]
-
-            # Filter preferred veggie sources
-            if "veggies" in template:
-                preferred_veggies = [(f, n) for f, n in veggie_sources if f in template["veggies"]]
-
-        # If no preferred foods found, use the original lists
-        if not preferred_proteins and protein_sources:
-            preferred_proteins = protein_sources
-
-        if not preferred_carbs and carb_sources:
-            preferred_carbs = carb_sources
-
-        if not preferred_fats and fat_sources:
-            preferred_fats = fat_sources
-
-        if not preferred_veggies and veggie_sources:
-            preferred_veggies = veggie_sources
+        if sources is None:
+            sources = self._meal_sources(template)
+        preferred_proteins, preferred_carbs, preferred_fats, preferred_veggies, fruit_sources = sources
 
         # Build the meal based on type
         max_foods_per_meal = 5
@@ -371,6 +1095,7 @@ class MealPlanCSP:
 
             # Add 1-2 vegetable sources
             veggie_count = min(2, len(preferred_veggies), max_foods_per_meal - len(selected_foods))
+            preferred_veggies = list(preferred_veggies)  # The sources may be shared
             random.shuffle(preferred_veggies)
             for i in range(veggie_count):
                 if i < len(preferred_veggies):
@@ -463,62 +1188,754 @@ class MealPlanCSP:
 
         return selected_foods
 
-    def _filter_available_foods(self, template=None):
-        """Filter available foods based on dietary restrictions"""
-        available_foods = {}
+    def _meal_sources(self, template):
+        """
+        Return the (name, nutrition) sources a meal draws from: preferred proteins, carbs, fats
+        and veggies (the template's picks, or every food of the category if none is available),
+        and fruits
+        """
+        # Available foods by category, filtered by restrictions and the template's exclusions;
+        # the view is precomputed and shared by every planner with the same restrictions
+        categorized = self._categorized_foods(template)
+        protein_sources = categorized['proteins']
+        carb_sources = categorized['carbs']
+        fat_sources = categorized['fats']
+        veggie_sources = categorized['veggies']
+        fruit_sources = categorized['fruits']
 
-        for food_name, nutrition in self.foods.items():
-            # Skip foods that are excluded for this meal type
-            if template and "exclude" in template and food_name in template.get("exclude", []):
-                continue
+        # Prioritize template-preferred foods
+        preferred_proteins = self._preferred_sources(protein_sources, template, "proteins")
+        preferred_carbs = self._preferred_sources(carb_sources, template, "carbs")
+        preferred_fats = self._preferred_sources(fat_sources, template, "fats")
+        preferred_veggies = self._preferred_sources(veggie_sources, template, "veggies")
+
+        # If no preferred foods found, use the original lists
+        if not preferred_proteins and protein_sources:
+            preferred_proteins = protein_sources
+
+        if not preferred_carbs and carb_sources:
+            preferred_carbs = carb_sources
+
+        if not preferred_fats and fat_sources:
+            preferred_fats = fat_sources
+
+        if not preferred_veggies and veggie_sources:
+            preferred_veggies = veggie_sources
+
+        return preferred_proteins, preferred_carbs, preferred_fats, preferred_veggies, fruit_sources
+
+    def _meal_slots(self, meal_type, template, sources=None):
+        """
+        Return the food slots of a meal as lists of food names, mirroring the structure of
+        _select_foods_for_meal; a None entry means the slot may stay empty
+        """
+        if sources is None:
+            sources = self._meal_sources(template)
+        proteins, carbs, fats, veggies, fruits = ([name for name, _ in category_sources]
+                                                  for category_sources in sources)
+        # Optional extra item topping up whichever macro falls short
+        extra = proteins + carbs + fats + [None]
+
+        if meal_type == "Breakfast":
+            slots = [proteins, carbs, fats, fruits, extra]
+        elif meal_type == "Lunch" or meal_type == "Dinner":
+            slots = [proteins, carbs, veggies, veggies, fats, extra]
+        elif "Snack" in meal_type:
+            slots = [proteins, fruits + carbs, fats, extra]
+        else:
+            slots = [extra]
+        return [slot for slot in slots if slot]
+
+    def _select_best_meal(self, target_calories, target_protein, target_carbs, target_fat, meal_type,
+                          template, candidate_meals, sources=None):
+        """
+        Draw candidate_meals random meals from the meal's slots and return the one closest to the
+        targets (sum of squared relative errors over calories, protein, carbs and fat). If every
+        draw repeats a food, the meal is built by _select_foods_for_meal instead.
+        """
+        import random
+        matrix = self.food_index.nutrient_matrix()
+        empty_row = len(matrix) - 1
+        rows = self.food_index.rows
+        slots = [np.array([empty_row if name is None else rows[name] for name in slot])
+                 for slot in self._meal_slots(meal_type, template, sources)]
+        if not slots:
+            return []
+
+        # Seed numpy from the random module so seeded runs stay reproducible
+        rng = np.random.default_rng(random.getrandbits(64))
+        candidates = np.column_stack([slot[rng.integers(len(slot), size=candidate_meals)] for slot in slots])
+
+        targets = np.array([target_calories, target_protein, target_carbs, target_fat])
+        totals = matrix[candidates].sum(axis=1)
+        scores = (((totals - targets) / np.maximum(targets, 1)) ** 2).sum(axis=1)
+
+        # A food may only appear once per meal
+        ordered = np.sort(candidates, axis=1)
+        repeated = ((ordered[:, 1:] == ordered[:, :-1]) & (ordered[:, 1:] != empty_row)).any(axis=1)
+        scores[repeated] = np.inf
+        if repeated.all():
+            return self._select_foods_for_meal(target_calories, target_protein, target_carbs, target_fat,
+                                               meal_type, template, sources)
+
+        best = candidates[int(np.argmin(scores))]
+        return [self.food_index.names[row] for row in best if row != empty_row]
+
+    def _solve_portions(self, meal, target_calories, target_protein, target_carbs, target_fat, sweeps=100):
+        """
+        Fit serving multipliers for the foods of a meal to its macro targets: bounded least squares
+        on the relative errors, min sum_k ((A x - t)_k / t_k)^2 with MIN_SERVINGS <= x <= MAX_SERVINGS,
+        solved by coordinate descent on the normal equations, then rounded to SERVING_STEP. A small
+        pull towards one serving per food keeps the problem well conditioned when a meal has more
+        foods than there are nutrients.
+        Without numpy every food stays at one serving.
+        """
+        if not meal or np is None:
+            return PortionedMeal(meal)
+
+        targets = np.array([target_calories, target_protein, target_carbs, target_fat])
+        weights = 1.0 / np.maximum(targets, 1) ** 2
+        nutrients = self.food_index.nutrient_matrix()[[self.food_index.rows[food_name] for food_name in meal]]
+        weighted = nutrients * weights
+        hessian = (weighted @ nutrients.T + PORTION_REGULARIZATION * np.eye(len(meal))).tolist()
+        linear = (weighted @ targets + PORTION_REGULARIZATION).tolist()
+
+        # The system is tiny (one variable per food), so plain floats beat numpy in the sweeps
+        size = len(meal)
+        servings = [1.0] * size
+        for _ in range(sweeps):
+            largest_step = 0.0
+            for j in range(size):
+                if hessian[j][j] <= 0:
+                    continue
+                gradient = sum(hessian[j][i] * servings[i] for i in range(size)) - linear[j]
+                value = min(max(servings[j] - gradient / hessian[j][j], MIN_SERVINGS), MAX_SERVINGS)
+                largest_step = max(largest_step, abs(value - servings[j]))
+                servings[j] = value
+            if largest_step < 1e-3:  # Far below SERVING_STEP
+                break
+
+        servings = {food_name: min(max(round(value / SERVING_STEP) * SERVING_STEP, MIN_SERVINGS), MAX_SERVINGS)
+                    for food_name, value in zip(meal, servings)}
+        return PortionedMeal(meal, servings)
+
+    def _solve_csp(self, meals, meal_plan, node_limit, deadline_ms):
+        """
+        Fill meal_plan by constraint satisfaction; return True on success.
+
+        Variables are the food slots of every meal (see _meal_slots) and their values are
+        (food, servings) pairs, servings from CSP_SERVINGS (optional slots may also stay empty).
+        Constraints are the daily calorie/protein/carb/fat windows of self.constraints, a
+        calorie window per meal around its share (CSP_MEAL_CALORIE_WINDOW) and no repeated food
+        within a meal. Depth-first search picks the variable with the fewest remaining values
+        (MRV), tries values that bring the projected day closest to the middle of the windows
+        first, and after each assignment runs forward checking with bounds consistency: a value
+        survives only if the constraint sums can still land in their windows given the smallest
+        and largest values left in the other variables' domains. Before searching, the sums of
+        the per-variable minima and maxima are checked against the windows, so inputs that
+        cannot fit (e.g. a restriction leaving too few carbs) fail at once.
+
+        All values of all variables live in one flat array, so the live domain is a sorted
+        array of value indices and propagation is a handful of vectorized operations over it.
+        Propagation is incremental: only the bounds of variables that lost values are
+        recomputed, and only live values are checked.
+        """
+        import random
+        matrix = self.food_index.nutrient_matrix()
+        rows = self.food_index.rows
+        servings = np.array(CSP_SERVINGS)
+
+        # Flat value table: owning variable, meal, food row (-1 for an empty slot), servings
+        variable_meals = []
+        value_variable, value_food, value_servings = [], [], []
+        for meal_index, (meal_name, _, template) in enumerate(meals):
+            for slot in self._meal_slots(meal_name, template):
+                foods = [rows[name] for name in slot if name is not None]
+                variable = len(variable_meals)
+                variable_meals.append(meal_index)
+                for food in foods:
+                    value_variable.extend([variable] * len(servings))
+                    value_food.extend([food] * len(servings))
+                    value_servings.extend(CSP_SERVINGS)
+                if None in slot:
+                    value_variable.append(variable)
+                    value_food.append(-1)
+                    value_servings.append(0.0)
+        if not variable_meals:
+            return False
+
+        value_variable = np.array(value_variable)
+        value_food = np.array(value_food)
+        value_servings = np.array(value_servings)
+        value_meal = np.array(variable_meals)[value_variable]
+        # (meal, food) id of every value; empty values map to a spare id that is never taken
+        key_count = len(meals) * len(matrix)
+        value_key = np.where(value_food >= 0, value_meal * len(matrix) + value_food, key_count)
+        values = matrix[value_food] * value_servings[:, None]  # Row -1 of the matrix is all zeros
+        starts = np.flatnonzero(np.r_[True, value_variable[1:] != value_variable[:-1]])
+        variable_count = len(variable_meals)
+        meal_members = np.array([[m == meal_index for m in variable_meals] for meal_index in range(len(meals))],
+                                dtype=float)
+
+        # Daily windows per nutrient, and a calorie window per meal (other nutrients unbounded)
+        daily_low = np.array([self.constraints[nutrient]['min'] for nutrient in NUTRIENTS])
+        daily_high = np.array([self.constraints[nutrient]['max'] for nutrient in NUTRIENTS])
+        meal_low = np.full((len(meals), len(NUTRIENTS)), -np.inf)
+        meal_high = np.full((len(meals), len(NUTRIENTS)), np.inf)
+        for meal_index, (_, targets, _) in enumerate(meals):
+            meal_low[meal_index, 0] = targets[0] * CSP_MEAL_CALORIE_WINDOW[0]
+            meal_high[meal_index, 0] = targets[0] * CSP_MEAL_CALORIE_WINDOW[1]
+
+        # Up-front infeasibility check: the smallest and largest sums each meal and the day can
+        # reach must overlap their windows
+        lows = np.minimum.reduceat(values, starts)
+        highs = np.maximum.reduceat(values, starts)
+        if ((meal_members @ lows > meal_high + 1e-9).any() or (meal_members @ highs < meal_low - 1e-9).any()
+                or (lows.sum(axis=0) > daily_high + 1e-9).any() or (highs.sum(axis=0) < daily_low - 1e-9).any()):
+            return False
+        variable_meals = np.array(variable_meals)
+
+        daily_middle = (daily_low + daily_high) / 2
+        daily_scale = np.maximum(daily_middle, 1)
+        deadline = time.perf_counter() + deadline_ms / 1000 if deadline_ms is not None else None
+        rng = np.random.default_rng(random.getrandbits(64))
+
+        def propagate(domain, lows, highs, changed):
+            # Shrink the domain (sorted live value indices) until every value can still meet every
+            # constraint; lows/highs hold the smallest and largest value per variable and nutrient
+            # and are only recomputed for the variables marked as changed
+            lows, highs = lows.copy(), highs.copy()
+            while True:
+                # No repeated food within a meal: a food fixed in one slot leaves its sibling slots
+                owners = value_variable[domain]
+                single = np.bincount(owners, minlength=variable_count)[owners] == 1
+                fixed = value_key[domain[single & (value_food[domain] >= 0)]]
+                taken = np.zeros(key_count + 1, dtype=bool)
+                taken[fixed] = True
+                if taken.sum() < len(fixed):
+                    return None
+                free = single | ~taken[value_key[domain]]
+                if not free.all():
+                    changed[owners[~free]] = True
+                    domain, owners = domain[free], owners[free]
+
+                recheck = changed[owners]
+                live, live_owners = domain[recheck], owners[recheck]
+                groups = np.flatnonzero(np.concatenate(([len(live) > 0], live_owners[1:] != live_owners[:-1])))
+                if len(groups) < changed.sum():
+                    return None  # A variable ran out of values
+                if len(groups):
+                    lows[live_owners[groups]] = np.minimum.reduceat(values[live], groups)
+                    highs[live_owners[groups]] = np.maximum.reduceat(values[live], groups)
+
+                # The window each variable's value must fall in, given the other variables' bounds
+                upper = np.minimum(daily_high - lows.sum(axis=0) + lows,
+                                   (meal_high - meal_members @ lows)[variable_meals] + lows)
+                lower = np.maximum(daily_low - highs.sum(axis=0) + highs,
+                                   (meal_low - meal_members @ highs)[variable_meals] + highs)
+                live_values = values[domain]
+                keep = ((live_values <= upper[owners] + 1e-9) & (live_values >= lower[owners] - 1e-9)).all(axis=1)
+                if keep.all():
+                    return domain, lows, highs
+                changed = np.zeros(variable_count, dtype=bool)
+                changed[owners[~keep]] = True
+                domain = domain[keep]
+
+        def search(domain, lows, highs, restart_at):
+            meal_plan.nodes_expanded += 1
+            if meal_plan.nodes_expanded > node_limit or (deadline is not None and time.perf_counter() > deadline):
+                meal_plan.budget_exhausted = True
+                return None
+            if meal_plan.nodes_expanded > restart_at:
+                return None
+
+            owners = value_variable[domain]
+            sizes = np.bincount(owners, minlength=variable_count)
+            if (sizes == 1).all():
+                return domain
+
+            # MRV: the variable with the fewest values left
+            variable = int(np.argmin(np.where(sizes > 1, sizes, np.iinfo(sizes.dtype).max)))
+            candidates = domain[owners == variable]
+
+            # Value ordering: projected day totals (domain midpoints elsewhere) closest to the
+            # middle of the daily windows, with a little noise for variety
+            middles = (lows + highs) / 2
+            projected = middles.sum(axis=0) - middles[variable] + values[candidates]
+            scores = (((projected - daily_middle) / daily_scale) ** 2).sum(axis=1)
+            scores += rng.random(len(candidates)) * 0.05
+
+            changed = np.arange(variable_count) == variable
+            for value in candidates[np.argsort(scores)]:
+                child = domain[(owners != variable) | (domain == value)]
+                propagated = propagate(child, lows, highs, changed.copy())
+                if propagated is None:
+                    continue
+                solution = search(*propagated, restart_at)
+                if solution is not None or meal_plan.budget_exhausted or meal_plan.nodes_expanded > restart_at:
+                    return solution
+            return None
+
+        propagated = propagate(np.arange(len(values)), lows, highs, np.zeros(variable_count, dtype=bool))
+        if propagated is None:
+            return False
+
+        # Randomized restarts with a growing node cutoff keep the search from thrashing in a
+        # hopeless subtree (the value ordering noise sends each restart elsewhere)
+        cutoff = CSP_RESTART_NODES
+        while True:
+            restart_at = meal_plan.nodes_expanded + cutoff
+            solution = search(*propagated, restart_at)
+            # Stop on a plan, on an exhausted budget, or when a run finished without being
+            # cut off (the whole space was searched)
+            if solution is not None or meal_plan.budget_exhausted or meal_plan.nodes_expanded <= restart_at:
+                break
+            cutoff *= 2
+        if solution is None:
+            return False
+
+        # Read the plan off the single remaining value of every variable
+        chosen = [[] for _ in meals]
+        for value in solution:
+            if value_food[value] >= 0:
+                chosen[value_meal[value]].append((self.food_index.names[value_food[value]],
+                                                  float(value_servings[value])))
+        for (meal_name, _, _), foods in zip(meals, chosen):
+            meal_plan.append((meal_name, PortionedMeal([name for name, _ in foods], dict(foods))))
+        return True
+
+    @staticmethod
+    def _preferred_sources(sources, template, category):
+        """Return the sources listed in the template for a category"""
+        if not template or category not in template:
+            return []
+        preferred = frozenset(template[category])
+        return [(f, n) for f, n in sources if f in preferred]
 
-            # Check dietary restrictions
-            should_exclude = False
-
-            # Define food categories for restrictions
-            dairy_foods = ["Milk", "Cheese", "Greek Yogurt", "Cottage Cheese", "Feta Cheese",
-                           "Mozzarella", "Cheddar", "Butter", "Yogurt"]
-            meat_foods = ["Chicken", "Salmon", "Beef", "Turkey", "Tuna", "Tilapia", "Shrimp",
-                          "Pork", "Cod", "Ground Turkey"]
-            nut_foods = ["Almonds", "Peanut Butter", "Almond Butter", "Walnuts", "Trail Mix"]
-            gluten_foods = ["Wheat", "Bread", "Pasta", "Flour Tortilla", "Ezekiel Bread",
-                            "Whole Wheat"]
-
-            # Apply appropriate restrictions
-            for restriction in self.constraints['restrictions']:
-                if restriction.lower() == "vegetarian":
-                    if any(meat in food_name for meat in meat_foods):
-                        should_exclude = True
-                elif restriction.lower() == "vegan":
-                    if any(meat in food_name for meat in meat_foods) or any(
-                            dairy in food_name for dairy in dairy_foods):
-                        should_exclude = True
-                elif restriction.lower() == "dairy":
-                    if any(dairy in food_name for dairy in dairy_foods):
-                        should_exclude = True
-                elif restriction.lower() == "nuts":
-                    if any(nut in food_name for nut in nut_foods):
-                        should_exclude = True
-                elif restriction.lower() == "gluten":
-                    if any(gluten in food_name for gluten in gluten_foods):
-                        should_exclude = True
-
-            # Only add foods that don't violate any restrictions
-            if not should_exclude:
-                available_foods[food_name] = nutrition
-
-        return available_foods
+    def _filter_available_foods(self, template=None):
+        """Filter available foods based on dietary restrictions (the result is a shared, cached view)"""
+        exclude = template.get("exclude", ()) if template else ()
+        return self.food_index.available(restriction_mask(self.constraints['restrictions']), exclude)
+
+    def _categorized_foods(self, template=None):
+        """The available foods grouped by category (see FoodIndex.categorized)"""
+        exclude = template.get("exclude", ()) if template else ()
+        return self.food_index.categorized(restriction_mask(self.constraints['restrictions']), exclude)
+
+
+# Fixed order of the muscle groups tracked by the workout planner. Search states are
+# tuples of weekly sets in this order, so they hash directly and compare cheaply.
+MUSCLE_GROUPS = ('chest', 'back', 'legs', 'shoulders', 'arms', 'core')
+MUSCLE_GROUP_INDEX = {muscle: i for i, muscle in enumerate(MUSCLE_GROUPS)}
+
+
+# Day templates for the workout builders, keyed by (day type, variant). Each slot is
+# (muscle_group, category, name_keywords, exercise_count, rep_range); every exercise is 3 sets.
+WORKOUT_DAY_TEMPLATES = {
+    ("push", "heavy"): (
+        ("chest", "compound", None, 2, "5-8"),
+        ("shoulders", "compound", None, 1, "5-8"),
+        ("shoulders", "isolation", None, 1, "8-12"),
+        ("arms", "compound", ("Tricep", "Close-Grip"), 1, "8-12"),
+        ("arms", "isolation", ("Tricep", "Skull", "Pushdown", "Extension"), 1, "8-12"),
+    ),
+    ("push", "moderate"): (
+        ("chest", "compound", None, 1, "8-12"),
+        ("chest", "isolation", None, 2, "8-12"),
+        ("shoulders", "compound", None, 1, "8-12"),
+        ("shoulders", "isolation", None, 1, "12-15"),
+        ("arms", "isolation", ("Tricep", "Skull", "Pushdown", "Extension"), 2, "12-15"),
+    ),
+    ("pull", "heavy"): (
+        ("back", "compound", None, 3, "5-8"),
+        ("back", "isolation", None, 1, "8-12"),
+        ("arms", "isolation", ("Curl",), 2, "8-12"),
+        ("shoulders", "isolation", ("Face Pull", "Reverse"), 1, "8-12"),
+    ),
+    ("pull", "moderate"): (
+        ("back", "compound", None, 2, "8-12"),
+        ("back", "isolation", None, 1, "8-12"),
+        ("arms", "isolation", ("Curl",), 3, "12-15"),
+        ("shoulders", "isolation", ("Face Pull", "Reverse"), 1, "12-15"),
+    ),
+    ("legs", "heavy"): (
+        ("legs", "compound", ("Squat", "Leg Press", "Hack"), 2, "5-8"),
+        ("legs", "compound", ("Deadlift", "Lunge", "Split"), 1, "5-8"),
+        ("legs", "isolation", None, 1, "8-12"),
+        ("legs", "isolation", ("Calf",), 1, "8-12"),
+        ("core", None, None, 1, "8-12"),
+    ),
+    ("legs", "moderate"): (
+        ("legs", "compound", ("Squat", "Leg Press", "Hack"), 1, "8-12"),
+        ("legs", "compound", ("Deadlift", "Lunge", "Split"), 1, "8-12"),
+        ("legs", "isolation", None, 2, "12-15"),
+        ("legs", "isolation", ("Calf",), 2, "12-15"),
+        ("core", None, None, 1, "12-15"),
+    ),
+    ("upper", "power"): (
+        ("chest", "compound", None, 1, "4-8"),
+        ("back", "compound", None, 1, "4-8"),
+        ("shoulders", "compound", None, 1, "6-10"),
+        ("arms", "isolation", ("Curl",), 1, "8-12"),
+        ("arms", "isolation", ("Tricep", "Skull"), 1, "8-12"),
+    ),
+    ("upper", "strength"): (
+        ("chest", "compound", None, 1, "4-8"),
+        ("chest", "isolation", None, 1, "4-8"),
+        ("back", "compound", None, 1, "4-8"),
+        ("back", "isolation", None, 1, "4-8"),
+        ("shoulders", "compound", None, 1, "6-10"),
+        ("shoulders", "isolation", None, 1, "6-10"),
+        ("arms", "isolation", ("Curl",), 1, "8-12"),
+        ("arms", "isolation", ("Tricep", "Skull"), 1, "8-12"),
+    ),
+    ("upper", "hypertrophy"): (
+        ("chest", "compound", None, 1, "8-12"),
+        ("chest", "isolation", None, 1, "8-12"),
+        ("back", "compound", None, 1, "8-12"),
+        ("back", "isolation", None, 1, "8-12"),
+        ("shoulders", "compound", None, 1, "10-15"),
+        ("shoulders", "isolation", None, 1, "10-15"),
+        ("arms", "isolation", ("Curl",), 1, "12-15"),
+        ("arms", "isolation", ("Tricep", "Skull"), 1, "12-15"),
+    ),
+    ("full_body", "balanced"): (
+        ("chest", "compound", None, 1, "8-12"),
+        ("back", "compound", None, 1, "8-12"),
+        ("legs", "compound", None, 2, "8-12"),
+        ("shoulders", "compound", None, 1, "8-12"),
+        ("arms", "isolation", None, 1, "10-15"),
+        ("core", None, None, 1, "12-15"),
+    ),
+    ("full_body", "push"): (
+        ("chest", "compound", None, 2, "6-10"),
+        ("shoulders", "compound", None, 1, "8-12"),
+        ("back", "compound", None, 1, "8-12"),
+        ("legs", "compound", None, 1, "8-12"),
+        ("arms", "isolation", ("Tricep",), 1, "10-15"),
+        ("core", None, None, 1, "12-15"),
+    ),
+    ("full_body", "pull"): (
+        ("back", "compound", None, 2, "6-10"),
+        ("arms", "isolation", ("Curl",), 1, "8-12"),
+        ("chest", "compound", None, 1, "8-12"),
+        ("legs", "compound", None, 1, "8-12"),
+        ("shoulders", "isolation", None, 1, "10-15"),
+        ("core", None, None, 1, "12-15"),
+    ),
+    ("full_body", "legs"): (
+        ("legs", "compound", None, 3, "6-10"),
+        ("chest", "compound", None, 1, "8-12"),
+        ("back", "compound", None, 1, "8-12"),
+        ("core", None, None, 2, "12-15"),
+    ),
+}
+
+# Upper limit on the sets a single workout can add (8 exercises of 3 sets)
+MAX_SETS_PER_DAY = 24
+
+
+class ExerciseIndex:
+    """Precomputed exercise lookups keyed by (muscle group, category) and name keyword family"""
+
+    # Name keyword families used by the workout builders (an exercise matches if its
+    # name contains any keyword of the family)
+    NAME_FAMILIES = (
+        ("Tricep", "Close-Grip"),
+        ("Tricep", "Skull", "Pushdown", "Extension"),
+        ("Tricep", "Skull"),
+        ("Tricep",),
+        ("Curl",),
+        ("Face Pull", "Reverse"),
+        ("Squat", "Leg Press", "Hack"),
+        ("Deadlift", "Lunge", "Split"),
+        ("Calf",),
+    )
+
+    # One index per exercise database, shared by every generator built on it
+    _cache = {}
+    _cache_limit = 8
+
+    def __init__(self, exercises):
+        self.exercises = exercises
+        self.signature = database_signature(exercises)
+        self.template_profiles = {}  # Day template volume/time, filled in by WorkoutPlanGenerator
+
+        # Bucket exercise names by (muscle group, category); category None means any category
+        buckets = {}
+        for exercise_name, properties in exercises.items():
+            muscle_group = properties['muscle_group']
+            buckets.setdefault((muscle_group, None), []).append(exercise_name)
+            if 'category' in properties:
+                buckets.setdefault((muscle_group, properties['category']), []).append(exercise_name)
+
+        self._lookup = {key: tuple(names) for key, names in buckets.items()}
+
+        # Precompute the keyword families for every bucket
+        for (muscle_group, category), names in list(self._lookup.items()):
+            for keywords in self.NAME_FAMILIES:
+                self._lookup[(muscle_group, category, keywords)] = self._match_keywords(names, keywords)
+
+    @classmethod
+    def for_database(cls, exercises):
+        """Return the index for an exercise database, built on first use and after invalidate"""
+        index = cls._cache.get(id(exercises))
+        if index is None or index.exercises is not exercises:
+            if len(cls._cache) >= cls._cache_limit:
+                cls._cache.pop(next(iter(cls._cache)))
+            index = cls(exercises)
+            cls._cache[id(exercises)] = index
+        return index
+
+    @classmethod
+    def invalidate(cls, exercises):
+        """Drop the index of an exercise database that was edited in place"""
+        index = cls._cache.get(id(exercises))
+        if index is not None and index.exercises is exercises:
+            del cls._cache[id(exercises)]
+
+    @staticmethod
+    def _match_keywords(names, keywords):
+        return tuple(name for name in names if any(keyword in name for keyword in keywords))
+
+    def lookup(self, muscle_group, category=None, name_keywords=None):
+        """Return exercise names for a muscle group, optional category and optional keyword family"""
+        category = category or None
+        if not name_keywords:
+            return self._lookup.get((muscle_group, category), ())
+
+        key = (muscle_group, category, tuple(name_keywords))
+        names = self._lookup.get(key)
+        if names is None:
+            # Keyword family not precomputed: derive it once from the base bucket
+            names = self._match_keywords(self._lookup.get((muscle_group, category), ()), key[2])
+            self._lookup[key] = names
+        return names
+
+
+class WorkoutPlan(list):
+    """A weekly plan, [(workout_name, workout), ...], with details on how the search produced it"""
+
+    def __init__(self, days=(), search_mode="astar", beam_width=None, deadline_ms=None):
+        super().__init__(days)
+        self.search_mode = search_mode  # "astar" or "beam"
+        self.beam_width = beam_width
+        self.deadline_ms = deadline_ms  # Anytime budget, None if the search was not time-limited
+        self.nodes_dropped = 0  # Nodes discarded by the frontier limit or the beam
+        self.deadline_reached = False  # True if the anytime budget expired during the search
+        self.best_so_far = False  # True if the best complete week was returned instead of a goal plan
+        self.used_fallback = False  # True if the rule-based fallback plan was returned
+        self.weekly_sets = None  # Sets per muscle group of the returned week, in MUSCLE_GROUPS order
+        self.stats = None  # SearchStats if statistics were requested
+
+
+class SearchStats:
+    """Opt-in counters and per-phase timings (seconds) for one workout plan search"""
+
+    def __init__(self):
+        self.split_type = None
+        self.days_per_week = None
+        self.target_sets_per_group = None
+        self.iterations = 0  # Frontier pops (A*) or beam node expansions
+        self.nodes_expanded = 0
+        self.nodes_generated = 0
+        self.nodes_dropped = 0
+        self.nodes_pruned = 0  # Nodes that could no longer reach the target (searched last)
+        self.peak_frontier = 0
+        self.explored_size = 0
+        self.successor_time = 0.0
+        self.heuristic_time = 0.0
+        self.total_time = 0.0
+        self.used_fallback = False
+
+    def timed(self, func, attribute):
+        """Wrap func so its run time is added to the given timing attribute"""
+        def wrapper(*args):
+            start = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                setattr(self, attribute, getattr(self, attribute) + time.perf_counter() - start)
+        return wrapper
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class _AnytimeTracker:
+    """Best complete-week plan of a search, and the wall-clock budget for anytime planning"""
+
+    def __init__(self, deadline_ms, target):
+        self.deadline = time.perf_counter() + deadline_ms / 1000.0 if deadline_ms is not None else float('inf')
+        self.target = target
+        self.expired = False
+        self.best_score = None
+        self.best_plan = None
+
+    def out_of_time(self):
+        if not self.expired and time.perf_counter() >= self.deadline:
+            self.expired = True
+        return self.expired
+
+    def offer(self, state, cost, plan_node):
+        """Keep a complete week if it beats the incumbent on (remaining volume deficit, workout time)"""
+        score = (sum(max(0, self.target - sets) for sets in state), cost)
+        if self.best_score is None or score < self.best_score:
+            self.best_score = score
+            self.best_plan = plan_node
+
+
+class PatternDatabase:
+    """
+    Exact cost-to-go table for a fixed split schedule over discretized muscle-volume states.
+
+    Volume only grows in 3-set steps, so each muscle group is stored as the level
+    min(sets // 3, ceil(target / 3)) without losing information: the table is exact, not just
+    a lower bound. Costs are workout minutes in half-minute units, kept as unsigned 16-bit
+    values with UNREACHABLE for states that cannot reach the target in the remaining days.
+    Tables are keyed by the target and the schedule's per-day (volume, workout time), so a
+    different exercise database gets its own table. They are loaded lazily from `directory`
+    (see build_pattern_databases.py) or, failing that, built in memory with numpy.
+    """
+
+    MAGIC = b'FPDB'
+    VERSION = 1
+    UNREACHABLE = 0xFFFF
+    directory = os.environ.get('FITAI_PDB_DIR',
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pattern_databases'))
+
+    _cache = {}
+
+    def __init__(self, days, levels, table):
+        self.days = days
+        self.levels = levels
+        self.states = (levels + 1) ** len(MUSCLE_GROUPS)
+        self.table = table  # array('H') of (days + 1) layers, one entry per discretized state
+
+    @classmethod
+    def key(cls, target, schedule):
+        return hashlib.sha1(repr((cls.VERSION, target, tuple(schedule))).encode()).hexdigest()[:16]
+
+    @classmethod
+    def path_for(cls, target, schedule):
+        return os.path.join(cls.directory, f"{cls.key(target, schedule)}.pdb")
+
+    @classmethod
+    def for_schedule(cls, target, schedule):
+        """Return the table for a schedule of per-day (volume, workout time), or None if unavailable"""
+        key = cls.key(target, schedule)
+        if key not in cls._cache:
+            path = cls.path_for(target, schedule)
+            if os.path.exists(path):
+                cls._cache[key] = cls.load(path)
+            else:
+                cls._cache[key] = cls.build(target, schedule)
+        return cls._cache[key]
+
+    @classmethod
+    def build(cls, target, schedule):
+        """Compute the table by backward induction over the days of the schedule (requires numpy)"""
+        if np is None:
+            return None
+
+        levels = -(-target // 3)
+        radix = levels + 1
+        days = len(schedule)
+        muscle_count = len(MUSCLE_GROUPS)
+
+        # Level of every muscle group for every state index (first muscle group is most significant)
+        level_grid = np.indices((radix,) * muscle_count).reshape(muscle_count, -1)
+        weights = (radix ** np.arange(muscle_count - 1, -1, -1))[:, None]
+        goal = (level_grid >= levels).all(axis=0)
+
+        table = np.full((days + 1, radix ** muscle_count), cls.UNREACHABLE, dtype=np.int64)
+        table[days][goal] = 0
+        for day_number in reversed(range(days)):
+            volume, workout_time = schedule[day_number]
+            added = np.array([sets // 3 for sets in volume])[:, None]
+            next_index = (np.minimum(level_grid + added, levels) * weights).sum(axis=0)
+            next_cost = table[day_number + 1][next_index]
+            cost = np.where(next_cost == cls.UNREACHABLE, cls.UNREACHABLE,
+                            np.minimum(next_cost + int(workout_time * 2), cls.UNREACHABLE - 1))
+            cost[goal] = 0
+            table[day_number] = cost
+
+        return cls(days, levels, array('H', table.astype('<u2').tobytes()))
+
+    def save(self, path):
+        """Write the table as a small header followed by the raw little-endian uint16 array"""
+        table = self.table
+        if sys.byteorder == 'big':
+            table = array('H', table)
+            table.byteswap()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(self.MAGIC + bytes([self.VERSION, self.days, self.levels, 0]))
+            table.tofile(f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            header = f.read(8)
+            if header[:4] != cls.MAGIC or header[4] != cls.VERSION:
+                raise ValueError(f"Not a version {cls.VERSION} pattern database: {path}")
+            days, levels = header[5], header[6]
+            table = array('H')
+            table.frombytes(f.read())
+        if sys.byteorder == 'big':
+            table.byteswap()
+        pattern_database = cls(days, levels, table)
+        if len(table) != (days + 1) * pattern_database.states:
+            raise ValueError(f"Truncated pattern database: {path}")
+        return pattern_database
+
+    def heuristic(self, state, target, day_number, split_type, days_per_week):
+        """Drop-in replacement for WorkoutPlanGenerator._heuristic: exact remaining workout time"""
+        levels = self.levels
+        index = 0
+        for sets in state:
+            level = sets // 3
+            index = index * (levels + 1) + (level if level < levels else levels)
+        cost = self.table[day_number * self.states + index]
+        return float('inf') if cost == self.UNREACHABLE else cost / 2
 
 
 class WorkoutPlanGenerator:
     """Generate workout plans using A* search algorithm with split-specific guidance"""
 
+    # Use exact pattern database heuristics for fixed splits (see PatternDatabase)
+    use_pattern_database = True
+
     def __init__(self, exercises, user_profile):
         self.exercises = exercises
         self.user = user_profile
+        self.exercise_index = ExerciseIndex.for_database(exercises)
 
-    def generate_workout_plan(self, days_per_week=4, split_type=None):
-        """Generate a weekly workout plan using A* search with split guidance"""
+    def generate_workout_plan(self, days_per_week=4, split_type=None, beam_width=None, deadline_ms=None,
+                              collect_stats=False, stats_callback=None, engine="astar"):
+        """
+        Generate a weekly workout plan using A* search with split guidance.
+
+        engine="dp" uses the exact dynamic-programming solver instead (see _dp_search), which
+        also chooses how many exercises each muscle group gets per day; beam_width and
+        deadline_ms only apply to the A* engine.
+
+        If beam_width is given, a layered beam search keeping the beam_width best nodes
+        per day is used instead, bounding memory and latency. If deadline_ms is given the
+        search runs in anytime mode: when the wall-clock budget expires the best complete week
+        seen so far is returned. That week is also returned if a search ends without reaching
+        the goal, so the rule-based fallback is only used when no complete week was seen.
+
+        With collect_stats (or a stats_callback, called with the SearchStats once the plan is
+        built) the search records counters and per-phase timings in the plan's stats attribute.
+        Returns a WorkoutPlan.
+        """
+        if engine not in ("astar", "dp"):
+            raise ValueError(f"Unknown planning engine: {engine}")
+
+        stats = SearchStats() if collect_stats or stats_callback is not None else None
+        if stats is not None:
+            start_time = time.perf_counter()
 
         # Validate days_per_week is within reasonable bounds
         days_per_week = max(2, min(7, days_per_week))  # Ensure between 2-7 days
@@ -527,70 +1944,154 @@ class WorkoutPlanGenerator:
         if not split_type:
             split_type = self._determine_split_type(days_per_week)
 
-        # Define muscle groups and their target weekly volume
-        muscle_groups = ['chest', 'back', 'legs', 'shoulders', 'arms', 'core']
+        # Target weekly sets for every muscle group
+        target_sets_per_group = self._target_sets_per_group(self.user.goals, days_per_week)
 
+        if engine == "dp":
+            search_mode = "dp"
+        else:
+            search_mode = "beam" if beam_width else "astar"
+        result = WorkoutPlan(search_mode=search_mode, beam_width=beam_width, deadline_ms=deadline_ms)
+        result.stats = stats
+        if stats is not None:
+            stats.split_type = split_type
+            stats.days_per_week = days_per_week
+            stats.target_sets_per_group = target_sets_per_group
+        anytime = _AnytimeTracker(deadline_ms, target_sets_per_group)
+
+        if engine == "dp":
+            plan_node = self._dp_search(target_sets_per_group, days_per_week, split_type, result)
+        elif beam_width:
+            plan_node = self._beam_search(target_sets_per_group, days_per_week, split_type, beam_width, result,
+                                          anytime)
+        else:
+            plan_node = self._astar_search(target_sets_per_group, days_per_week, split_type, result, anytime)
+
+        result.deadline_reached = anytime.expired
+        if plan_node is None and anytime.best_plan is not None:
+            # No goal reached (within budget): use the best complete week found so far
+            plan_node = anytime.best_plan
+            result.best_so_far = True
+
+        if plan_node is not None:
+            result.extend(self._materialize_plan(plan_node))
+        else:
+            # If no solution found or max iterations reached, fall back to rule-based approach
+            result.used_fallback = True
+            result.extend(self._fallback_workout_plan(days_per_week, split_type))
+        result.weekly_sets = self._weekly_sets(result)
+
+        if stats is not None:
+            stats.nodes_dropped = result.nodes_dropped
+            stats.used_fallback = result.used_fallback
+            stats.total_time = time.perf_counter() - start_time
+            if stats_callback is not None:
+                stats_callback(stats)
+
+        return result
+
+    def _weekly_sets(self, plan):
+        """Sets per muscle group (MUSCLE_GROUPS order) of a [(workout_name, workout), ...] plan"""
+        weekly_sets = [0] * len(MUSCLE_GROUPS)
+        for _, workout in plan:
+            for exercise in workout:
+                exercise_name, sets = exercise[:2] if isinstance(exercise, tuple) else (exercise, 3)
+                muscle_group = self.exercises.get(exercise_name, {}).get('muscle_group')
+                if muscle_group in MUSCLE_GROUP_INDEX:
+                    weekly_sets[MUSCLE_GROUP_INDEX[muscle_group]] += sets
+        return tuple(weekly_sets)
+
+    @staticmethod
+    def _target_sets_per_group(goals, days_per_week):
+        """Weekly sets each muscle group should reach for a user's goals and training days"""
         # Target sets per muscle group (can be adjusted based on goal)
-        if "muscle gain" in self.user.goals:
+        if "muscle gain" in goals:
             target_sets_per_group = 14  # Higher volume for hypertrophy
-        elif "athletic" in self.user.goals:
+        elif "athletic" in goals:
             target_sets_per_group = 12  # Balanced for athletic performance
-        elif "health" in self.user.goals:
+        elif "health" in goals:
             target_sets_per_group = 10  # Moderate for general health
         else:
             target_sets_per_group = 12  # Default
 
         # For fewer training days, we need to adjust the target
         # to be achievable within the given days_per_week
-        max_sets_per_day = 24  # Reasonable upper limit of sets per workout
-        max_possible_sets = days_per_week * max_sets_per_day / len(muscle_groups)
+        max_sets_per_day = MAX_SETS_PER_DAY  # Reasonable upper limit of sets per workout
+        max_possible_sets = days_per_week * max_sets_per_day / len(MUSCLE_GROUPS)
         if target_sets_per_group > max_possible_sets:
             target_sets_per_group = int(max_possible_sets)
 
-        # Initialize A* search
-        initial_state = {muscle: 0 for muscle in muscle_groups}
-        frontier = [(initial_state, [], 0)]  # (state, plan, cost)
-        explored = set()  # Track explored states
+        return target_sets_per_group
+
+    def _astar_search(self, target_sets_per_group, days_per_week, split_type, result, anytime=None):
+        """Run A* over muscle-volume states; return the goal plan chain or None"""
+        heuristic = self._search_heuristic(split_type, days_per_week, target_sets_per_group)
+        goal, heuristic = self._reachable_goal(split_type, days_per_week, target_sets_per_group, heuristic, result)
+        generate_successors = self._generate_workout_successors
+        stats = result.stats
+        if stats is not None:
+            heuristic = stats.timed(heuristic, 'heuristic_time')
+            generate_successors = stats.timed(generate_successors, 'successor_time')
+
+        # Frontier is a binary heap of (f, tie_breaker, g, state, plan_node, days). f = g + h is
+        # computed once when a node is pushed; the insertion counter breaks ties deterministically (FIFO).
+        # Partial plans are parent-pointer chains (see _extend_plan) shared between successors
+        initial_state = (0,) * len(MUSCLE_GROUPS)
+        initial_h = heuristic(initial_state, target_sets_per_group, 0, split_type, days_per_week)
+
+        tie_breaker = itertools.count()
+        frontier = [(initial_h, next(tie_breaker), 0, initial_state, None, 0)]
+        # The heuristic depends on the day as well as the volume, so nodes are (state, day) pairs
+        best_cost = {}  # Cheapest cost found so far for each node
+        explored = set()  # Track explored nodes
 
         # A* search
         iterations = 0
         max_iterations = 1000  # Prevent infinite loops
+        frontier_limit = 100  # Keep at most the best 100 nodes (trimmed once the heap doubles)
 
         while frontier and iterations < max_iterations:
             iterations += 1
+            if stats is not None:
+                stats.iterations += 1
 
-            # If frontier is empty, break
-            if not frontier:
+            # Stop when the anytime budget is used up
+            if anytime is not None and anytime.out_of_time():
                 break
 
-            # Sort frontier by f(n) = g(n) + h(n)
-            frontier.sort(key=lambda x: x[2] + self._heuristic(x[0], target_sets_per_group))
-            current_state, current_plan, current_cost = frontier.pop(0)
+            # Pop the node with the lowest f(n) = g(n) + h(n)
+            _, _, current_cost, current_state, current_plan, planned_days = heapq.heappop(frontier)
 
-            # Convert state to hashable form for tracking explored states
-            state_tuple = tuple(sorted(current_state.items()))
-            if state_tuple in explored:
+            # Lazy deletion: skip entries for states that were already expanded
+            # or that have since been reached more cheaply
+            node = (current_state, planned_days)
+            if node in explored or current_cost > best_cost.get(node, current_cost):
                 continue
 
-            explored.add(state_tuple)
+            explored.add(node)
+            if stats is not None:
+                stats.explored_size += 1
 
-            # Check if we've reached goal state (all muscle groups have target sets)
-            if all(sets >= target_sets_per_group for muscle, sets in current_state.items()):
+            # Check if we've reached goal state (all muscle groups have their reachable target sets)
+            if all(sets >= needed for sets, needed in zip(current_state, goal)):
                 # We found our solution
                 return current_plan
 
             # If we've already planned enough days, continue to next state
-            if len(current_plan) >= days_per_week:
+            if planned_days >= days_per_week:
                 continue
 
             # Generate possible next workouts based on the split type and current day
-            next_workouts = self._generate_workout_successors(
+            next_workouts = generate_successors(
                 current_state,
                 target_sets_per_group,
-                len(current_plan),
+                planned_days,
                 split_type,
                 days_per_week
             )
+            if stats is not None:
+                stats.nodes_expanded += 1
+                stats.nodes_generated += len(next_workouts)
 
             # If no successors were generated, continue to next state
             if not next_workouts:
@@ -600,23 +2101,307 @@ class WorkoutPlanGenerator:
                 # Calculate new cost (workout time is our cost metric)
                 new_cost = current_cost + self._calculate_workout_time(workout)
 
-                # Create new state tuple for checking if we've seen this state
-                new_state_tuple = tuple(sorted(new_state.items()))
+                # Skip states already expanded or already queued with a cheaper (or equal) cost
+                new_node = (new_state, planned_days + 1)
+                if new_node in explored or new_cost >= best_cost.get(new_node, float('inf')):
+                    continue
+
+                new_plan = self._extend_plan(current_plan, workout_name, workout)
+                if anytime is not None and planned_days + 1 == days_per_week:
+                    anytime.offer(new_state, new_cost, new_plan)
+
+                # States that can no longer reach the target in the remaining days get f = inf:
+                # they are only expanded once no other state is left, to find the closest week
+                h_score = heuristic(new_state, target_sets_per_group, planned_days + 1, split_type, days_per_week)
+                if h_score == float('inf') and stats is not None:
+                    stats.nodes_pruned += 1
+
+                best_cost[new_node] = new_cost
+                f_score = new_cost + h_score
+                heapq.heappush(frontier, (f_score, next(tie_breaker), new_cost, new_state, new_plan,
+                                          planned_days + 1))
+
+            if stats is not None and len(frontier) > stats.peak_frontier:
+                stats.peak_frontier = len(frontier)
+
+            # Limit frontier size for performance: keep the best nodes by f-score.
+            # A sorted list is a valid heap, and trimming only on doubling keeps this amortized O(log n)
+            if len(frontier) > 2 * frontier_limit:
+                result.nodes_dropped += len(frontier) - frontier_limit
+                frontier = heapq.nsmallest(frontier_limit, frontier)
+
+        return None
+
+    def _beam_search(self, target_sets_per_group, days_per_week, split_type, beam_width, result, anytime=None):
+        """Layered beam search: keep only the beam_width best nodes by f-score for each planned day"""
+        heuristic = self._search_heuristic(split_type, days_per_week, target_sets_per_group)
+        goal, heuristic = self._reachable_goal(split_type, days_per_week, target_sets_per_group, heuristic, result)
+        generate_successors = self._generate_workout_successors
+        stats = result.stats
+        if stats is not None:
+            heuristic = stats.timed(heuristic, 'heuristic_time')
+            generate_successors = stats.timed(generate_successors, 'successor_time')
+
+        initial_state = (0,) * len(MUSCLE_GROUPS)
+        initial_h = heuristic(initial_state, target_sets_per_group, 0, split_type, days_per_week)
+
+        tie_breaker = itertools.count()
+        beam = [(initial_h, 0, 0, initial_state, None)]
+
+        for day_number in range(days_per_week + 1):
+            # Return the cheapest goal state reached so far
+            goals = [node for node in beam if all(sets >= needed for sets, needed in zip(node[3], goal))]
+            if goals:
+                return min(goals, key=lambda node: (node[2], node[1]))[4]
+
+            if day_number == days_per_week:
+                break
+
+            # Bounded max-heap of (-f, -tie_breaker, g, state, plan_node): the root is the worst
+            # candidate, so it is the one evicted once the heap holds beam_width nodes
+            candidates = []
+            layer_cost = {}  # Cheapest cost per state within this layer
+            for _, _, current_cost, current_state, current_plan in beam:
+                if anytime is not None and anytime.out_of_time():
+                    return None
+
+                next_workouts = generate_successors(
+                    current_state,
+                    target_sets_per_group,
+                    day_number,
+                    split_type,
+                    days_per_week
+                )
+                if stats is not None:
+                    stats.iterations += 1
+                    stats.nodes_expanded += 1
+                    stats.nodes_generated += len(next_workouts)
+
+                for workout_name, workout, new_state in next_workouts:
+                    new_cost = current_cost + self._calculate_workout_time(workout)
+                    if new_cost >= layer_cost.get(new_state, float('inf')):
+                        continue
+                    layer_cost[new_state] = new_cost
+
+                    new_plan = self._extend_plan(current_plan, workout_name, workout)
+                    if anytime is not None and day_number + 1 == days_per_week:
+                        anytime.offer(new_state, new_cost, new_plan)
+
+                    # States that can no longer reach the target in the remaining days get f = inf,
+                    # so they only fill the beam when there are too few other candidates
+                    h_score = heuristic(new_state, target_sets_per_group, day_number + 1, split_type, days_per_week)
+                    if h_score == float('inf') and stats is not None:
+                        stats.nodes_pruned += 1
+
+                    f_score = new_cost + h_score
+
+                    entry = (-f_score, -next(tie_breaker), new_cost, new_state, new_plan)
+                    if len(candidates) < beam_width:
+                        heapq.heappush(candidates, entry)
+                    else:
+                        heapq.heappushpop(candidates, entry)
+                        result.nodes_dropped += 1
+
+            if stats is not None:
+                stats.explored_size += len(layer_cost)
+                stats.peak_frontier = max(stats.peak_frontier, len(candidates))
+
+            if not candidates:
+                break
 
-                # Only add to frontier if we haven't exceeded the days or
-                # if it's a better plan than what we've seen
-                if new_state_tuple not in explored:
-                    new_plan = current_plan + [(workout_name, workout)]
-                    frontier.append((new_state, new_plan, new_cost))
+            # Next layer, best first
+            beam = sorted((-neg_f, -neg_tie, cost, state, plan)
+                          for neg_f, neg_tie, cost, state, plan in candidates)
 
-            # Limit frontier size for performance
-            if len(frontier) > 100:
-                frontier = frontier[:100]
+        return None
 
-        # If no solution found or max iterations reached, fall back to rule-based approach
-        return self._fallback_workout_plan(days_per_week, split_type)
+    def _reachable_goal(self, split_type, days_per_week, target, heuristic, result):
+        """
+        Return (weekly sets each muscle group must reach, heuristic) for A* and beam search.
 
-    def _determine_split_type(self, days_per_week):
+        A muscle group the split cannot bring to the target in the available days only has to
+        reach what the split can deliver, so the search plans the closest reachable week instead
+        of pruning every plan at the root. Search states keep the real volume; only the
+        heuristic sees the unreachable shortfall (rounded up to whole 3-set exercises) credited.
+        Such plans fall short of the target and are flagged best_so_far, like the DP engine's.
+        """
+        capacity, _ = self._split_bounds(split_type, days_per_week)[0]
+        if all(sets >= target for sets in capacity):
+            return (target,) * len(capacity), heuristic
+
+        result.best_so_far = True
+        full_target = -(-target // 3) * 3
+        credit = tuple(full_target - sets if sets < target else 0 for sets in capacity)
+
+        def credited_heuristic(state, *args):
+            return heuristic(tuple(sets + extra for sets, extra in zip(state, credit)), *args)
+        return tuple(min(sets, target) for sets in capacity), credited_heuristic
+
+    def _dp_search(self, target_sets_per_group, days_per_week, split_type, result):
+        """
+        Exact weekly volume solver: forward dynamic programming over (day, discretized volume).
+
+        Each day takes one of the split's day types for that day (any of them for the flexible
+        split) with one of its exercise-count variants (see _dp_day_variants). Volume is tracked
+        per muscle group in 3-set levels capped at the target, and each state keeps only its
+        cheapest way in, so the result is the minimum-workout-time plan that meets the target.
+        If the target cannot be met, the plan with the smallest remaining deficit (then the
+        least time) over the full week is returned. Never falls back.
+        """
+        stats = result.stats
+        levels = -(-target_sets_per_group // 3)
+        muscle_count = len(MUSCLE_GROUPS)
+        exercises_per_day = MAX_SETS_PER_DAY // 3
+
+        # layers[day][state] = (time, back pointer (previous state, workout name, template key, counts))
+        layers = [{(0,) * muscle_count: (0, None)}]
+        best_goal = None  # (time, day, state) of the cheapest plan reaching the target
+
+        for day_number in range(days_per_week):
+            options = [(workout_name, template_key, self._dp_day_variants(template_key))
+                       for workout_name, template_key in self._day_options(split_type, day_number)]
+            next_layer = {}
+            for state, (current_time, _) in layers[-1].items():
+                # Plans that cannot finish cheaper than the best goal plan cannot win: every
+                # missing level needs one more exercise, spread over at least ceil(n / 8) workouts
+                if best_goal is not None:
+                    exercises_needed = sum(levels - level for level in state)
+                    workouts_needed = -(-exercises_needed // exercises_per_day)
+                    if current_time + exercises_needed * 10.5 + workouts_needed * 5 >= best_goal[0]:
+                        continue
+                if stats is not None:
+                    stats.nodes_expanded += 1
+
+                for workout_name, template_key, variants in options:
+                    for counts in self._dp_useful_variants(state, variants, levels):
+                        new_state = tuple(min(level + count, levels) for level, count in zip(state, counts))
+                        # Same cost as _calculate_workout_time: 10.5 min per exercise plus warmup
+                        new_time = current_time + sum(counts) * 10.5 + 5
+                        if stats is not None:
+                            stats.nodes_generated += 1
+                        if new_time >= next_layer.get(new_state, (float('inf'),))[0]:
+                            continue
+                        next_layer[new_state] = (new_time, (state, workout_name, template_key, counts))
+                        if min(new_state) >= levels and (best_goal is None or new_time < best_goal[0]):
+                            best_goal = (new_time, day_number + 1, new_state)
+
+            # Goal states end the plan; only the others are extended on the next day
+            layers.append({state: entry for state, entry in next_layer.items() if min(state) < levels})
+            if best_goal is not None and best_goal[1] == day_number + 1:
+                layers[-1][best_goal[2]] = next_layer[best_goal[2]]
+            if stats is not None:
+                stats.iterations += 1
+                stats.explored_size += len(next_layer)
+                stats.peak_frontier = max(stats.peak_frontier, len(next_layer))
+
+        if best_goal is not None:
+            _, day_number, state = best_goal
+        else:
+            # Target unreachable: smallest remaining deficit, then least time, after the full week
+            final_layer = layers[days_per_week]
+            if not final_layer:
+                return None
+            day_number = days_per_week
+            state = min(final_layer, key=lambda s: (sum(levels - level for level in s), final_layer[s][0]))
+            result.best_so_far = True
+
+        # Walk the back pointers, then pick concrete exercises day by day
+        days = []
+        while day_number > 0:
+            _, (previous_state, workout_name, template_key, counts) = layers[day_number][state]
+            days.append((workout_name, template_key, counts))
+            state = previous_state
+            day_number -= 1
+
+        plan_node = None
+        for workout_name, template_key, counts in reversed(days):
+            plan_node = self._extend_plan(plan_node, workout_name, self._build_dp_workout(template_key, counts))
+        return plan_node
+
+    def _dp_day_variants(self, template_key):
+        """
+        Exercise-count variants of a day template for the DP engine, as per-muscle-group count
+        tuples. Every muscle group the template trains gets one exercise fewer, the template's
+        count, or one more (at least 1 and at most what the database offers), and a workout
+        holds at most MAX_SETS_PER_DAY sets.
+        """
+        key = ("dp_variants", template_key)
+        variants = self.exercise_index.template_profiles.get(key)
+        if variants is None:
+            base = [0] * len(MUSCLE_GROUPS)
+            available = [set() for _ in MUSCLE_GROUPS]
+            for muscle_group, category, name_keywords, count, _ in WORKOUT_DAY_TEMPLATES[template_key]:
+                pool = self._filter_exercises(muscle_group, category, name_keywords)
+                base[MUSCLE_GROUP_INDEX[muscle_group]] += min(count, len(pool))
+                available[MUSCLE_GROUP_INDEX[muscle_group]].update(pool)
+
+            choices = []
+            for count, pool in zip(base, available):
+                options = [c for c in (count - 1, count, count + 1) if 0 < c <= len(pool)]
+                choices.append(options if count and options else [0])
+
+            variants = [counts for counts in itertools.product(*choices)
+                        if sum(counts) * 3 <= MAX_SETS_PER_DAY]
+            self.exercise_index.template_profiles[key] = variants
+        return variants
+
+    @staticmethod
+    def _dp_useful_variants(state, variants, levels):
+        """
+        Drop dominated variants: once a muscle group would reach the target, any larger count
+        for it only adds time, so only the smallest count reaching the target is kept.
+        """
+        useful = []
+        for counts in variants:
+            for level, count in zip(state, counts):
+                # A smaller count would already reach the cap if count - 1 does (counts step by 1)
+                if count > 1 and level + count - 1 >= levels:
+                    break
+            else:
+                useful.append(counts)
+        return useful or variants
+
+    def _build_dp_workout(self, template_key, counts):
+        """Pick concrete exercises for a day template with per-muscle-group exercise counts"""
+        template = WORKOUT_DAY_TEMPLATES[template_key]
+        remaining = list(counts)
+        used = set()
+        slot_exercises = [[] for _ in template]
+
+        # First fill each slot up to its template count, then spread any extra exercises
+        # over the muscle group's slots in template order
+        for fill_to_template in (True, False):
+            for slot, (muscle_group, category, name_keywords, count, rep_range) in enumerate(template):
+                index = MUSCLE_GROUP_INDEX[muscle_group]
+                wanted = min(count, remaining[index]) if fill_to_template else remaining[index]
+                if wanted <= 0:
+                    continue
+                pool = [name for name in self._filter_exercises(muscle_group, category, name_keywords)
+                        if name not in used]
+                selected_exercises = self._pick_exercises(pool, wanted, rep_range)
+                slot_exercises[slot].extend(selected_exercises)
+                used.update(name for name, _, _ in selected_exercises)
+                remaining[index] -= len(selected_exercises)
+
+        return [exercise for exercises in slot_exercises for exercise in exercises]
+
+    @staticmethod
+    def _extend_plan(plan_node, workout_name, workout):
+        """Append a day to a partial plan without copying it: plans are (name, workout, parent) chains"""
+        return workout_name, workout, plan_node
+
+    @staticmethod
+    def _materialize_plan(plan_node):
+        """Flatten a parent-pointer plan chain into the [(workout_name, workout), ...] list"""
+        plan = []
+        while plan_node is not None:
+            workout_name, workout, plan_node = plan_node
+            plan.append((workout_name, workout))
+        plan.reverse()
+        return plan
+
+    @staticmethod
+    def _determine_split_type(days_per_week):
         """Determine the recommended split type based on number of days"""
         if days_per_week == 2:
             return "full_body"
@@ -631,21 +2416,76 @@ class WorkoutPlanGenerator:
         else:
             return "full_body"
 
-    def _heuristic(self, state, target):
+    def _heuristic(self, state, target, day_number, split_type, days_per_week):
         """
-        Heuristic function for A* search:
-        Estimates cost to goal based on remaining sets needed and training efficiency
-        """
-        # Calculate total sets needed to reach target
-        sets_remaining = sum(max(0, target - sets) for muscle, sets in state.items())
-
-        # Estimate workouts needed - assume average of 18 sets per workout
-        workouts_needed = max(1, sets_remaining / 18)
-
-        # Estimate time per workout (60 min average)
-        estimated_time = workouts_needed * 60
+        Admissible heuristic for A* search: a lower bound on the workout time still needed.
 
-        return estimated_time
+        Every exercise adds 3 sets to one muscle group and costs 10.5 minutes, and every workout
+        costs 5 minutes more, so reaching the target takes at least sum(ceil(deficit / 3))
+        exercises spread over at least ceil(exercises / max exercises per day) workouts.
+        Returns infinity (prune) when the remaining days of the split cannot deliver the target
+        for some muscle group or cannot fit the exercises needed.
+        """
+        exercises_needed = sum(-(-(target - sets) // 3) for sets in state if sets < target)
+        if exercises_needed == 0:
+            return 0
+
+        remaining_capacity, max_exercises_per_day = self._split_bounds(split_type, days_per_week)[day_number]
+        if max_exercises_per_day == 0:
+            return float('inf')
+
+        # Prune states where some muscle group cannot reach the target in the remaining days
+        for sets, capacity in zip(state, remaining_capacity):
+            if sets + capacity < target:
+                return float('inf')
+
+        workouts_needed = -(-exercises_needed // max_exercises_per_day)
+        if workouts_needed > days_per_week - day_number:
+            return float('inf')
+
+        # Same time model as _calculate_workout_time: 10.5 min per exercise plus 5 min per workout
+        return exercises_needed * 10.5 + workouts_needed * 5
+
+    def _search_heuristic(self, split_type, days_per_week, target):
+        """Return the pattern database lookup for fixed splits when available, else _heuristic"""
+        if self.use_pattern_database:
+            pattern_database = self._pattern_database(split_type, days_per_week, target)
+            if pattern_database is not None:
+                return pattern_database.heuristic
+        return self._heuristic
+
+    def _pattern_database(self, split_type, days_per_week, target):
+        """Return the PatternDatabase for a fixed split, or None for the state-dependent flexible split"""
+        schedule = []
+        for day_number in range(days_per_week):
+            options = self._day_options(split_type, day_number)
+            if len(options) != 1:
+                return None
+            schedule.append(self._template_profile(options[0][1]))
+        return PatternDatabase.for_schedule(target, schedule)
+
+    def _split_bounds(self, split_type, days_per_week):
+        """
+        For each day index, return (sets each muscle group can still gain from that day to the end
+        of the week, most exercises a single remaining workout can hold). Cached per exercise database.
+        """
+        key = ("bounds", split_type, days_per_week)
+        bounds = self.exercise_index.template_profiles.get(key)
+        if bounds is None:
+            capacity = (0,) * len(MUSCLE_GROUPS)
+            max_exercises = 0
+            bounds = [(capacity, max_exercises)]
+            for day_number in reversed(range(days_per_week)):
+                day_capacity = [0] * len(MUSCLE_GROUPS)
+                for _, template_key in self._day_options(split_type, day_number):
+                    volume, _ = self._template_profile(template_key)
+                    day_capacity = [max(a, b) for a, b in zip(day_capacity, volume)]
+                    max_exercises = max(max_exercises, min(sum(volume), MAX_SETS_PER_DAY) // 3)
+                capacity = tuple(a + min(b, MAX_SETS_PER_DAY) for a, b in zip(capacity, day_capacity))
+                bounds.append((capacity, max_exercises))
+            bounds.reverse()
+            self.exercise_index.template_profiles[key] = bounds
+        return bounds
 
     def _calculate_workout_time(self, workout):
         """Estimate total workout time in minutes (our cost function)"""
@@ -658,528 +2498,142 @@ class WorkoutPlanGenerator:
 
         return base_time + complexity_time
 
-    def _filter_exercises(self, muscle_group, exercise_type, additional_filter=None):
-        filtered = []
-
-        for exercise_name, properties in self.exercises.items():
-            # Check muscle group
-            if properties['muscle_group'] != muscle_group:
-                continue
-
-            # Check exercise type if specified
-            if exercise_type and ('category' not in properties or properties['category'] != exercise_type):
-                continue
+    def _filter_exercises(self, muscle_group, exercise_type, name_keywords=None):
+        """Return the (shared, immutable) exercise names for a muscle group, category and name family"""
+        return self.exercise_index.lookup(muscle_group, exercise_type, name_keywords)
 
-            # Apply additional filter if provided
-            if additional_filter and not additional_filter(exercise_name):
-                continue
-
-            filtered.append(exercise_name)
-
-        return filtered
-
-    def _create_push_workout(self, current_state, intensity="moderate"):
-        """Create a push workout (chest, shoulders, triceps) and update state"""
+    def _build_workout(self, current_state, template_key):
+        """Build a workout from a day template (see WORKOUT_DAY_TEMPLATES) and return it with the updated state"""
         workout = []
-        new_state = current_state.copy()
-
-        # Select compound chest exercises
-        chest_compounds = self._filter_exercises("chest", "compound")
-        chest_isolations = self._filter_exercises("chest", "isolation")
-
-        # Select shoulder exercises
-        shoulder_compounds = self._filter_exercises("shoulders", "compound")
-        shoulder_isolations = self._filter_exercises("shoulders", "isolation")
-
-        # Select tricep exercises
-        tricep_compounds = self._filter_exercises("arms", "compound", lambda x: "Tricep" in x or "Close-Grip" in x)
-        tricep_isolations = self._filter_exercises("arms", "isolation", lambda
-            x: "Tricep" in x or "Skull" in x or "Pushdown" in x or "Extension" in x)
-
-        # Adjust rep ranges based on intensity
-        heavy_rep_range = "5-8"
-        moderate_rep_range = "8-12"
-        light_rep_range = "12-15"
-
-        # Build the workout
-        if intensity == "heavy":
-            # Add 2 compound chest exercises
-            selected_exercises = self._pick_exercises(chest_compounds, 2, heavy_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "chest", len(selected_exercises) * 3)  # 3 sets per exercise
-
-            # Add 1 compound shoulder exercise
-            selected_exercises = self._pick_exercises(shoulder_compounds, 1, heavy_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "shoulders", len(selected_exercises) * 3)
-
-            # Add 1 isolation shoulder exercise
-            selected_exercises = self._pick_exercises(shoulder_isolations, 1, moderate_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "shoulders", len(selected_exercises) * 3)
-
-            # Add 2 tricep exercises
-            selected_exercises = self._pick_exercises(tricep_compounds, 1, moderate_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "arms", len(selected_exercises) * 3)
-
-            selected_exercises = self._pick_exercises(tricep_isolations, 1, moderate_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "arms", len(selected_exercises) * 3)
-        else:
-            # Add 1 compound chest exercise
-            selected_exercises = self._pick_exercises(chest_compounds, 1, moderate_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "chest", len(selected_exercises) * 3)
+        new_state = list(current_state)
 
-            # Add 1-2 isolation chest exercises
-            selected_exercises = self._pick_exercises(chest_isolations, 2, moderate_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "chest", len(selected_exercises) * 3)
-
-            # Add 1-2 shoulder exercises
-            selected_exercises = self._pick_exercises(shoulder_compounds, 1, moderate_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "shoulders", len(selected_exercises) * 3)
-
-            selected_exercises = self._pick_exercises(shoulder_isolations, 1, light_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "shoulders", len(selected_exercises) * 3)
-
-            # Add 2 tricep isolation exercises
-            selected_exercises = self._pick_exercises(tricep_isolations, 2, light_rep_range)
+        for muscle_group, category, name_keywords, count, rep_range in WORKOUT_DAY_TEMPLATES[template_key]:
+            selected_exercises = self._pick_exercises(
+                self._filter_exercises(muscle_group, category, name_keywords), count, rep_range)
             workout.extend(selected_exercises)
-            self._update_state(new_state, "arms", len(selected_exercises) * 3)
+            self._update_state(new_state, muscle_group, len(selected_exercises) * 3)  # 3 sets per exercise
+
+        return workout, tuple(new_state)
+
+    def _template_profile(self, template_key):
+        """Return (sets added per muscle group, workout time) for a day template with this exercise database"""
+        profiles = self.exercise_index.template_profiles
+        profile = profiles.get(template_key)
+        if profile is None:
+            volume = [0] * len(MUSCLE_GROUPS)
+            exercise_count = 0
+            for muscle_group, category, name_keywords, count, _ in WORKOUT_DAY_TEMPLATES[template_key]:
+                # _pick_exercises takes min(count, available) exercises, so volume is deterministic
+                picked = min(count, len(self._filter_exercises(muscle_group, category, name_keywords)))
+                volume[MUSCLE_GROUP_INDEX[muscle_group]] += picked * 3
+                exercise_count += picked
+            profile = (tuple(volume), self._calculate_workout_time(range(exercise_count)))
+            profiles[template_key] = profile
+        return profile
 
-        return workout, new_state
+    def _create_push_workout(self, current_state, intensity="moderate"):
+        """Create a push workout (chest, shoulders, triceps) and update state"""
+        return self._build_workout(current_state, ("push", "heavy" if intensity == "heavy" else "moderate"))
 
     def _create_pull_workout(self, current_state, intensity="moderate"):
         """Create a pull workout (back, biceps) and update state"""
-        workout = []
-        new_state = current_state.copy()
-
-        # Select back exercises
-        back_compounds = self._filter_exercises("back", "compound")
-        back_isolations = self._filter_exercises("back", "isolation")
-
-        # Select bicep exercises
-        bicep_isolations = self._filter_exercises("arms", "isolation", lambda x: "Curl" in x)
-
-        # Select rear delt exercises
-        rear_delt_exercises = self._filter_exercises("shoulders", "isolation",
-                                                     lambda x: "Face Pull" in x or "Reverse" in x)
-
-        # Adjust rep ranges based on intensity
-        heavy_rep_range = "5-8"
-        moderate_rep_range = "8-12"
-        light_rep_range = "12-15"
-
-        # Build the workout
-        if intensity == "heavy":
-            # Add 2-3 compound back exercises
-            selected_exercises = self._pick_exercises(back_compounds, 3, heavy_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "back", len(selected_exercises) * 3)
-
-            # Add 1 back isolation
-            selected_exercises = self._pick_exercises(back_isolations, 1, moderate_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "back", len(selected_exercises) * 3)
-
-            # Add 2 bicep exercises
-            selected_exercises = self._pick_exercises(bicep_isolations, 2, moderate_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "arms", len(selected_exercises) * 3)
-
-            # Add 1 rear delt exercise
-            selected_exercises = self._pick_exercises(rear_delt_exercises, 1, moderate_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "shoulders", len(selected_exercises) * 3)
-        else:
-            # Add 2 compound back exercises
-            selected_exercises = self._pick_exercises(back_compounds, 2, moderate_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "back", len(selected_exercises) * 3)
-
-            # Add 1-2 back isolation
-            selected_exercises = self._pick_exercises(back_isolations, 1, moderate_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "back", len(selected_exercises) * 3)
-
-            # Add 2-3 bicep exercises
-            selected_exercises = self._pick_exercises(bicep_isolations, 3, light_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "arms", len(selected_exercises) * 3)
-
-            # Add 1 rear delt exercise
-            selected_exercises = self._pick_exercises(rear_delt_exercises, 1, light_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "shoulders", len(selected_exercises) * 3)
-
-        return workout, new_state
+        return self._build_workout(current_state, ("pull", "heavy" if intensity == "heavy" else "moderate"))
 
     def _create_legs_workout(self, current_state, intensity="moderate"):
         """Create a legs workout and update state"""
-        workout = []
-        new_state = current_state.copy()
-
-        # Filter exercises
-        quad_compounds = self._filter_exercises("legs", "compound",
-                                                lambda x: "Squat" in x or "Leg Press" in x or "Hack" in x)
-        ham_compounds = self._filter_exercises("legs", "compound",
-                                               lambda x: "Deadlift" in x or "Lunge" in x or "Split" in x)
-        leg_isolations = self._filter_exercises("legs", "isolation")
-        calf_exercises = self._filter_exercises("legs", "isolation", lambda x: "Calf" in x)
-        core_exercises = self._filter_exercises("core", None)
-
-        # Adjust rep ranges based on intensity
-        heavy_rep_range = "5-8"
-        moderate_rep_range = "8-12"
-        light_rep_range = "12-15"
-
-        # Build the workout
-        if intensity == "heavy":
-            # Add 2 quad compound exercises
-            selected_exercises = self._pick_exercises(quad_compounds, 2, heavy_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "legs", len(selected_exercises) * 3)
-
-            # Add 1 ham compound exercise
-            selected_exercises = self._pick_exercises(ham_compounds, 1, heavy_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "legs", len(selected_exercises) * 3)
-
-            # Add 1 leg isolation
-            selected_exercises = self._pick_exercises(leg_isolations, 1, moderate_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "legs", len(selected_exercises) * 3)
-
-            # Add 1 calf exercise
-            selected_exercises = self._pick_exercises(calf_exercises, 1, moderate_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "legs", len(selected_exercises) * 3)
-
-            # Add 1 core exercise
-            selected_exercises = self._pick_exercises(core_exercises, 1, moderate_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "core", len(selected_exercises) * 3)
-        else:
-            # Add 1 quad compound exercise
-            selected_exercises = self._pick_exercises(quad_compounds, 1, moderate_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "legs", len(selected_exercises) * 3)
-
-            # Add 1 ham compound exercise
-            selected_exercises = self._pick_exercises(ham_compounds, 1, moderate_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "legs", len(selected_exercises) * 3)
-
-            # Add 2 leg isolations
-            selected_exercises = self._pick_exercises(leg_isolations, 2, light_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "legs", len(selected_exercises) * 3)
-
-            # Add 2 calf exercises
-            selected_exercises = self._pick_exercises(calf_exercises, 2, light_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "legs", len(selected_exercises) * 3)
-
-            # Add 1 core exercise
-            selected_exercises = self._pick_exercises(core_exercises, 1, light_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "core", len(selected_exercises) * 3)
-
-        return workout, new_state
+        return self._build_workout(current_state, ("legs", "heavy" if intensity == "heavy" else "moderate"))
 
     def _create_upper_workout(self, current_state, focus="strength"):
         """Create an upper body workout and update state"""
-        workout = []
-        new_state = current_state.copy()
-
-        # Filter exercises
-        chest_compounds = self._filter_exercises("chest", "compound")
-        chest_isolations = self._filter_exercises("chest", "isolation")
-        back_compounds = self._filter_exercises("back", "compound")
-        back_isolations = self._filter_exercises("back", "isolation")
-        shoulder_compounds = self._filter_exercises("shoulders", "compound")
-        shoulder_isolations = self._filter_exercises("shoulders", "isolation")
-        bicep_exercises = self._filter_exercises("arms", "isolation", lambda x: "Curl" in x)
-        tricep_exercises = self._filter_exercises("arms", "isolation", lambda x: "Tricep" in x or "Skull" in x)
-
-        # Adjust rep ranges based on focus
-        if focus == "power" or focus == "strength":
-            chest_rep_range = "4-8"
-            back_rep_range = "4-8"
-            shoulder_rep_range = "6-10"
-            arm_rep_range = "8-12"
-        else:
-            chest_rep_range = "8-12"
-            back_rep_range = "8-12"
-            shoulder_rep_range = "10-15"
-            arm_rep_range = "12-15"
-
-        # Add 1-2 chest exercises
-        selected_exercises = self._pick_exercises(chest_compounds, 1, chest_rep_range)
-        workout.extend(selected_exercises)
-        self._update_state(new_state, "chest", len(selected_exercises) * 3)
-
-        if focus != "power":
-            selected_exercises = self._pick_exercises(chest_isolations, 1, chest_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "chest", len(selected_exercises) * 3)
-
-        # Add 1-2 back exercises
-        selected_exercises = self._pick_exercises(back_compounds, 1, back_rep_range)
-        workout.extend(selected_exercises)
-        self._update_state(new_state, "back", len(selected_exercises) * 3)
-
-        if focus != "power":
-            selected_exercises = self._pick_exercises(back_isolations, 1, back_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "back", len(selected_exercises) * 3)
-
-        # Add 1-2 shoulder exercises
-        selected_exercises = self._pick_exercises(shoulder_compounds, 1, shoulder_rep_range)
-        workout.extend(selected_exercises)
-        self._update_state(new_state, "shoulders", len(selected_exercises) * 3)
-
-        if focus != "power":
-            selected_exercises = self._pick_exercises(shoulder_isolations, 1, shoulder_rep_range)
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "shoulders", len(selected_exercises) * 3)
-
-        # Add 1 exercise each for biceps and triceps
-        selected_exercises = self._pick_exercises(bicep_exercises, 1, arm_rep_range)
-        workout.extend(selected_exercises)
-        self._update_state(new_state, "arms", len(selected_exercises) * 3)
-
-        selected_exercises = self._pick_exercises(tricep_exercises, 1, arm_rep_range)
-        workout.extend(selected_exercises)
-        self._update_state(new_state, "arms", len(selected_exercises) * 3)
-
-        return workout, new_state
+        if focus not in ("power", "strength"):
+            focus = "hypertrophy"
+        return self._build_workout(current_state, ("upper", focus))
 
     def _create_full_body_workout(self, current_state, focus="balanced"):
         """Create a full body workout and update state"""
-        workout = []
-        new_state = current_state.copy()
-
-        # Determine emphasis based on focus
-        if focus == "push":
-            # Emphasize chest and shoulders
-            selected_exercises = self._pick_exercises(self._filter_exercises("chest", "compound"), 2, "6-10")
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "chest", len(selected_exercises) * 3)
-
-            selected_exercises = self._pick_exercises(self._filter_exercises("shoulders", "compound"), 1, "8-12")
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "shoulders", len(selected_exercises) * 3)
-
-            # Include less emphasis on pull and legs
-            selected_exercises = self._pick_exercises(self._filter_exercises("back", "compound"), 1, "8-12")
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "back", len(selected_exercises) * 3)
-
-            selected_exercises = self._pick_exercises(self._filter_exercises("legs", "compound"), 1, "8-12")
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "legs", len(selected_exercises) * 3)
-
-            # Add arm and core work
-            selected_exercises = self._pick_exercises(
-                self._filter_exercises("arms", "isolation", lambda x: "Tricep" in x), 1, "10-15")
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "arms", len(selected_exercises) * 3)
-
-            selected_exercises = self._pick_exercises(self._filter_exercises("core", None), 1, "12-15")
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "core", len(selected_exercises) * 3)
-
-        elif focus == "pull":
-            # Emphasize back and biceps
-            selected_exercises = self._pick_exercises(self._filter_exercises("back", "compound"), 2, "6-10")
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "back", len(selected_exercises) * 3)
-
-            selected_exercises = self._pick_exercises(
-                self._filter_exercises("arms", "isolation", lambda x: "Curl" in x), 1, "8-12")
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "arms", len(selected_exercises) * 3)
-
-            # Include less emphasis on push and legs
-            selected_exercises = self._pick_exercises(self._filter_exercises("chest", "compound"), 1, "8-12")
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "chest", len(selected_exercises) * 3)
-
-            selected_exercises = self._pick_exercises(self._filter_exercises("legs", "compound"), 1, "8-12")
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "legs", len(selected_exercises) * 3)
-
-            # Add shoulder and core work
-            selected_exercises = self._pick_exercises(self._filter_exercises("shoulders", "isolation"), 1, "10-15")
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "shoulders", len(selected_exercises) * 3)
-
-            selected_exercises = self._pick_exercises(self._filter_exercises("core", None), 1, "12-15")
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "core", len(selected_exercises) * 3)
-
-        elif focus == "legs":
-            # Emphasize legs
-            selected_exercises = self._pick_exercises(self._filter_exercises("legs", "compound"), 3, "6-10")
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "legs", len(selected_exercises) * 3)
-
-            # Include minimal upper body
-            selected_exercises = self._pick_exercises(self._filter_exercises("chest", "compound"), 1, "8-12")
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "chest", len(selected_exercises) * 3)
-
-            selected_exercises = self._pick_exercises(self._filter_exercises("back", "compound"), 1, "8-12")
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "back", len(selected_exercises) * 3)
-
-            # Add core work
-            selected_exercises = self._pick_exercises(self._filter_exercises("core", None), 2, "12-15")
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "core", len(selected_exercises) * 3)
-
-        else:
-            # Balanced approach
-            selected_exercises = self._pick_exercises(self._filter_exercises("chest", "compound"), 1, "8-12")
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "chest", len(selected_exercises) * 3)
-
-            selected_exercises = self._pick_exercises(self._filter_exercises("back", "compound"), 1, "8-12")
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "back", len(selected_exercises) * 3)
-
-            selected_exercises = self._pick_exercises(self._filter_exercises("legs", "compound"), 2, "8-12")
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "legs", len(selected_exercises) * 3)
-
-            selected_exercises = self._pick_exercises(self._filter_exercises("shoulders", "compound"), 1, "8-12")
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "shoulders", len(selected_exercises) * 3)
-
-            selected_exercises = self._pick_exercises(self._filter_exercises("arms", "isolation"), 1, "10-15")
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "arms", len(selected_exercises) * 3)
+        if focus not in ("push", "pull", "legs"):
+            focus = "balanced"
+        return self._build_workout(current_state, ("full_body", focus))
 
-            selected_exercises = self._pick_exercises(self._filter_exercises("core", None), 1, "12-15")
-            workout.extend(selected_exercises)
-            self._update_state(new_state, "core", len(selected_exercises) * 3)
-
-        return workout, new_state
-
-    def _generate_workout_successors(self, current_state, target, day_number, split_type, total_days):
-        """Generate possible next workouts based on split type and current day"""
-        successors = []
-
-        # Determine which workout types to create based on split type and day number
+    def _day_options(self, split_type, day_number, current_state=None, target=None):
+        """
+        Return the (workout_name, template_key) options for a day of the split. The flexible
+        (unrecognised) split picks options from the current deficits; without a state, all of
+        its options are returned.
+        """
         if split_type == "full_body":
             # Always full body workouts, possibly with different focus
             focus_options = ["balanced", "push", "pull", "legs"]
-            focus = focus_options[day_number % len(focus_options)]
-            full_body_workout, full_body_state = self._create_full_body_workout(current_state.copy(), focus)
-            successors.append(("Full Body", full_body_workout, full_body_state))
+            return [("Full Body", ("full_body", focus_options[day_number % len(focus_options)]))]
 
         elif split_type == "ppl":
             # Push/Pull/Legs split - day determines workout type
-            if day_number % 3 == 0:
-                push_workout, push_state = self._create_push_workout(current_state.copy(), "heavy")
-                successors.append(("Push Day", push_workout, push_state))
-            elif day_number % 3 == 1:
-                pull_workout, pull_state = self._create_pull_workout(current_state.copy(), "heavy")
-                successors.append(("Pull Day", pull_workout, pull_state))
-            else:
-                legs_workout, legs_state = self._create_legs_workout(current_state.copy(), "heavy")
-                successors.append(("Legs Day", legs_workout, legs_state))
+            return [[("Push Day", ("push", "heavy")),
+                     ("Pull Day", ("pull", "heavy")),
+                     ("Legs Day", ("legs", "heavy"))][day_number % 3]]
 
         elif split_type == "upper_lower":
             # Upper/Lower split
             if day_number % 2 == 0:
-                upper_workout, upper_state = self._create_upper_workout(current_state.copy(),
-                                                                        "strength" if day_number == 0 else "hypertrophy")
-                successors.append(("Upper Body", upper_workout, upper_state))
-            else:
-                legs_workout, legs_state = self._create_legs_workout(current_state.copy(),
-                                                                     "heavy" if day_number == 1 else "moderate")
-                successors.append(("Lower Body", legs_workout, legs_state))
+                return [("Upper Body", ("upper", "strength" if day_number == 0 else "hypertrophy"))]
+            return [("Lower Body", ("legs", "heavy" if day_number == 1 else "moderate"))]
 
         elif split_type == "ppl_ul":
-            # PPL + Upper/Lower (5 days)
-            if day_number < 3:  # First 3 days are PPL
-                if day_number == 0:
-                    push_workout, push_state = self._create_push_workout(current_state.copy(), "heavy")
-                    successors.append(("Push Day", push_workout, push_state))
-                elif day_number == 1:
-                    pull_workout, pull_state = self._create_pull_workout(current_state.copy(), "heavy")
-                    successors.append(("Pull Day", pull_workout, pull_state))
-                else:  # day_number == 2
-                    legs_workout, legs_state = self._create_legs_workout(current_state.copy(), "heavy")
-                    successors.append(("Legs Day", legs_workout, legs_state))
-            else:  # Last 2 days are Upper/Lower
-                if day_number == 3:
-                    upper_workout, upper_state = self._create_upper_workout(current_state.copy(), "hypertrophy")
-                    successors.append(("Upper Body", upper_workout, upper_state))
-                else:  # day_number == 4
-                    legs_workout, legs_state = self._create_legs_workout(current_state.copy(), "moderate")
-                    successors.append(("Lower Body", legs_workout, legs_state))
+            # PPL + Upper/Lower (5 days): first 3 days are PPL, the rest Upper/Lower
+            if day_number < 3:
+                return [[("Push Day", ("push", "heavy")),
+                         ("Pull Day", ("pull", "heavy")),
+                         ("Legs Day", ("legs", "heavy"))][day_number]]
+            if day_number == 3:
+                return [("Upper Body", ("upper", "hypertrophy"))]
+            return [("Lower Body", ("legs", "moderate"))]
 
         elif split_type == "ppl_2x":
             # PPL twice per week (6 days)
-            day_in_cycle = day_number % 3
-            if day_in_cycle == 0:
-                push_workout, push_state = self._create_push_workout(
-                    current_state.copy(),
-                    "heavy" if day_number < 3 else "moderate"
-                )
-                successors.append(("Push Day", push_workout, push_state))
-            elif day_in_cycle == 1:
-                pull_workout, pull_state = self._create_pull_workout(
-                    current_state.copy(),
-                    "heavy" if day_number < 3 else "moderate"
-                )
-                successors.append(("Pull Day", pull_workout, pull_state))
-            else:  # day_in_cycle == 2
-                legs_workout, legs_state = self._create_legs_workout(
-                    current_state.copy(),
-                    "heavy" if day_number < 3 else "moderate"
-                )
-                successors.append(("Legs Day", legs_workout, legs_state))
+            intensity = "heavy" if day_number < 3 else "moderate"
+            return [[("Push Day", ("push", intensity)),
+                     ("Pull Day", ("pull", intensity)),
+                     ("Legs Day", ("legs", intensity))][day_number % 3]]
 
-        else:
-            # Default to a flexible approach that works for any split
-            # Determine which muscle groups need more work
-            deficient_muscles = [(muscle, target - sets) for muscle, sets in current_state.items() if sets < target]
-            deficient_muscles.sort(key=lambda x: x[1], reverse=True)  # Sort by deficit
+        # Default to a flexible approach that works for any split
+        if current_state is None:
+            return [("Push Day", ("push", "moderate")), ("Pull Day", ("pull", "moderate")),
+                    ("Legs Day", ("legs", "moderate")), ("Upper Body", ("upper", "hypertrophy")),
+                    ("Full Body", ("full_body", "balanced"))]
 
-            # Include multiple workout types to ensure options based on what's needed most
-            if not deficient_muscles or deficient_muscles[0][0] in ['chest', 'shoulders', 'arms']:
-                push_workout, push_state = self._create_push_workout(current_state.copy(), "moderate")
-                successors.append(("Push Day", push_workout, push_state))
+        # Determine which muscle groups need more work
+        deficient_muscles = [(muscle, target - sets) for muscle, sets in zip(MUSCLE_GROUPS, current_state)
+                             if sets < target]
+        deficient_muscles.sort(key=lambda x: x[1], reverse=True)  # Sort by deficit
 
-            if not deficient_muscles or deficient_muscles[0][0] in ['back', 'arms']:
-                pull_workout, pull_state = self._create_pull_workout(current_state.copy(), "moderate")
-                successors.append(("Pull Day", pull_workout, pull_state))
+        # Include multiple workout types to ensure options based on what's needed most
+        options = []
+        if not deficient_muscles or deficient_muscles[0][0] in ['chest', 'shoulders', 'arms']:
+            options.append(("Push Day", ("push", "moderate")))
 
-            if not deficient_muscles or deficient_muscles[0][0] in ['legs', 'core']:
-                legs_workout, legs_state = self._create_legs_workout(current_state.copy(), "moderate")
-                successors.append(("Legs Day", legs_workout, legs_state))
+        if not deficient_muscles or deficient_muscles[0][0] in ['back', 'arms']:
+            options.append(("Pull Day", ("pull", "moderate")))
 
-            upper_workout, upper_state = self._create_upper_workout(current_state.copy(), "hypertrophy")
-            successors.append(("Upper Body", upper_workout, upper_state))
+        if not deficient_muscles or deficient_muscles[0][0] in ['legs', 'core']:
+            options.append(("Legs Day", ("legs", "moderate")))
 
-            full_body_workout, full_body_state = self._create_full_body_workout(current_state.copy(), "balanced")
-            successors.append(("Full Body", full_body_workout, full_body_state))
+        options.append(("Upper Body", ("upper", "hypertrophy")))
+        options.append(("Full Body", ("full_body", "balanced")))
+        return options
 
-            # Keep only successors that make progress toward the goal
+    def _generate_workout_successors(self, current_state, target, day_number, split_type, total_days):
+        """Generate possible next workouts based on split type and current day"""
+        successors = []
+        for workout_name, template_key in self._day_options(split_type, day_number, current_state, target):
+            workout, new_state = self._build_workout(current_state, template_key)
+            successors.append((workout_name, workout, new_state))
+
+        # Keep only successors that make progress toward the goal
         valid_successors = []
+        current_total = sum(current_state)
         for name, workout, state in successors:
             # Check if this workout makes progress (increases total sets)
-            current_total = sum(current_state.values())
-            new_total = sum(state.values())
-            if new_total > current_total:
+            if sum(state) > current_total:
                 valid_successors.append((name, workout, state))
 
         return valid_successors if valid_successors else successors  # Return original if none are valid
@@ -1213,7 +2667,7 @@ class WorkoutPlanGenerator:
     def _fallback_workout_plan(self, days_per_week, split_type):
         """Create a fallback workout plan when A* search fails or times out"""
         workout_plan = []
-        current_state = {muscle: 0 for muscle in ['chest', 'back', 'legs', 'shoulders', 'arms', 'core']}
+        current_state = (0,) * len(MUSCLE_GROUPS)
 
         # Create workout plan based on split type
         if split_type == "full_body":
@@ -1221,7 +2675,7 @@ class WorkoutPlanGenerator:
             focuses = ["balanced", "push", "pull", "legs"]
             for i in range(days_per_week):
                 focus = focuses[i % len(focuses)]
-                workout, state = self._create_full_body_workout(current_state.copy(), focus)
+                workout, state = self._create_full_body_workout(current_state, focus)
                 workout_plan.append((f"Full Body ({focus} focus)", workout))
                 # Update state for next workout
                 current_state = state
@@ -1230,13 +2684,13 @@ class WorkoutPlanGenerator:
             # Create Push/Pull/Legs workouts
             for i in range(days_per_week):
                 if i % 3 == 0:
-                    workout, state = self._create_push_workout(current_state.copy(), "heavy")
+                    workout, state = self._create_push_workout(current_state, "heavy")
                     workout_plan.append(("Push Day", workout))
                 elif i % 3 == 1:
-                    workout, state = self._create_pull_workout(current_state.copy(), "heavy")
+                    workout, state = self._create_pull_workout(current_state, "heavy")
                     workout_plan.append(("Pull Day", workout))
                 else:
-                    workout, state = self._create_legs_workout(current_state.copy(), "heavy")
+                    workout, state = self._create_legs_workout(current_state, "heavy")
                     workout_plan.append(("Legs Day", workout))
                 # Update state for next workout
                 current_state = state
@@ -1245,11 +2699,11 @@ class WorkoutPlanGenerator:
             # Create Upper/Lower split
             for i in range(days_per_week):
                 if i % 2 == 0:
-                    workout, state = self._create_upper_workout(current_state.copy(),
+                    workout, state = self._create_upper_workout(current_state,
                                                                 "strength" if i == 0 else "hypertrophy")
                     workout_plan.append(("Upper Body", workout))
                 else:
-                    workout, state = self._create_legs_workout(current_state.copy(),
+                    workout, state = self._create_legs_workout(current_state,
                                                                "heavy" if i == 1 else "moderate")
                     workout_plan.append(("Lower Body", workout))
                 # Update state for next workout
@@ -1260,20 +2714,20 @@ class WorkoutPlanGenerator:
             for i in range(days_per_week):
                 if i < 3:  # First 3 days are PPL
                     if i == 0:
-                        workout, state = self._create_push_workout(current_state.copy(), "heavy")
+                        workout, state = self._create_push_workout(current_state, "heavy")
                         workout_plan.append(("Push Day", workout))
                     elif i == 1:
-                        workout, state = self._create_pull_workout(current_state.copy(), "heavy")
+                        workout, state = self._create_pull_workout(current_state, "heavy")
                         workout_plan.append(("Pull Day", workout))
                     else:  # i == 2
-                        workout, state = self._create_legs_workout(current_state.copy(), "heavy")
+                        workout, state = self._create_legs_workout(current_state, "heavy")
                         workout_plan.append(("Legs Day", workout))
                 else:  # Last 2 days are Upper/Lower
                     if i == 3:
-                        workout, state = self._create_upper_workout(current_state.copy(), "hypertrophy")
+                        workout, state = self._create_upper_workout(current_state, "hypertrophy")
                         workout_plan.append(("Upper Body", workout))
                     else:  # i == 4
-                        workout, state = self._create_legs_workout(current_state.copy(), "moderate")
+                        workout, state = self._create_legs_workout(current_state, "moderate")
                         workout_plan.append(("Lower Body", workout))
                 # Update state for next workout
                 current_state = state
@@ -1284,19 +2738,19 @@ class WorkoutPlanGenerator:
                 day_in_cycle = i % 3
                 if day_in_cycle == 0:
                     workout, state = self._create_push_workout(
-                        current_state.copy(),
+                        current_state,
                         "heavy" if i < 3 else "moderate"
                     )
                     workout_plan.append(("Push Day", workout))
                 elif day_in_cycle == 1:
                     workout, state = self._create_pull_workout(
-                        current_state.copy(),
+                        current_state,
                         "heavy" if i < 3 else "moderate"
                     )
                     workout_plan.append(("Pull Day", workout))
                 else:  # day_in_cycle == 2
                     workout, state = self._create_legs_workout(
-                        current_state.copy(),
+                        current_state,
                         "heavy" if i < 3 else "moderate"
                     )
                     workout_plan.append(("Legs Day", workout))
@@ -1306,13 +2760,13 @@ class WorkoutPlanGenerator:
             # Default to balanced approach
             for i in range(days_per_week):
                 if i % 3 == 0:
-                    workout, state = self._create_full_body_workout(current_state.copy(), "balanced")
+                    workout, state = self._create_full_body_workout(current_state, "balanced")
                     workout_plan.append(("Full Body", workout))
                 elif i % 3 == 1:
-                    workout, state = self._create_upper_workout(current_state.copy(), "balanced")
+                    workout, state = self._create_upper_workout(current_state, "balanced")
                     workout_plan.append(("Upper Body", workout))
                 else:
-                    workout, state = self._create_legs_workout(current_state.copy(), "moderate")
+                    workout, state = self._create_legs_workout(current_state, "moderate")
                     workout_plan.append(("Lower Body", workout))
                 # Update state for next workout
                 current_state = state
@@ -1320,11 +2774,8 @@ class WorkoutPlanGenerator:
         return workout_plan
 
     def _update_state(self, state, muscle_group, sets):
-        """Update the state with the number of sets for a muscle group"""
-        if muscle_group in state:
-            state[muscle_group] = state[muscle_group] + sets
-        else:
-            state[muscle_group] = sets
+        """Add sets for a muscle group to a mutable (list) copy of a search state"""
+        state[MUSCLE_GROUP_INDEX[muscle_group]] += sets
 
 
 def _initialize_expanded_food_database(self):
@@ -1559,3 +3010,12 @@ def _initialize_expanded_exercise_database(self):
                          "category": "anti-rotation"}
     }
 
+
+
+def load_default_knowledge_base():
+    """Return a KnowledgeBase holding the built-in food and exercise databases"""
+    kb = KnowledgeBase()
+    holder = SimpleNamespace(kb=kb)
+    _initialize_expanded_food_database(holder)
+    _initialize_expanded_exercise_database(holder)
+    return kb
@@ -0,0 +1,194 @@
+"""
+Load generator for fitai_service: keeps concurrent keep-alive connections busy with random
+profiles and reports throughput, p50/p99 latency of the successful (200) responses, and
+the shed (503) and failed requests separately.
+
+Usage: python fitai_loadgen.py [--url http://127.0.0.1:8080] [--endpoint recommendations]
+                               [--concurrency 16] [--requests 2000 | --duration 10] [--profiles N]
+                               [--spawn [--workers N]]
+
+With --spawn a local service is started on the given port for the run and stopped afterwards.
+With --profiles N the requests cycle through N distinct profiles (e.g. to exercise the cache)
+instead of a new random profile per request.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import random
+import subprocess
+import sys
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+GOALS = ("weight loss", "muscle gain", "maintenance", "athletic", "health")
+ACTIVITY_LEVELS = ("sedentary", "light", "moderate", "active", "very active")
+RESTRICTIONS = ((), ("vegetarian",), ("vegan",), ("keto",), ("gluten", "dairy"), ("paleo",), ("nuts",))
+
+
+def random_profile(rng):
+    return {
+        'age': rng.randint(18, 70),
+        'height_ft': rng.randint(4, 6),
+        'height_in': rng.randint(0, 11),
+        'weight_lbs': rng.randint(110, 280),
+        'gender': rng.choice(("male", "female")),
+        'activity_level': rng.choice(ACTIVITY_LEVELS),
+        'goals': [rng.choice(GOALS)],
+        'restrictions': list(rng.choice(RESTRICTIONS)),
+        'days_per_week': rng.randint(2, 6),
+        'meals_per_day': rng.randint(3, 6),
+    }
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return float("nan")
+    rank = max(1, math.ceil(len(sorted_values) * fraction))
+    return sorted_values[rank - 1]
+
+
+async def _client(host, port, path, rng, profiles, next_request, latencies, statuses):
+    """
+    One keep-alive connection sending requests while next_request() allows; profiles is an
+    iterator of request bodies shared by all clients, or None for a random profile per request
+    """
+    reader = writer = None
+    try:
+        while next_request():
+            body = next(profiles) if profiles is not None else json.dumps(random_profile(rng)).encode()
+            request = (f"POST {path} HTTP/1.1\r\nHost: {host}:{port}\r\nContent-Type: application/json\r\n"
+                       f"Content-Length: {len(body)}\r\n\r\n").encode("latin-1") + body
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(host, port)
+                start = time.perf_counter()
+                writer.write(request)
+                await writer.drain()
+                head = await reader.readuntil(b"\r\n\r\n")
+                lines = head.decode("latin-1").split("\r\n")
+                status = int(lines[0].split(" ", 2)[1])
+                headers = {name.strip().lower(): value.strip()
+                           for name, value in (line.split(":", 1) for line in lines[1:] if line)}
+                await reader.readexactly(int(headers.get("content-length", 0)))
+            except (asyncio.IncompleteReadError, ConnectionError) as exc:
+                statuses[type(exc).__name__] += 1
+                if writer is not None:
+                    writer.close()
+                reader = writer = None
+                continue
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+            statuses[status] += 1
+            if headers.get("connection", "").lower() == "close":
+                writer.close()
+                reader = writer = None
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def run_load(url, endpoint="recommendations", concurrency=16, requests=2000, duration=None, seed=0,
+                   profile_count=None):
+    """Run the load test; returns a report dict (latencies in milliseconds, of 200 responses only)"""
+    parts = urlsplit(url)
+    host, port = parts.hostname or "127.0.0.1", parts.port or 80
+    path = "/" + endpoint.strip("/")
+    rng = random.Random(seed)
+    profiles = None
+    if profile_count:
+        profiles = itertools.cycle([json.dumps(random_profile(rng)).encode() for _ in range(profile_count)])
+
+    latencies = []
+    statuses = Counter()
+    sent = 0
+    start = time.perf_counter()
+
+    def next_request():
+        nonlocal sent
+        if duration is not None:
+            return time.perf_counter() - start < duration
+        sent += 1
+        return sent <= requests
+
+    await asyncio.gather(*(_client(host, port, path, random.Random(seed + i), profiles, next_request, latencies,
+                                   statuses)
+                           for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    ok = statuses.get(200, 0)
+    shed = statuses.get(503, 0)
+    latencies.sort()
+    return {
+        'endpoint': path,
+        'concurrency': concurrency,
+        'requests': sum(statuses.values()),
+        'ok': ok,
+        'shed': shed,
+        'errors': sum(statuses.values()) - ok - shed,
+        'statuses': {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        'seconds': round(elapsed, 3),
+        'throughput': round(ok / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2) if latencies else float("nan"),
+    }
+
+
+async def _wait_for_port(host, port, timeout):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test a running fitai_service.")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--endpoint", default="recommendations", choices=("workout", "meal", "recommendations"))
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent keep-alive connections")
+    parser.add_argument("--requests", type=int, default=2000, help="total requests (ignored with --duration)")
+    parser.add_argument("--duration", type=float, default=None, help="run for this many seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--profiles", type=int, default=None, help="cycle through this many distinct profiles in order")
+    parser.add_argument("--spawn", action="store_true", help="start a local service for the run")
+    parser.add_argument("--workers", type=int, default=None, help="service workers with --spawn")
+    args = parser.parse_args(argv)
+
+    service = None
+    if args.spawn:
+        parts = urlsplit(args.url)
+        command = [sys.executable, "fitai_service.py", "--host", parts.hostname or "127.0.0.1",
+                   "--port", str(parts.port or 80)]
+        if args.workers:
+            command += ["--workers", str(args.workers)]
+        service = subprocess.Popen(command, cwd=sys.path[0] or None)
+    try:
+        if service is not None:
+            parts = urlsplit(args.url)
+            asyncio.run(_wait_for_port(parts.hostname or "127.0.0.1", parts.port or 80, 30))
+        report = asyncio.run(run_load(args.url, args.endpoint, args.concurrency, args.requests, args.duration,
+                                      args.seed, args.profiles))
+    finally:
+        if service is not None:
+            service.terminate()
+            service.wait()
+
+    print(f"{report['requests']} requests to {report['endpoint']} over {report['concurrency']} connections "
+          f"in {report['seconds']}s: {report['ok']} ok, {report['shed']} shed, {report['errors']} errors; "
+          f"{report['throughput']} req/s, p50 {report['p50_ms']} ms, p99 {report['p99_ms']} ms, "
+          f"max {report['max_ms']} ms; statuses {report['statuses']}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
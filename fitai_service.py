@@ -0,0 +1,275 @@
+"""
+Long-running HTTP recommendation service (asyncio, standard library only).
+
+Endpoints (JSON profile in the request body, same fields as the fitai_cli records):
+    POST /workout          weekly workout plan
+    POST /meal             daily meal plan with portions
+    POST /recommendations  both, plus BMR and TDEE
+    GET  /health           service status
+
+Malformed profiles, and days_per_week or meals_per_day outside DAYS_PER_WEEK_RANGE or
+MEALS_PER_DAY_RANGE (see fitai_cli), get a 400.
+
+Plan generation runs in a process pool (see fitai_batch.create_worker_pool). Requests that
+take longer than the timeout get a 504, and when max_pending generations are already queued
+new ones are shed with a 503 right away. Connections are kept alive (HTTP/1.1) until the
+client closes them or they stay idle for idle_timeout seconds.
+
+Workout and meal plans are cached and identical concurrent requests are coalesced (see
+fitai_cache), so repeated profiles never reach the worker pool; --cache-size 0 disables this.
+
+Usage: python fitai_service.py [--host HOST] [--port PORT] [--workers N] [--timeout S] [--max-pending N]
+                               [--cache-size N] [--cache-ttl S] [--variety K]
+(see fitai_loadgen.py to measure latency and throughput)
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+
+from fitai_batch import create_worker_pool, worker_knowledge_base
+from fitai_cache import PlanCache, meal_key, workout_key
+from fitai_cli import DAYS_PER_WEEK_RANGE, MEALS_PER_DAY_RANGE, meal_plan_json, parse_count, parse_profile, \
+    profile_summary, workout_plan_json
+from fitai_core import MealPlanCSP, WorkoutPlanGenerator, load_default_knowledge_base
+
+MAX_BODY_SIZE = 64 * 1024
+STATUS_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                  413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable",
+                  504: "Gateway Timeout"}
+
+
+class ServiceBusy(Exception):
+    """Raised when a generation would exceed the pending limit"""
+
+
+def _plan_part(kind, profile, days_per_week, meals_per_day):
+    """Generate a "workout" or "meal" plan in a worker process; returns its JSON-able response part"""
+    kb = worker_knowledge_base()
+    if kind == "workout":
+        plan = WorkoutPlanGenerator(kb.exercises, profile).generate_workout_plan(days_per_week=days_per_week)
+        return {'workout_plan': workout_plan_json(plan)}
+    plan = MealPlanCSP(kb.foods, profile).generate_meal_plan(meals_per_day=meals_per_day, portions=True)
+    return {'meal_plan': meal_plan_json(plan, kb.foods)}
+
+
+def _recommend(kind, profile, days_per_week, meals_per_day):
+    """Generate the plans of an endpoint in a worker process; returns the JSON response body"""
+    result = profile_summary(profile) if kind == "recommendations" else {}
+    for part in ("workout", "meal"):
+        if kind in (part, "recommendations"):
+            result.update(_plan_part(part, profile, days_per_week, meals_per_day))
+    return json.dumps(result).encode()
+
+
+def _worker_ready():
+    worker_knowledge_base()
+
+
+class RecommendationService:
+    """HTTP front end: parses requests on the event loop and generates plans in the worker pool"""
+
+    ENDPOINTS = ("workout", "meal", "recommendations")
+
+    def __init__(self, workers=None, timeout=10.0, max_pending=None, idle_timeout=15.0, cache=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout  # Seconds per generation request
+        self.max_pending = max_pending or 4 * self.workers  # Generations queued or running before shedding
+        self.idle_timeout = idle_timeout  # Seconds a kept-alive connection may stay idle
+        self.cache = cache  # PlanCache of response parts, None to always generate
+        self.kb = None  # Databases the cache keys are computed from
+        self.pending = 0
+        self.executor = None
+        self.server = None
+        self.counters = {'requests': 0, 'shed': 0, 'timeouts': 0, 'errors': 0}
+
+    async def start(self, host="127.0.0.1", port=8080):
+        self.executor = create_worker_pool(self.workers)
+        if self.cache is not None:
+            self.kb = load_default_knowledge_base()
+        # Start every worker now so the first requests do not pay for loading the knowledge base
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.executor, _worker_ready)
+                               for _ in range(self.workers)))
+        self.server = await asyncio.start_server(self._handle_connection, host, port)
+        return self.server
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.idle_timeout)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                        ConnectionError):
+                    break
+
+                try:
+                    request_line, *header_lines = head.decode("latin-1").rstrip("\r\n").split("\r\n")
+                    method, path, version = request_line.split(" ", 2)
+                    headers = {}
+                    for line in header_lines:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                    length = int(headers.get("content-length", 0))
+                    if length < 0:
+                        raise ValueError("negative Content-Length")
+                except ValueError:
+                    await self._respond(writer, 400, {'error': "Malformed request"}, keep_alive=False)
+                    break
+                if length > MAX_BODY_SIZE:
+                    await self._respond(writer, 413, {'error': "Request body too large"}, keep_alive=False)
+                    break
+                try:
+                    body = await reader.readexactly(length)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+                status, payload = await self._dispatch(method, path.split("?", 1)[0], body)
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, payload, keep_alive):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        head = (f"HTTP/1.1 {status} {STATUS_REASONS[status]}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n")
+        if status == 503:
+            head += "Retry-After: 1\r\n"
+        writer.write(head.encode("latin-1") + b"\r\n" + body)
+        await writer.drain()
+
+    async def _dispatch(self, method, path, body):
+        """Return (status, payload) for a request; payload is a JSON-able object or encoded JSON"""
+        self.counters['requests'] += 1
+        if path == "/health":
+            return 200, {'status': "ok", 'pending': self.pending, 'max_pending': self.max_pending,
+                         'workers': self.workers, **self.counters,
+                         'cache': self.cache.stats() if self.cache is not None else None}
+
+        kind = path.strip("/")
+        if kind not in self.ENDPOINTS:
+            return 404, {'error': f"Unknown endpoint: {path}"}
+        if method != "POST":
+            return 405, {'error': f"Use POST for {path}"}
+
+        try:
+            record = json.loads(body or b"{}")
+            if not isinstance(record, dict):
+                raise ValueError("expected a JSON object")
+            profile = parse_profile(record)
+            days_per_week = parse_count(record, 'days_per_week', 4, DAYS_PER_WEEK_RANGE)
+            meals_per_day = parse_count(record, 'meals_per_day', 4, MEALS_PER_DAY_RANGE)
+        except (TypeError, ValueError) as exc:
+            return 400, {'error': str(exc)}
+
+        try:
+            return 200, await asyncio.wait_for(self._generate(kind, profile, days_per_week, meals_per_day),
+                                               self.timeout)
+        except ServiceBusy:
+            self.counters['shed'] += 1
+            return 503, {'error': "Server busy, retry later"}
+        except asyncio.TimeoutError:
+            self.counters['timeouts'] += 1
+            return 504, {'error': f"Generation took longer than {self.timeout:g}s"}
+        except Exception as exc:
+            self.counters['errors'] += 1
+            return 500, {'error': f"{type(exc).__name__}: {exc}"}
+
+    async def _generate(self, kind, profile, days_per_week, meals_per_day):
+        """Return the JSON response body of a generation endpoint"""
+        if self.cache is None:
+            return await self._run(_recommend, kind, profile, days_per_week, meals_per_day)
+
+        # Plans are cached per part; BMR and TDEE are specific to the profile
+        keys = {}
+        if kind in ("workout", "recommendations"):
+            keys['workout'] = workout_key(self.kb.exercises, profile, days_per_week)
+        if kind in ("meal", "recommendations"):
+            keys['meal'] = meal_key(self.kb.foods, profile, meals_per_day, portions=True)
+        parts = await asyncio.gather(*(
+            self.cache.get_async(key, lambda part=part: self._run(_plan_part, part, profile, days_per_week,
+                                                                  meals_per_day))
+            for part, key in keys.items()))
+
+        result = profile_summary(profile) if kind == "recommendations" else {}
+        for part in parts:
+            result.update(part)
+        return json.dumps(result).encode()
+
+    async def _run(self, function, *args):
+        """Run function(*args) in the worker pool, shedding load instead of queueing without bound"""
+        if self.pending >= self.max_pending:
+            raise ServiceBusy()
+
+        # A timed-out generation still finishes in its worker, so it stays pending until then
+        self.pending += 1
+        loop = asyncio.get_running_loop()
+        job = self.executor.submit(function, *args)
+        job.add_done_callback(lambda _: self._release(loop))
+        return await asyncio.wrap_future(job)
+
+    def _release(self, loop):
+        """Called from the pool's thread when a generation finishes"""
+        def release():
+            self.pending -= 1
+        try:
+            loop.call_soon_threadsafe(release)
+        except RuntimeError:  # The event loop has already been closed
+            pass
+
+
+async def serve(host="127.0.0.1", port=8080, **options):
+    """Run the service until SIGINT or SIGTERM"""
+    service = RecommendationService(**options)
+    server = await service.start(host, port)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    address = server.sockets[0].getsockname()
+    print(f"Serving on http://{address[0]}:{address[1]} with {service.workers} workers", flush=True)
+    try:
+        await stop.wait()
+    finally:
+        await service.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve workout and meal recommendations over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds per generation request")
+    parser.add_argument("--max-pending", type=int, default=None,
+                        help="generations queued or running before requests are shed (default: 4 per worker)")
+    parser.add_argument("--cache-size", type=int, default=10000, help="cached plans (0 disables the cache)")
+    parser.add_argument("--cache-ttl", type=float, default=3600.0, help="seconds a cached plan stays valid")
+    parser.add_argument("--variety", type=int, default=1, help="different plans served per cache key")
+    args = parser.parse_args(argv)
+    cache = PlanCache(args.cache_size, args.cache_ttl, args.variety) if args.cache_size > 0 else None
+    asyncio.run(serve(args.host, args.port, workers=args.workers, timeout=args.timeout,
+                      max_pending=args.max_pending, cache=cache))
+
+
+if __name__ == "__main__":
+    main()
@@ -343,7 +343,7 @@ class FitAIApp(QMainWindow):
             split_type = self.get_recommended_split_type(workout_days)
 
             # Generate recommendations
-            meal_plan = meal_planner.generate_meal_plan(meals_per_day=meals_per_day)
+            meal_plan = meal_planner.generate_meal_plan(meals_per_day=meals_per_day, portions=True)
 
             # Pass the split_type as a parameter to the workout planner
             workout_plan = workout_planner.generate_workout_plan(days_per_week=workout_days)
@@ -384,11 +384,12 @@ class FitAIApp(QMainWindow):
                 meal_text += "<ul>"
                 for food in foods:
                     nutrition = self.kb.foods[food]
-                    meal_text += (f"<li><b>{food}</b> - "
-                                  f"{nutrition['calories']} cal, "
-                                  f"{nutrition['protein']}g protein, "
-                                  f"{nutrition['carbs']}g carbs, "
-                                  f"{nutrition['fat']}g fat</li>")
+                    servings = foods.servings[food] if hasattr(foods, 'servings') else 1
+                    meal_text += (f"<li><b>{food}</b> ({servings:g} serving{'' if servings == 1 else 's'}) - "
+                                  f"{nutrition['calories'] * servings:.0f} cal, "
+                                  f"{nutrition['protein'] * servings:.1f}g protein, "
+                                  f"{nutrition['carbs'] * servings:.1f}g carbs, "
+                                  f"{nutrition['fat'] * servings:.1f}g fat</li>")
                 meal_text += "</ul>"
 
             self.meal_text.setHtml(meal_text)
@@ -0,0 +1,57 @@
+"""Tests for plan cache keys and their invalidation when a database changes"""
+import pytest
+
+import fitai_core
+from fitai_cache import CachedPlanner, PlanCache, meal_key, workout_key
+from fitai_core import FoodIndex, MealPlanCSP, UserProfile, WorkoutPlanGenerator, load_default_knowledge_base
+
+PROFILE = UserProfile(30, 5, 10, 180, 'male', 'moderate', ['weight loss'], ['vegan'])
+
+
+@pytest.fixture
+def knowledge_base():
+    return load_default_knowledge_base()
+
+
+def test_keys_do_not_rehash_the_database(knowledge_base, monkeypatch):
+    meal_key(knowledge_base.foods, PROFILE)
+    workout_key(knowledge_base.exercises, PROFILE, 4)
+    calls = []
+    monkeypatch.setattr(fitai_core, 'database_signature', lambda database: calls.append(database))
+
+    for _ in range(3):
+        meal_key(knowledge_base.foods, PROFILE)
+        workout_key(knowledge_base.exercises, PROFILE, 4)
+        MealPlanCSP(knowledge_base.foods, PROFILE).generate_meal_plan(3)
+        WorkoutPlanGenerator(knowledge_base.exercises, PROFILE)
+    assert calls == []
+
+
+def test_equal_content_gives_equal_keys(knowledge_base):
+    other = load_default_knowledge_base()
+    assert meal_key(knowledge_base.foods, PROFILE) == meal_key(other.foods, PROFILE)
+    assert workout_key(knowledge_base.exercises, PROFILE, 4) == workout_key(other.exercises, PROFILE, 4)
+
+
+def test_invalidate_picks_up_in_place_edits(knowledge_base):
+    planner = CachedPlanner(knowledge_base, PlanCache())
+    meal_before = meal_key(knowledge_base.foods, PROFILE)
+    workout_before = workout_key(knowledge_base.exercises, PROFILE, 4)
+    planner.meal_plan(PROFILE)
+
+    knowledge_base.foods['Seitan'] = {'calories': 370, 'protein': 75, 'carbs': 14, 'fat': 2}
+    knowledge_base.exercises['Cable Crunch'] = {'muscle_group': 'core', 'category': 'isolation'}
+    knowledge_base.invalidate()
+
+    assert meal_key(knowledge_base.foods, PROFILE) != meal_before
+    assert workout_key(knowledge_base.exercises, PROFILE, 4) != workout_before
+    assert 'Seitan' in FoodIndex.for_database(knowledge_base.foods).rows
+    planner.meal_plan(PROFILE)
+    assert planner.cache.stats()['misses'] == 2
+
+
+def test_replaced_database_gets_new_keys(knowledge_base):
+    before = meal_key(knowledge_base.foods, PROFILE)
+    knowledge_base.foods = {name: dict(nutrition) for name, nutrition in knowledge_base.foods.items()
+                            if name != 'Tofu'}
+    assert meal_key(knowledge_base.foods, PROFILE) != before
@@ -0,0 +1,34 @@
+"""Tests for record parsing in fitai_cli"""
+import pytest
+
+from fitai_cli import MEALS_PER_DAY_RANGE, _parse_records, parse_count
+
+PROFILE = {'age': 30, 'height_ft': 5, 'height_in': 10, 'weight_lbs': 180, 'gender': 'male',
+           'activity_level': 'moderate', 'goals': ['health'], 'restrictions': []}
+
+
+@pytest.mark.parametrize("value, expected", [(None, 4), ("", 4), (3, 3), ("6", 6), (2.0, 2)])
+def test_parse_count_defaults_only_when_absent(value, expected):
+    assert parse_count({'meals_per_day': value}, 'meals_per_day', 4, MEALS_PER_DAY_RANGE) == expected
+
+
+@pytest.mark.parametrize("value", [0, -3, 500, "abc", True])
+def test_parse_count_rejects_bad_values(value):
+    with pytest.raises(ValueError):
+        parse_count({'meals_per_day': value}, 'meals_per_day', 4, MEALS_PER_DAY_RANGE)
+
+
+@pytest.mark.parametrize("field, value", [('meals_per_day', 500), ('meals_per_day', -3), ('meals_per_day', 0),
+                                          ('days_per_week', 0), ('days_per_week', 8)])
+def test_parse_records_bounds_counts(field, value):
+    records = [(1, dict(PROFILE, **{field: value}), None)]
+    (_, profile, _, workout_settings, meal_settings, error), = _parse_records(records, 4, 4)
+    assert profile is None and error is not None and field in error
+
+
+def test_parse_records_applies_defaults():
+    records = [(1, dict(PROFILE, meals_per_day=3), None)]
+    (_, profile, _, workout_settings, meal_settings, error), = _parse_records(records, 5, 4)
+    assert error is None
+    assert workout_settings == {'days_per_week': 5}
+    assert meal_settings == {'meals_per_day': 3}
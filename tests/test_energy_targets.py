@@ -0,0 +1,47 @@
+"""Tests that the vectorized calculate_energy_targets agrees with the scalar UserProfile path"""
+import numpy as np
+import pytest
+
+from fitai_core import NUTRIENTS, UserProfile, calculate_energy_targets
+
+MEMBERS = [
+    # age, height_ft, height_in, weight_lbs, gender, activity_level, goals
+    (30, 5, 10, 180, 'male', 'moderate', ['health']),
+    (45, 5, 4, 150, 'female', 'light', 'weight loss'),
+    (22, 6, 1, 200, 'Male', 'very active', ('muscle gain', 'athletic')),
+    (60, 5, 6, 170, 'female', 'sedentary', ['muscle gain', 'weight loss']),
+    (35, 5, 9, 160, 'male', 'active', 'muscle gain'),
+    (28, 5, 2, 130, 'female', 'moderate', []),
+]
+
+
+def _scalar_targets(members):
+    profiles = [UserProfile(*member, restrictions=()) for member in members]
+    bounds = [profile.macro_bounds() for profile in profiles]
+    return profiles, bounds
+
+
+def test_string_goal_is_one_goal():
+    profile = UserProfile(30, 5, 10, 180, 'male', 'moderate', 'weight loss', 'vegan')
+    assert profile.goals == ('weight loss',)
+    assert profile.restrictions == ('vegan',)
+    assert profile == UserProfile(30, 5, 10, 180, 'male', 'moderate', ['weight loss'], ['vegan'])
+
+
+@pytest.mark.parametrize("as_array", [False, True])
+def test_vectorized_targets_match_scalar_profiles(as_array):
+    columns = [list(column) for column in zip(*MEMBERS)]
+    if as_array:
+        # Single-goal members only, so the goals column can be a NumPy string array
+        members = [member for member in MEMBERS if isinstance(member[-1], str)]
+        columns = [np.array(column) for column in zip(*members)]
+    else:
+        members = MEMBERS
+    targets = calculate_energy_targets(*columns)
+    profiles, bounds = _scalar_targets(members)
+
+    assert targets['bmr'].tolist() == [profile.calculate_bmr() for profile in profiles]
+    assert targets['tdee'].tolist() == [profile.calculate_tdee() for profile in profiles]
+    for index, nutrient in enumerate(NUTRIENTS):
+        assert targets[nutrient]['min'].tolist() == [bound[index][0] for bound in bounds]
+        assert targets[nutrient]['max'].tolist() == [bound[index][1] for bound in bounds]
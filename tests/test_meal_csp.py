@@ -0,0 +1,57 @@
+"""Tests for the constraint satisfaction meal planner (MealPlanCSP engine="csp")"""
+import random
+import time
+
+import pytest
+
+from fitai_core import MealPlanCSP, NUTRIENTS, UserProfile, load_default_knowledge_base
+
+
+@pytest.fixture(scope="module")
+def knowledge_base():
+    return load_default_knowledge_base()
+
+
+def _profile(weight_lbs=180, goals=('health',), restrictions=()):
+    return UserProfile(30, 5, 10, weight_lbs, 'male', 'moderate', goals, restrictions)
+
+
+@pytest.mark.parametrize("meals_per_day", [3, 4, 6])
+def test_feasible_day_lies_inside_the_windows(knowledge_base, meals_per_day):
+    planner = MealPlanCSP(knowledge_base.foods, _profile())
+    random.seed(1)
+    meal_plan = planner.generate_meal_plan(meals_per_day, engine="csp")
+
+    assert meal_plan.feasible
+    assert len(meal_plan) == meals_per_day
+    totals = planner._plan_totals(meal_plan)
+    for nutrient in NUTRIENTS:
+        bounds = planner.constraints[nutrient]
+        assert bounds['min'] - 1e-6 <= totals[nutrient] <= bounds['max'] + 1e-6
+    for _, meal in meal_plan:
+        assert len(set(meal)) == len(meal)  # No repeated food within a meal
+
+
+def test_impossible_windows_are_rejected_before_searching(knowledge_base):
+    # Keto foods cannot reach the carb minimum of a heavy muscle-gain profile
+    planner = MealPlanCSP(knowledge_base.foods, _profile(240, ('muscle gain',), ('keto',)))
+    start = time.perf_counter()
+    meal_plan = planner.generate_meal_plan(4, engine="csp")
+
+    assert time.perf_counter() - start < 0.5
+    assert not meal_plan.feasible
+    assert meal_plan.nodes_expanded == 0
+    assert not meal_plan.budget_exhausted
+    assert len(meal_plan) == 4  # The greedy fallback plan
+
+
+def test_hopeless_search_returns_within_the_deadline(knowledge_base):
+    # Passes the up-front check, but no day fits the windows: the search must give up on time
+    planner = MealPlanCSP(knowledge_base.foods, _profile(240, ('health',), ('keto',)))
+    random.seed(1)
+    start = time.perf_counter()
+    meal_plan = planner.generate_meal_plan(3, engine="csp", deadline_ms=100)
+
+    assert time.perf_counter() - start < 1.0
+    assert not meal_plan.feasible
+    assert meal_plan.budget_exhausted
@@ -0,0 +1,71 @@
+"""Tests for the ranked meal options of MealPlanCSP.enumerate_meal_options"""
+import itertools
+import random
+import time
+
+import pytest
+
+from fitai_core import MealPlanCSP, NUTRIENTS, UserProfile, load_default_knowledge_base, meal_template
+
+
+@pytest.fixture(scope="module")
+def knowledge_base():
+    return load_default_knowledge_base()
+
+
+def _profile(restrictions=()):
+    return UserProfile(30, 5, 10, 180, 'male', 'moderate', ('health',), restrictions)
+
+
+def _brute_force(planner, meal_type, targets, k, max_foods_per_meal=5):
+    # Score every combination of one value per slot, without repeated foods or duplicate food sets
+    scores = {}
+    for combination in itertools.product(*planner._meal_slots(meal_type, meal_template(meal_type))):
+        foods = [food_name for food_name in combination if food_name is not None]
+        if len(set(foods)) < len(foods) or len(foods) > max_foods_per_meal:
+            continue
+        totals = [sum(planner.foods[food_name][nutrient] for food_name in foods) for nutrient in NUTRIENTS]
+        scores[frozenset(foods)] = sum(((total - target) / max(target, 1)) ** 2
+                                       for total, target in zip(totals, targets))
+    return sorted(scores.values())[:k]
+
+
+@pytest.mark.parametrize("restrictions", [(), ('vegan',)])
+@pytest.mark.parametrize("meal_type", ["Breakfast", "Lunch", "Snack"])
+@pytest.mark.parametrize("targets", [(400, 20, 40, 10), (700, 40, 80, 25)])
+def test_options_match_brute_force(knowledge_base, restrictions, meal_type, targets):
+    planner = MealPlanCSP(knowledge_base.foods, _profile(restrictions))
+    options = planner.enumerate_meal_options(meal_type, *targets, k=5)
+
+    assert [score for score, _ in options] == pytest.approx(_brute_force(planner, meal_type, targets, 5))
+    for _, foods in options:
+        assert len(set(foods)) == len(foods) <= 5
+
+
+def test_large_fallback_pools_stay_fast(knowledge_base):
+    # None of these names are template picks, so every slot falls back to a whole category
+    rng = random.Random(0)
+    foods = {}
+    for i in range(2000):
+        food_name, nutrition = rng.choice(list(knowledge_base.foods.items()))
+        foods[f"{food_name} #{i}"] = {nutrient: round(amount * rng.uniform(0.6, 1.4), 1)
+                                      for nutrient, amount in nutrition.items()}
+    planner = MealPlanCSP(foods, _profile())
+    assert max(map(len, planner._meal_slots("Dinner", meal_template("Dinner")))) > 500
+
+    for meal_type in ("Breakfast", "Dinner", "Snack"):
+        start = time.perf_counter()
+        options = planner.enumerate_meal_options(meal_type, 700, 40, 70, 20, k=5)
+        assert time.perf_counter() - start < 2.0
+        assert len(options) == 5
+        assert options[0][0] < 0.05
+
+
+def test_node_budget_returns_best_found_so_far(knowledge_base):
+    planner = MealPlanCSP(knowledge_base.foods, _profile())
+    exact = planner.enumerate_meal_options("Dinner", 700, 40, 80, 25, k=5)
+    budgeted = planner.enumerate_meal_options("Dinner", 700, 40, 80, 25, k=5, node_limit=20)
+
+    scores = [score for score, _ in budgeted]
+    assert scores and scores == sorted(scores)
+    assert all(score >= best - 1e-12 for score, best in zip(scores, (score for score, _ in exact)))